@@ -26,6 +26,7 @@
 
 from collections import namedtuple
 import hashlib
+import itertools
 import struct
 
 from . import cashaddr
@@ -296,7 +297,9 @@ class ScriptOutput(namedtuple("ScriptAddressTuple", "script")):
         return '<ScriptOutput {}>'.format(self.__str__())
 
 
-# A namedtuple for easy comparison and unique hashing
+# A namedtuple for easy comparison and unique hashing.  The script, script hash and
+# string encodings are cached on the instance when first asked for; they are not part
+# of the tuple so do not affect comparison or hashing.
 class Address(namedtuple("AddressTuple", "hash160 kind")):
 
     # Address kinds
@@ -361,7 +364,10 @@ class Address(namedtuple("AddressTuple", "hash160 kind")):
         else:
             raise AddressError('unknown version byte: {}'.format(verbyte))
 
-        return cls(hash160_, kind)
+        address = cls(hash160_, kind)
+        # Base58 encodings are unique, so this is what to_string would give
+        address._strings = {(cls.FMT_BITCOIN, NetworkConstants.TESTNET): string}
+        return address
 
     @classmethod
     def is_valid(cls, string):
@@ -373,8 +379,16 @@ class Address(namedtuple("AddressTuple", "hash160 kind")):
 
     @classmethod
     def from_strings(cls, strings):
-        '''Construct a list from an iterable of strings.'''
-        return [cls.from_string(string) for string in strings]
+        '''Construct a list from an iterable of strings.  Repeated strings are
+        only decoded once, and give the same Address object.'''
+        decoded = {}
+        result = []
+        for string in strings:
+            address = decoded.get(string)
+            if address is None:
+                address = decoded[string] = cls.from_string(string)
+            result.append(address)
+        return result
 
     @classmethod
     def from_pubkey(cls, pubkey):
@@ -414,18 +428,28 @@ class Address(namedtuple("AddressTuple", "hash160 kind")):
 
     def to_string(self, fmt):
         '''Converts to a string of the given format.'''
-        if fmt == self.FMT_CASHADDR:
-            return self.to_cashaddr()
+        # The encodings depend on the network as well as the format
+        key = (fmt, NetworkConstants.TESTNET)
+        try:
+            return self._strings[key]
+        except AttributeError:
+            self._strings = {}
+        except KeyError:
+            pass
 
-        if fmt == self.FMT_BITCOIN:
+        if fmt == self.FMT_CASHADDR:
+            text = self.to_cashaddr()
+        elif fmt == self.FMT_BITCOIN:
             if self.kind == self.ADDR_P2PKH:
                 verbyte = NetworkConstants.ADDRTYPE_P2PKH
             else:
                 verbyte = NetworkConstants.ADDRTYPE_P2SH
+            text = Base58.encode_check(bytes([verbyte]) + self.hash160)
         else:
             raise AddressError('unrecognised format')
 
-        return Base58.encode_check(bytes([verbyte]) + self.hash160)
+        self._strings[key] = text
+        return text
 
     def to_full_string(self, fmt):
         '''Convert to text, with a URI prefix for cashaddr format.'''
@@ -458,10 +482,15 @@ class Address(namedtuple("AddressTuple", "hash160 kind")):
 
     def to_script(self):
         '''Return a binary script to pay to the address.'''
+        try:
+            return self._script
+        except AttributeError:
+            pass
         if self.kind == self.ADDR_P2PKH:
-            return Script.P2PKH_script(self.hash160)
+            self._script = Script.P2PKH_script(self.hash160)
         else:
-            return Script.P2SH_script(self.hash160)
+            self._script = Script.P2SH_script(self.hash160)
+        return self._script
 
     def to_script_hex(self):
         '''Return a script to pay to the address as a hex string.'''
@@ -473,7 +502,11 @@ class Address(namedtuple("AddressTuple", "hash160 kind")):
 
     def to_scripthash_hex(self):
         '''Like other bitcoin hashes this is reversed when written in hex.'''
-        return hash_to_hex_str(self.to_scripthash())
+        try:
+            return self._scripthash_hex
+        except AttributeError:
+            self._scripthash_hex = hash_to_hex_str(self.to_scripthash())
+            return self._scripthash_hex
 
     def __str__(self):
         return self.to_ui_string()
@@ -590,6 +623,15 @@ class Base58(object):
     chars = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
     assert len(chars) == 58
     cmap = {c: n for n, c in enumerate(chars)}
+    # Every two-character string, indexed by its value, for encoding two
+    # digits per division
+    pairs = [a + b for a, b in itertools.product(chars, repeat=2)]
+    # Maps ASCII bytes to digit values; invalid characters map to 0xff
+    decode_table = bytearray(b'\xff' * 256)
+    for c, n in cmap.items():
+        decode_table[ord(c)] = n
+    decode_table = bytes(decode_table)
+    del c, n
 
     @staticmethod
     def char_value(c):
@@ -607,18 +649,29 @@ class Base58(object):
         if not txt:
             raise Base58Error('string cannot be empty')
 
+        try:
+            digits = txt.encode('ascii').translate(Base58.decode_table)
+        except UnicodeEncodeError:
+            digits = b'\xff'
+        if 0xff in digits:
+            for c in txt:
+                Base58.char_value(c)
+
+        # Accumulate five digits at a time in a small int, so the big int
+        # is only touched once per chunk
+        start = len(digits) % 5 or 5
         value = 0
-        for c in txt:
-            value = value * 58 + Base58.char_value(c)
+        for d in digits[:start]:
+            value = value * 58 + d
+        for n in range(start, len(digits), 5):
+            a, b, c, d, e = digits[n:n + 5]
+            value = (value * 656356768
+                     + (((a * 58 + b) * 58 + c) * 58 + d) * 58 + e)
 
         result = int_to_bytes(value)
 
         # Prepend leading zero bytes if necessary
-        count = 0
-        for c in txt:
-            if c != '1':
-                break
-            count += 1
+        count = len(txt) - len(txt.lstrip('1'))
         if count:
             result = bytes(count) + result
 
@@ -629,17 +682,18 @@ class Base58(object):
         """Converts a big-endian bytearray into a base58 string."""
         value = bytes_to_int(be_bytes)
 
-        txt = ''
-        while value:
-            value, mod = divmod(value, 58)
-            txt += Base58.chars[mod]
-
-        for byte in be_bytes:
-            if byte != 0:
-                break
-            txt += '1'
-
-        return txt[::-1]
+        pairs = Base58.pairs
+        parts = []
+        while value >= 3364:
+            value, pair = divmod(value, 3364)
+            parts.append(pairs[pair])
+        parts.append(pairs[value])
+        parts.reverse()
+        # The most significant pair may have a leading zero digit
+        txt = ''.join(parts).lstrip('1')
+
+        count = len(be_bytes) - len(bytes(be_bytes).lstrip(b'\0'))
+        return '1' * count + txt
 
     @staticmethod
     def decode_check(txt):
@@ -27,6 +27,7 @@ import hashlib
 import base64
 import hmac
 import os
+import struct
 
 import ecdsa
 import pyaes
@@ -34,7 +35,7 @@ import pyaes
 from .networks import NetworkConstants
 from .util import (bfh, bh2u, to_string, InvalidPassword,
                    assert_bytes, to_bytes, inv_dict)
-from . import version
+from . import ecc_fast, version
 from .ecc_fast import do_monkey_patching_of_python_ecdsa_internals_with_libsecp256k1
 
 do_monkey_patching_of_python_ecdsa_internals_with_libsecp256k1()
@@ -165,6 +166,18 @@ def var_int(i):
         return "ff"+int_to_hex(i,8)
 
 
+def var_int_bytes(i):
+    '''Bytes form of var_int.'''
+    if i<0xfd:
+        return bytes((i, ))
+    elif i<=0xffff:
+        return b'\xfd' + struct.pack('<H', i)
+    elif i<=0xffffffff:
+        return b'\xfe' + struct.pack('<I', i)
+    else:
+        return b'\xff' + struct.pack('<Q', i)
+
+
 def op_push(i):
     if i<0x4c:
         return int_to_hex(i)
@@ -313,9 +326,7 @@ def base_encode(v, base):
     chars = __b58chars
     if base == 43:
         chars = __b43chars
-    long_value = 0
-    for (i, c) in enumerate(v[::-1]):
-        long_value += (256**i) * c
+    long_value = int.from_bytes(v, 'big')
     result = bytearray()
     while long_value >= base:
         div, mod = divmod(long_value, base)
@@ -344,8 +355,8 @@ def base_decode(v, length, base):
     if base == 43:
         chars = __b43chars
     long_value = 0
-    for (i, c) in enumerate(v[::-1]):
-        long_value += chars.find(bytes([c])) * (base**i)
+    for c in v:
+        long_value = long_value * base + chars.find(c)
     result = bytearray()
     while long_value >= 256:
         div, mod = divmod(long_value, 256)
@@ -541,6 +552,11 @@ class MyVerifyingKey(ecdsa.VerifyingKey):
     @classmethod
     def from_signature(klass, sig, recid, h, curve):
         """ See http://www.secg.org/download/aid-780/sec1-v2.pdf, chapter 4.1.6 """
+        if curve is SECP256k1 and ecc_fast.is_recovery_available():
+            public_key = ecc_fast.recover_pubkeys_batch([(sig, recid, h)])[0]
+            if public_key is None:
+                raise Exception("cannot recover public key")
+            return klass.from_public_point(ser_to_point(public_key), curve)
         from ecdsa import util, numbertheory
         from . import msqr
         curveFp = curve.curve
@@ -593,6 +609,65 @@ class MySigningKey(ecdsa.SigningKey):
         return r, s
 
 
+def sign_digests(digests, secrets, compressions):
+    '''Sign each 32 byte digest with the matching 32 byte secret.  Returns (DER
+    signature, public key) pairs with the public key serialized compressed or not.
+    Signatures are deterministic with low S values, so they are the same whether or
+    not libsecp256k1 is available.'''
+    if ecc_fast.is_batch_available():
+        return ecc_fast.sign_digests_batch(digests, secrets, compressions)
+    results = []
+    for digest, secret, compressed in zip(digests, secrets, compressions):
+        private_key = MySigningKey.from_secret_exponent(string_to_number(secret),
+                                                        curve = SECP256k1)
+        public_key = private_key.get_verifying_key()
+        sig = private_key.sign_digest_deterministic(
+            digest, hashfunc=hashlib.sha256, sigencode = ecdsa.util.sigencode_der)
+        assert public_key.verify_digest(sig, digest, sigdecode=ecdsa.util.sigdecode_der)
+        results.append((sig, GetPubKey(public_key.pubkey, compressed)))
+    return results
+
+
+def verify_digests(items):
+    '''Takes (digest, DER signature, public key) triples and returns whether each
+    signature is valid.'''
+    if ecc_fast.is_batch_available():
+        return ecc_fast.verify_digests_batch(items)
+    results = []
+    for digest, der_sig, public_key in items:
+        try:
+            key = ecdsa.VerifyingKey.from_public_point(ser_to_point(public_key),
+                                                       curve = SECP256k1)
+            results.append(key.verify_digest(der_sig, digest,
+                                             sigdecode=ecdsa.util.sigdecode_der))
+        except Exception:
+            results.append(False)
+    return results
+
+
+def recover_public_keys(sig_string, h):
+    '''Returns the uncompressed public keys recovered from a 64 byte signature of the
+    digest h for each of the four recovery ids, or None where there is none.'''
+    if ecc_fast.is_recovery_available():
+        return ecc_fast.recover_pubkeys_batch([(sig_string, recid, h)
+                                               for recid in range(4)])
+    results = []
+    for recid in range(4):
+        try:
+            public_key = MyVerifyingKey.from_signature(sig_string, recid, h,
+                                                       curve = SECP256k1)
+        except Exception:
+            results.append(None)
+        else:
+            results.append(point_to_ser(public_key.pubkey.point, False))
+    return results
+
+
+def compress_public_key(public_key):
+    '''Compress a 65 byte uncompressed public key.'''
+    return bytes([2 + (public_key[64] & 1)]) + public_key[1:33]
+
+
 class EC_KEY(object):
 
     def __init__( self, k ):
@@ -608,13 +683,11 @@ class EC_KEY(object):
         return bh2u(point_to_ser(self.pubkey.point, compressed))
 
     def sign(self, msg_hash):
-        private_key = MySigningKey.from_secret_exponent(self.secret, curve = SECP256k1)
-        public_key = private_key.get_verifying_key()
-        signature = private_key.sign_digest_deterministic(
-            msg_hash, hashfunc=hashlib.sha256, sigencode = ecdsa.util.sigencode_string)
-        assert public_key.verify_digest(signature, msg_hash,
-                                        sigdecode=ecdsa.util.sigdecode_string)
-        return signature
+        order = generator_secp256k1.order()
+        der_sig, public_key = sign_digests([msg_hash], [number_to_string(self.secret, order)],
+                                           [True])[0]
+        r, s = ecdsa.util.sigdecode_der(der_sig, order)
+        return ecdsa.util.sigencode_string(r, s, order)
 
     def sign_message(self, message, is_compressed):
         message = to_bytes(message, 'utf8')
@@ -733,17 +806,38 @@ def _CKD_priv(k, c, s, is_prime):
 # n = index of key we want to derive
 # This function allows us to find the nth public key, as long as n is
 #  non-negative. If n is negative, we need the master private key to find it.
-def CKD_pub(cK, c, n):
+def CKD_pub(cK, c, n, point=None):
+    # point, if given, is cK already decoded to a curve point
     if n & BIP32_PRIME:
         raise Exception("presumably negative")
-    return _CKD_pub(cK, c, bfh(rev_hex(int_to_hex(n,4))))
+    return _CKD_pub(cK, c, bfh(rev_hex(int_to_hex(n,4))), point)
+
+def CKD_pub_batch(cK, c, ns, point=None):
+    '''CKD_pub for each of the indexes ns, sharing the work on the parent key.'''
+    if not ecc_fast.is_batch_available():
+        if point is None:
+            point = ser_to_point(cK)
+        return [CKD_pub(cK, c, n, point) for n in ns]
+    Is = []
+    for n in ns:
+        if n & BIP32_PRIME:
+            raise Exception("presumably negative")
+        Is.append(hmac.new(c, cK + n.to_bytes(4, 'big'), hashlib.sha512).digest())
+    results = []
+    for cK_n, I in zip(ecc_fast.pubkey_tweak_add_batch(cK, [I[0:32] for I in Is]), Is):
+        if cK_n is None:
+            raise Exception("invalid child key")
+        results.append((cK_n, I[32:]))
+    return results
 
 # helper function, callable with arbitrary string
-def _CKD_pub(cK, c, s):
+def _CKD_pub(cK, c, s, point=None):
     order = generator_secp256k1.order()
     I = hmac.new(c, cK + s, hashlib.sha512).digest()
     curve = SECP256k1
-    pubkey_point = string_to_number(I[0:32])*curve.generator + ser_to_point(cK)
+    if point is None:
+        point = ser_to_point(cK)
+    pubkey_point = string_to_number(I[0:32])*curve.generator + point
     public_key = ecdsa.VerifyingKey.from_public_point( pubkey_point, curve = SECP256k1 )
     c_n = I[32:]
     cK_n = GetPubKey(public_key.pubkey,True)
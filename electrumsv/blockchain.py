@@ -21,9 +21,13 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+from collections import OrderedDict
 import logging
+import mmap
 import os
+import re
 import threading
+import time
 
 from . import util
 from .networks import NetworkConstants
@@ -109,20 +113,46 @@ def hash_header(header):
 
 blockchains = {}
 
+FORK_FILENAME = re.compile(r'fork_(\d+)_(\d+)$')
+SWAP_FILENAME = re.compile(r'swap_(\d+)_(\d+)$')
+
 def read_blockchains(config):
     blockchains[0] = Blockchain(config, 0, None)
     fdir = os.path.join(util.get_headers_dir(config), 'forks')
     if not os.path.exists(fdir):
         os.mkdir(fdir)
-    l = [x for x in os.listdir(fdir) if x.startswith('fork_')]
-    l = sorted(l, key = lambda x: int(x.split('_')[1]))
-    for filename in l:
-        parent_base_height = int(filename.split('_')[1])
-        base_height = int(filename.split('_')[2])
+    filenames = os.listdir(fdir)
+    l = [m for m in map(FORK_FILENAME.match, filenames) if m]
+    l = sorted(l, key = lambda m: int(m.group(1)))
+    for m in l:
+        filename = m.group(0)
+        parent_base_height = int(m.group(1))
+        base_height = int(m.group(2))
         b = Blockchain(config, base_height, parent_base_height)
+        if b.size() == 0:
+            # Interrupted before its first header was written
+            logger.error("removing empty fork %s", filename)
+            if os.path.exists(b.path()):
+                os.remove(b.path())
+            continue
         blockchains[b.base_height] = b
+    for filename in filenames:
+        if filename.startswith('swap_'):
+            recover_swap(os.path.join(fdir, filename))
     return blockchains
 
+def recover_swap(swap_path):
+    '''Finish a swap with the parent branch that was interrupted.  A swap file that was
+    not completely written is dropped, as neither branch has been changed yet.'''
+    m = SWAP_FILENAME.match(os.path.basename(swap_path))
+    b = m and blockchains.get(int(m.group(2)))
+    if b is None or b.parent_base_height != int(m.group(1)):
+        logger.error("removing unfinished swap file %s", swap_path)
+        os.remove(swap_path)
+        return
+    logger.error("finishing interrupted swap %s", swap_path)
+    b.finish_swap(swap_path)
+
 def check_header(header):
     if type(header) is not dict:
         return False
@@ -165,6 +195,17 @@ def root_from_proof(hash_, branch, index):
         raise ValueError('index out of range for branch')
     return hash_
 
+def copy_file_range(src, src_offset, dst, dst_offset, length, block_size=1 << 20):
+    '''Copy length bytes between open files, a block at a time.'''
+    src.seek(src_offset)
+    dst.seek(dst_offset)
+    while length > 0:
+        data = src.read(min(block_size, length))
+        if not data:
+            break
+        dst.write(data)
+        length -= len(data)
+
 class HeaderChunk:
     def __init__(self, base_height, data):
         self.base_height = base_height
@@ -193,16 +234,33 @@ class HeaderChunk:
 class Blockchain:
     """
     Manages blockchain headers and their verification
+
+    The headers file is read through a memory map, and the most recently read
+    headers are kept deserialized along with their hashes.
+
+    Headers appended to the end of the file are buffered, and written and synced
+    together once enough have built up or the oldest has waited long enough.  Until
+    then they are read from the buffer.
     """
 
+    max_cached_headers = 500
+    flush_size = 2016 * HEADER_SIZE
+    flush_interval = 5.0 # seconds
+
     def __init__(self, config, base_height, parent_base_height):
         self.config = config
         self.catch_up = None # interface catching up
         self.base_height = base_height
         self.parent_base_height = parent_base_height
+        self._mmap = None
+        # height -> (header, header hash)
+        self._header_cache = OrderedDict()
+        self._write_buffer = bytearray()
+        self._buffer_time = None
 
         self.lock = threading.Lock()
         with self.lock:
+            self.recover()
             self.update_size()
 
     def parent(self):
@@ -227,11 +285,20 @@ class Blockchain:
         height = header.get('block_height')
         return header_hash == self.get_hash(height)
 
+    def close_mmap(self):
+        '''Drop the memory map of the headers file, for example before it is written,
+        truncated or renamed.  The next read maps it again.  Callers hold the lock.'''
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
     def fork(self, header):
         base_height = header.get('block_height')
         child = Blockchain(self.config, base_height, self.base_height)
         open(child.path(), 'w+').close()
         child.save_header(header)
+        # A fork file is never left without its first header
+        child.flush()
         return child
 
     def height(self):
@@ -241,13 +308,57 @@ class Blockchain:
         with self.lock:
             return self._size
 
+    def recover(self):
+        '''Truncate the headers file to the last valid header.  An interrupted write
+        can leave a partial header, or headers that were never filled in, at the end of
+        the file.  Callers hold the lock.'''
+        p = self.path()
+        if not os.path.exists(p):
+            return
+        file_size = os.path.getsize(p)
+        size = file_size - file_size % HEADER_SIZE
+        # The main chain is sparse up to the checkpoint
+        min_size = 0
+        if self.parent_base_height is None:
+            if NetworkConstants.VERIFICATION_BLOCK_HEIGHT is None:
+                min_size = size
+            else:
+                min_size = (NetworkConstants.VERIFICATION_BLOCK_HEIGHT + 1) * HEADER_SIZE
+        with open(p, 'rb+') as f:
+            while size > min_size:
+                f.seek(size - HEADER_SIZE)
+                header_data = f.read(HEADER_SIZE)
+                if header_data == bytes(HEADER_SIZE):
+                    size -= HEADER_SIZE
+                    continue
+                if size - HEADER_SIZE > min_size:
+                    f.seek(size - 2 * HEADER_SIZE)
+                    prev_data = f.read(HEADER_SIZE)
+                    if Hash(prev_data) != header_data[4:36]:
+                        size -= HEADER_SIZE
+                        continue
+                break
+            if size != file_size:
+                logger.error("truncating %s from %d to %d bytes", p, file_size, size)
+                f.truncate(size)
+                f.flush()
+                os.fsync(f.fileno())
+        if size == 0 and self.parent_base_height is not None:
+            # A fork with no valid headers is not a fork at all
+            logger.error("removing %s, it has no valid headers", p)
+            os.remove(p)
+
     def update_size(self):
         p = self.path()
         self._size = os.path.getsize(p)//HEADER_SIZE if os.path.exists(p) else 0
+        # The file has changed, so the map may be too short and cached headers stale
+        self.close_mmap()
+        self._header_cache.clear()
 
     def verify_header(self, header, prev_header, bits=None):
-        prev_header_hash = hash_header(prev_header)
-        this_header_hash = hash_header(header)
+        self._verify_header(header, hash_header(prev_header), hash_header(header), bits)
+
+    def _verify_header(self, header, prev_header_hash, this_header_hash, bits):
         if prev_header_hash != header.get('prev_block_hash'):
             raise VerifyError("prev hash mismatch: %s vs %s" %
                               (prev_header_hash, header.get('prev_block_hash')))
@@ -257,9 +368,9 @@ class Blockchain:
         if bits is not None:
             # checkpoint BitcoinCash fork block
             if (header.get('block_height') == NetworkConstants.BITCOIN_CASH_FORK_BLOCK_HEIGHT and
-                    hash_header(header) != NetworkConstants.BITCOIN_CASH_FORK_BLOCK_HASH):
+                    this_header_hash != NetworkConstants.BITCOIN_CASH_FORK_BLOCK_HASH):
                 raise VerifyError("block at height %i is not cash chain fork block. hash %s" %
-                                  (header.get('block_height'), hash_header(header)))
+                                  (header.get('block_height'), this_header_hash))
             if bits != header.get('bits'):
                 raise VerifyError("bits mismatch: %s vs %s" % (bits, header.get('bits')))
             target = bits_to_target(bits)
@@ -273,14 +384,16 @@ class Blockchain:
         prev_header = None
         if chunk_base_height != 0:
             prev_header = self.read_header(chunk_base_height - 1)
+        prev_header_hash = hash_header(prev_header)
 
-        header_count = len(chunk_data) // HEADER_SIZE
-        for i in range(header_count):
+        # Check the chain of hashes and the difficulty.
+        chunk_bits = self.get_chunk_bits(chunk)
+        for i, bits in enumerate(chunk_bits):
             header = chunk.get_header_at_index(i)
-            # Check the chain of hashes and the difficulty.
-            bits = self.get_bits(header, chunk)
-            self.verify_header(header, prev_header, bits)
-            prev_header = header
+            raw_header = chunk_data[i * HEADER_SIZE : (i + 1) * HEADER_SIZE]
+            this_header_hash = hash_encode(Hash(raw_header))
+            self._verify_header(header, prev_header_hash, this_header_hash, bits)
+            prev_header_hash = this_header_hash
 
     def path(self):
         d = util.get_headers_dir(self.config)
@@ -311,13 +424,21 @@ class Blockchain:
         parent_base_height = self.parent_base_height
         base_height = self.base_height
         parent = self.parent()
-        with open(self.path(), 'rb') as f:
-            my_data = f.read()
-        with open(parent.path(), 'rb') as f:
-            f.seek((base_height - parent.base_height)*HEADER_SIZE)
-            parent_data = f.read(parent_branch_size*HEADER_SIZE)
-        self.write(parent_data, 0)
-        parent.write(my_data, (base_height - parent.base_height)*HEADER_SIZE)
+        parent_offset = (base_height - parent.base_height)*HEADER_SIZE
+        for b in blockchains.values():
+            b.flush()
+        # Copy the parent's headers above the fork point aside, put ours in their place
+        # and make the copy ours.  Neither branch is read into memory whole.  Once the
+        # copy is complete under its final name the swap is finished on the next start
+        # if it is interrupted.
+        swap_path = os.path.join(os.path.dirname(self.path()),
+                                 'swap_%d_%d' % (parent_base_height, base_height))
+        with open(parent.path(), 'rb') as f, open(swap_path + '.tmp', 'wb') as swap_file:
+            copy_file_range(f, parent_offset, swap_file, 0, parent_branch_size*HEADER_SIZE)
+            swap_file.flush()
+            os.fsync(swap_file.fileno())
+        os.replace(swap_path + '.tmp', swap_path)
+        self.finish_swap(swap_path)
         # store file path
         for b in blockchains.values():
             b.old_path = b.path()
@@ -326,22 +447,56 @@ class Blockchain:
         parent.parent_base_height = parent_base_height
         self.base_height = parent.base_height
         parent.base_height = base_height
-        self._size = parent._size
-        parent._size = parent_branch_size
+        with self.lock:
+            self.update_size()
+        with parent.lock:
+            parent.update_size()
         # move files
         for b in blockchains.values():
             if b in [self, parent]: continue
             if b.old_path != b.path():
                 logger.debug("renaming %s %s", b.old_path, b.path())
-                os.rename(b.old_path, b.path())
+                with b.lock:
+                    b.close_mmap()
+                    os.rename(b.old_path, b.path())
         # update pointers
         blockchains[self.base_height] = self
         blockchains[parent.base_height] = parent
 
+    def finish_swap(self, swap_path):
+        '''Overwrite the parent's headers above the fork point with ours, then replace
+        ours with the parent's old headers, which were copied to swap_path.  Both steps
+        can be repeated, so an interrupted swap is finished by calling this again.'''
+        parent = self.parent()
+        parent_offset = (self.base_height - parent.base_height)*HEADER_SIZE
+        with parent.lock:
+            parent.close_mmap()
+            with open(self.path(), 'rb') as f, open(parent.path(), 'rb+') as parent_file:
+                parent_file.truncate(parent_offset)
+                copy_file_range(f, 0, parent_file, parent_offset, self.size()*HEADER_SIZE)
+                parent_file.flush()
+                os.fsync(parent_file.fileno())
+        with self.lock:
+            self.close_mmap()
+            os.replace(swap_path, self.path())
+            self.update_size()
+        with parent.lock:
+            parent.update_size()
+
     def write(self, data, offset, truncate=True):
-        filename = self.path()
         with self.lock:
-            with open(filename, 'rb+') as f:
+            if offset == self._size*HEADER_SIZE:
+                # Appends are buffered
+                if not self._write_buffer:
+                    self._buffer_time = time.time()
+                self._write_buffer.extend(data)
+                self._size += len(data) // HEADER_SIZE
+                if len(self._write_buffer) >= self.flush_size:
+                    self._flush()
+                return
+            self._flush()
+            self.close_mmap()
+            with open(self.path(), 'rb+') as f:
                 if truncate and offset != self._size*HEADER_SIZE:
                     f.seek(offset)
                     f.truncate()
@@ -351,6 +506,32 @@ class Blockchain:
                 os.fsync(f.fileno())
             self.update_size()
 
+    def flush(self):
+        '''Write and sync any buffered headers.'''
+        with self.lock:
+            self._flush()
+
+    def flush_if_due(self):
+        '''Write and sync any buffered headers if the oldest has waited long enough.'''
+        with self.lock:
+            if (self._write_buffer and
+                    time.time() - self._buffer_time >= self.flush_interval):
+                self._flush()
+
+    def _flush(self):
+        if not self._write_buffer:
+            return
+        offset = self._size*HEADER_SIZE - len(self._write_buffer)
+        with open(self.path(), 'rb+') as f:
+            f.seek(offset)
+            f.write(self._write_buffer)
+            f.flush()
+            os.fsync(f.fileno())
+        self._write_buffer = bytearray()
+        self._buffer_time = None
+        # The map does not cover the headers that were just written
+        self.close_mmap()
+
     def save_header(self, header):
         delta = header.get('block_height') - self.base_height
         data = bfh(serialize_header(header))
@@ -370,25 +551,53 @@ class Blockchain:
             return
         if height < self.base_height:
             return self.parent().read_header(height)
-        if height > self.height():
-            return
-        delta = height - self.base_height
-        name = self.path()
-        if os.path.exists(name):
-            with open(name, 'rb') as f:
-                f.seek(delta * HEADER_SIZE)
-                h = f.read(HEADER_SIZE)
-            # Is it a pre-checkpoint header that has never been requested?
-            if h == bytes([0])*HEADER_SIZE:
-                return None
-            return deserialize_header(h, height)
+        with self.lock:
+            entry = self._read_cached_header(height)
+        return entry[0] if entry is not None else None
+
+    def _read_cached_header(self, height):
+        '''Returns (header, header hash) or None.  Callers hold the lock and have
+        checked that the height is not below this blockchain's base height.'''
+        entry = self._header_cache.get(height)
+        if entry is not None:
+            self._header_cache.move_to_end(height)
+            return entry
+        if height >= self.base_height + self._size:
+            return None
+        offset = (height - self.base_height) * HEADER_SIZE
+        buffer_offset = self._size*HEADER_SIZE - len(self._write_buffer)
+        if offset >= buffer_offset:
+            offset -= buffer_offset
+            h = bytes(self._write_buffer[offset : offset + HEADER_SIZE])
+        else:
+            if self._mmap is None:
+                name = self.path()
+                if not os.path.exists(name):
+                    return None
+                with open(name, 'rb') as f:
+                    self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            h = self._mmap[offset : offset + HEADER_SIZE]
+        # Is it a pre-checkpoint header that has never been requested?
+        if h == bytes([0])*HEADER_SIZE:
+            return None
+        entry = (deserialize_header(h, height), hash_encode(Hash(h)))
+        self._header_cache[height] = entry
+        if len(self._header_cache) > self.max_cached_headers:
+            self._header_cache.popitem(last=False)
+        return entry
 
     def get_hash(self, height):
         if height == -1:
             return '0000000000000000000000000000000000000000000000000000000000000000'
         elif height == 0:
             return NetworkConstants.GENESIS
-        return hash_header(self.read_header(height))
+        if height < 0:
+            return hash_header(None)
+        if height < self.base_height:
+            return self.parent().get_hash(height)
+        with self.lock:
+            entry = self._read_cached_header(height)
+        return entry[1] if entry is not None else hash_header(None)
 
     # Not used.
     def BIP9(self, height, flag):
@@ -502,6 +711,67 @@ class Blockchain:
 
         return target_to_bits(target)
 
+    def get_chunk_bits(self, chunk):
+        '''Return the bits expected for each header in the chunk.
+
+        This gives the same result as calling get_bits() for each header.  But for
+        headers under the November 2017 DAA it reads the 147 headers preceding the chunk
+        once and works over arrays, rather than reading around 150 headers from disk for
+        every header in the chunk.
+        '''
+        base_height = chunk.base_height
+        first_height = base_height - 147
+        prior_headers = ([self.read_header(height)
+                          for height in range(first_height, base_height)]
+                         if first_height >= 0 else [None])
+        if None in prior_headers:
+            return [self.get_bits(header, chunk) for header in chunk.headers]
+
+        headers = prior_headers + chunk.headers
+        timestamps = [header['timestamp'] for header in headers]
+        # cumulative_work[i] is the total work of the first i headers
+        cumulative_work = [0]
+        for header in headers:
+            cumulative_work.append(cumulative_work[-1] + bits_to_work(header['bits']))
+
+        def suitable_index(i):
+            # The median of the timestamps of the three headers ending at index i.
+            # This mirrors get_suitable_block_height.
+            blocks2, blocks1, blocks = i, i - 1, i - 2
+            if timestamps[blocks] > timestamps[blocks2]:
+                blocks, blocks2 = blocks2, blocks
+            if timestamps[blocks] > timestamps[blocks1]:
+                blocks, blocks1 = blocks1, blocks
+            if timestamps[blocks1] > timestamps[blocks2]:
+                blocks1, blocks2 = blocks2, blocks1
+            return blocks1
+
+        result = []
+        for i in range(147, len(headers)):
+            header = headers[i]
+            prior_index = i - 1
+            daa_mtp = sorted(timestamps[prior_index - 10 : i])[5]
+            if daa_mtp < 1510600000:
+                result.append(self.get_bits(header, chunk))
+                continue
+            if (NetworkConstants.TESTNET and
+                    header['timestamp'] - timestamps[prior_index] > 20*60):
+                result.append(MAX_BITS)
+                continue
+
+            starting_index = suitable_index(prior_index - 144)
+            ending_index = suitable_index(prior_index)
+            # Work EXcluding the starting block, INcluding the ending block
+            daa_cumulative_work = (cumulative_work[ending_index + 1] -
+                                   cumulative_work[starting_index + 1])
+            daa_elapsed_time = timestamps[ending_index] - timestamps[starting_index]
+            daa_elapsed_time = min(max(daa_elapsed_time, 43200), 172800)
+
+            daa_Wn = (daa_cumulative_work*600) // daa_elapsed_time
+            daa_target = (1 << 256) // daa_Wn - 1
+            result.append(int(target_to_bits(daa_target)))
+        return result
+
     def get_new_bits(self, height, chunk=None):
         assert height % 2016 == 0
         # Genesis
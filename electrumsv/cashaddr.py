@@ -21,24 +21,60 @@
 
 _CHARSET = "qpzry9x8gf2tvdw0s3jn54khce6mua7l"
 
+# Translation tables between 5-bit values and charset bytes.  Bytes not in
+# the charset decode to 0xff.
+_ENCODE_TABLE = bytes(_CHARSET.encode('ascii') + bytes(224))
+_DECODE_TABLE = bytearray(b'\xff' * 256)
+for _n, _c in enumerate(_CHARSET.encode('ascii')):
+    _DECODE_TABLE[_c] = _n
+_DECODE_TABLE = bytes(_DECODE_TABLE)
+
+_GENERATORS = (0x98f2bc8e61, 0x79b76d99e2, 0xf33e5fb3c4, 0xae2eabe2a8,
+               0x1e4f43e470)
+
+def _polymod_table(steps):
+    """The generator terms folded into the checksum by STEPS values for each
+    possible combination of the checksum's top 5 * STEPS bits."""
+    table = []
+    for top in range(1 << (5 * steps)):
+        c = top << (40 - 5 * steps)
+        for _ in range(steps):
+            c0 = c >> 35
+            c = (c & 0x07ffffffff) << 5
+            for i, generator in enumerate(_GENERATORS):
+                if c0 & (1 << i):
+                    c ^= generator
+        table.append(c)
+    return table
+
+_POLYMOD_TABLE = _polymod_table(1)
+_POLYMOD_TABLE2 = _polymod_table(2)
+# Checksum states after the expanded prefix, keyed by prefix
+_prefix_states = {}
+
+def _polymod_update(c, values):
+    """Feed values into checksum state c, two values at a time."""
+    it = iter(values)
+    if len(values) & 1:
+        c = ((c & 0x07ffffffff) << 5) ^ next(it) ^ _POLYMOD_TABLE[c >> 35]
+    table = _POLYMOD_TABLE2
+    for a, b in zip(it, it):
+        c = ((c & 0x3fffffff) << 10) ^ (a << 5) ^ b ^ table[c >> 30]
+    return c
+
 def _polymod(values):
     """Internal function that computes the cashaddr checksum."""
-    c = 1
-    for d in values:
-        c0 = c >> 35
-        c = ((c & 0x07ffffffff) << 5) ^ d
-        if c0 & 0x01:
-            c ^= 0x98f2bc8e61
-        if c0 & 0x02:
-            c ^= 0x79b76d99e2
-        if c0 & 0x04:
-            c ^= 0xf33e5fb3c4
-        if c0 & 0x08:
-            c ^= 0xae2eabe2a8
-        if c0 & 0x10:
-            c ^= 0x1e4f43e470
-    retval= c ^ 1
-    return retval
+    return _polymod_update(1, values) ^ 1
+
+def _prefix_state(prefix):
+    """The checksum state after the expanded prefix, cached as there are
+    only ever a few prefixes in use."""
+    state = _prefix_states.get(prefix)
+    if state is None:
+        state = _polymod_update(1, _prefix_expand(prefix))
+        if len(_prefix_states) < 16:
+            _prefix_states[prefix] = state
+    return state
 
 def _prefix_expand(prefix):
     """Expand the prefix into values for checksum computation."""
@@ -49,8 +85,7 @@ def _prefix_expand(prefix):
 
 def _create_checksum(prefix, data):
     """Compute the checksum values given prefix and data."""
-    values = _prefix_expand(prefix) + data + bytes(8)
-    polymod = _polymod(values)
+    polymod = _polymod_update(_prefix_state(prefix), data + bytes(8)) ^ 1
     # Return the polymod expanded into eight 5-bit elements
     return bytes((polymod >> 5 * (7 - i)) & 31 for i in range(8))
 
@@ -73,6 +108,36 @@ def _convertbits(data, frombits, tobits, pad=True):
 
     return ret
 
+def _bytes_to_5bit(data):
+    """Split bytes into 5-bit values, zero-padding the last one.  The same
+    as _convertbits(data, 8, 5, True) but done 40 bits at a time."""
+    nbits = len(data) * 8
+    count = (nbits + 4) // 5
+    pad = -nbits % 40
+    blob = (int.from_bytes(data, 'big') << pad).to_bytes((nbits + pad) // 8,
+                                                        'big')
+    ret = bytearray()
+    for i in range(0, len(blob), 5):
+        w = int.from_bytes(blob[i:i + 5], 'big')
+        ret += bytes((w >> 35, (w >> 30) & 31, (w >> 25) & 31,
+                      (w >> 20) & 31, (w >> 15) & 31, (w >> 10) & 31,
+                      (w >> 5) & 31, w & 31))
+    del ret[count:]
+    return ret
+
+def _5bit_to_bytes(data):
+    """Join 5-bit values into bytes, dropping incomplete trailing bits.  The
+    same as _convertbits(data, 5, 8, False) but done 40 bits at a time."""
+    value = 0
+    for i in range(0, len(data), 8):
+        chunk = data[i:i + 8]
+        w = 0
+        for d in chunk:
+            w = (w << 5) | d
+        value = (value << (5 * len(chunk))) | w
+    nbits = len(data) * 5
+    return (value >> (nbits % 8)).to_bytes(nbits // 8, 'big')
+
 def _pack_addr_data(kind, addr_hash):
     """Pack addr data with version byte"""
     version_byte = kind << 3
@@ -92,7 +157,7 @@ def _pack_addr_data(kind, addr_hash):
     version_byte |= encoded_size
 
     data = bytes([version_byte]) + addr_hash
-    return _convertbits(data, 8, 5, True)
+    return _bytes_to_5bit(data)
 
 
 def _decode_payload(addr):
@@ -122,12 +187,14 @@ def _decode_payload(addr):
         raise ValueError('address payload has invalid length: {}'
                          .format(len(addr)))
     try:
-        data = bytes(_CHARSET.find(x) for x in payload)
-    except ValueError:
+        data = payload.encode('ascii').translate(_DECODE_TABLE)
+    except UnicodeEncodeError:
+        data = b'\xff'
+    if 0xff in data:
         raise ValueError('invalid characters in address: {}'
                             .format(payload))
 
-    if _polymod(_prefix_expand(prefix) + data):
+    if _polymod_update(_prefix_state(prefix), data) ^ 1:
         raise ValueError('invalid checksum in address: {}'.format(addr))
 
     if lower != addr:
@@ -162,7 +229,7 @@ def decode(address):
     if payload[-1] & ((1 << extrabits) - 1):
         raise ValueError('non-zero padding in address {}'.format(address))
 
-    decoded = _convertbits(payload, 5, 8, False)
+    decoded = _5bit_to_bytes(payload)
     version = decoded[0]
     addr_hash = bytes(decoded[1:])
     size = (version & 0x03) * 4 + 20
@@ -193,7 +260,7 @@ def encode(prefix, kind, addr_hash):
 
     payload = _pack_addr_data(kind, addr_hash)
     checksum = _create_checksum(prefix, payload)
-    return ''.join([ _CHARSET[d] for d in payload + checksum ])
+    return (payload + checksum).translate(_ENCODE_TABLE).decode('ascii')
 
 
 def encode_full(prefix, kind, addr_hash):
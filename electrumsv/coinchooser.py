@@ -26,6 +26,7 @@
 from collections import defaultdict, namedtuple
 import logging
 from math import floor, log10
+import time
 
 from .bitcoin import sha256, COIN, TYPE_ADDRESS
 from .transaction import Transaction
@@ -34,6 +35,9 @@ from .util import NotEnoughFunds
 
 logger = logging.getLogger("coinchooser")
 
+# The serialized size of a pay-to-bitcoin-address output, as used for change
+P2PKH_OUTPUT_SIZE = 34
+
 
 # A simple deterministic PRNG.  Used to deterministically shuffle a
 # set of coins - the same set of coins should produce the same output.
@@ -186,6 +190,12 @@ class CoinChooserBase:
         base_size = tx.estimated_size()
         spent_amount = tx.output_value()
 
+        # Kept for choosers that weigh buckets by their value net of fees
+        self.base_size = base_size
+        self.spent_amount = spent_amount
+        self.fee_estimator = fee_estimator
+        self.dust_threshold = dust_threshold
+
         def sufficient_funds(buckets):
             '''Given a list of buckets, return True if it has enough
             value to pay for the transaction'''
@@ -201,9 +211,8 @@ class CoinChooserBase:
         tx.add_inputs([coin for b in buckets for coin in b.coins])
         tx_size = base_size + sum(bucket.size for bucket in buckets)
 
-        # This takes a count of change outputs and returns a tx fee;
-        # each pay-to-bitcoin-address output serializes as 34 bytes
-        fee = lambda count: fee_estimator(tx_size + count * 34)
+        # This takes a count of change outputs and returns a tx fee
+        fee = lambda count: fee_estimator(tx_size + count * P2PKH_OUTPUT_SIZE)
         change, dust = self.change_outputs(tx, change_addrs, fee, dust_threshold)
         tx.add_outputs(change)
         tx.ephemeral['dust_to_fee'] = dust
@@ -286,3 +295,105 @@ class CoinChooserPrivacy(CoinChooserRandom):
             return badness
 
         return penalty
+
+
+class CoinChooserBranchAndBound(CoinChooserPrivacy):
+    '''Searches for a set of buckets that pays the outputs and fee without
+    leaving change worth keeping, so no change output is needed.  Buckets are
+    weighed by their effective value, their value less the fee to spend them,
+    and explored depth first from the largest, abandoning a branch as soon as
+    it overshoots or can no longer reach the target.  Of the changeless sets
+    found within the try and time budgets, the one wasting least to fees
+    wins.  If there is none, the privacy chooser picks the buckets instead.'''
+
+    max_tries = 100000
+    # Seconds
+    time_budget = 0.25
+
+    def effective_values(self, buckets):
+        base_fee = self.fee_estimator(self.base_size)
+        return [bucket.value
+                - (self.fee_estimator(self.base_size + bucket.size) - base_fee)
+                for bucket in buckets]
+
+    def branch_and_bound(self, values, target, upper):
+        '''Given effective values sorted largest first, return the indices of a
+        subset whose sum is in [target, upper] and closest to target, or None.'''
+        # prefix[i] is the sum of values[:i], so what the values from i on can
+        # still add is found without summing them
+        prefix = [0]
+        for value in values:
+            prefix.append(prefix[-1] + value)
+        total = prefix[-1]
+        if total < target:
+            return None
+
+        deadline = time.monotonic() + self.time_budget
+        best, best_excess = None, None
+        selected = []
+        current = 0
+        n = 0
+        for tries in range(self.max_tries):
+            if tries % 1000 == 999 and time.monotonic() > deadline:
+                break
+            if current + total - prefix[n] < target or current > upper:
+                backtrack = True
+            elif current >= target:
+                excess = current - target
+                if (best is None or excess < best_excess or
+                        (excess == best_excess and len(selected) < len(best))):
+                    best, best_excess = list(selected), excess
+                    if excess == 0:
+                        break
+                backtrack = True
+            else:
+                # Try including the next value first
+                selected.append(n)
+                current += values[n]
+                n += 1
+                continue
+            if not selected:
+                break
+            # Exclude the most recently included value instead.  Including an
+            # equal value in its place would only repeat the search.
+            last = selected.pop()
+            current -= values[last]
+            n = last + 1
+            while n < len(values) and values[n] == values[last]:
+                n += 1
+        return best
+
+    def choose_buckets(self, buckets, sufficient_funds, penalty_func):
+        values = self.effective_values(buckets)
+        order = sorted((n for n, value in enumerate(values) if value > 0),
+                       key=lambda n: -values[n])
+        target = self.spent_amount + self.fee_estimator(self.base_size)
+        # Less than this left over would be dropped as dust rather than kept
+        # in a change output
+        cost_of_change = (self.fee_estimator(self.base_size + P2PKH_OUTPUT_SIZE)
+                          - self.fee_estimator(self.base_size) + self.dust_threshold)
+        indices = self.branch_and_bound([values[n] for n in order], target,
+                                        target + cost_of_change)
+        if indices is not None:
+            winner = [buckets[order[n]] for n in indices]
+            if sufficient_funds(winner):
+                logger.debug("Bucket sets: %d", len(buckets))
+                logger.debug("Changeless selection of %d buckets", len(winner))
+                return winner
+        logger.debug("No changeless selection, falling back to privacy chooser")
+        return super().choose_buckets(buckets, sufficient_funds, penalty_func)
+
+
+COIN_CHOOSERS = {
+    'Privacy': CoinChooserPrivacy,
+    'BranchAndBound': CoinChooserBranchAndBound,
+}
+
+def get_name(config):
+    kind = config.get('coin_chooser')
+    if kind not in COIN_CHOOSERS:
+        kind = 'Privacy'
+    return kind
+
+def get_coin_chooser(config):
+    return COIN_CHOOSERS[get_name(config)]()
@@ -181,6 +181,17 @@ class Commands:
         self.wallet.storage.write()
         return {'password':self.wallet.has_password()}
 
+    @command('w')
+    def migratestorage(self):
+        """Convert the wallet file to the SQLite storage format, which saves large
+        wallets faster.  The original file is kept with a '.json' suffix.  Encrypted
+        wallet files cannot be converted."""
+        if self.wallet.storage.is_encrypted():
+            return {'converted': False,
+                    'error': _('Encrypted wallet files cannot be converted.')}
+        storage = self.wallet.migrate_storage()
+        return {'converted': True, 'path': storage.path}
+
     @command('')
     def getconfig(self, key):
         """Return a configuration variable. """
@@ -280,7 +291,8 @@ class Commands:
             x_pubkey = 'fd' + bh2u(b'\x00' + h160)
             tx.sign({x_pubkey:(privkey2, compressed)})
         else:
-            self.wallet.sign_transaction(tx, password)
+            self.wallet.sign_transaction(tx, password,
+                                        processes=self.config.get('sign_processes'))
         return tx.as_dict()
 
     @command('')
@@ -477,7 +489,8 @@ class Commands:
             tx.locktime = locktime
         if not unsigned:
             run_hook('sign_tx', self.wallet, tx)
-            self.wallet.sign_transaction(tx, password)
+            self.wallet.sign_transaction(tx, password,
+                                        processes=self.config.get('sign_processes'))
         return tx
 
     @command('wp')
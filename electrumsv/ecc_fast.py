@@ -85,6 +85,30 @@ def load_library():
         secp256k1.secp256k1_ec_pubkey_tweak_mul.argtypes = [c_void_p, c_char_p, c_char_p]
         secp256k1.secp256k1_ec_pubkey_tweak_mul.restype = c_int
 
+        secp256k1.secp256k1_ec_pubkey_tweak_add.argtypes = [c_void_p, c_char_p, c_char_p]
+        secp256k1.secp256k1_ec_pubkey_tweak_add.restype = c_int
+
+        secp256k1.secp256k1_ecdsa_signature_parse_der.argtypes = [c_void_p, c_char_p, c_char_p,
+                                                                  c_size_t]
+        secp256k1.secp256k1_ecdsa_signature_parse_der.restype = c_int
+
+        secp256k1.secp256k1_ecdsa_signature_serialize_der.argtypes = [c_void_p, c_char_p,
+                                                                      c_void_p, c_char_p]
+        secp256k1.secp256k1_ecdsa_signature_serialize_der.restype = c_int
+
+        # The recovery module is optional when building the library
+        try:
+            secp256k1.secp256k1_ecdsa_recoverable_signature_parse_compact.argtypes = [
+                c_void_p, c_char_p, c_char_p, c_int]
+            secp256k1.secp256k1_ecdsa_recoverable_signature_parse_compact.restype = c_int
+
+            secp256k1.secp256k1_ecdsa_recover.argtypes = [c_void_p, c_char_p, c_char_p,
+                                                          c_char_p]
+            secp256k1.secp256k1_ecdsa_recover.restype = c_int
+            secp256k1.has_recovery = True
+        except AttributeError:
+            secp256k1.has_recovery = False
+
         secp256k1.ctx = secp256k1.secp256k1_context_create(SECP256K1_CONTEXT_SIGN |
                                                            SECP256K1_CONTEXT_VERIFY)
         r = secp256k1.secp256k1_context_randomize(secp256k1.ctx, os.urandom(32))
@@ -227,6 +251,114 @@ def is_using_fast_ecc():
     return _patched_functions.monkey_patching_active
 
 
+# Batch operations.  These work directly on bytes and make one library call per item,
+# without creating python-ecdsa objects.  Callers check is_batch_available() or
+# is_recovery_available() first, and fall back to python-ecdsa otherwise.
+
+def is_batch_available():
+    return _libsecp256k1 is not None
+
+
+def is_recovery_available():
+    return _libsecp256k1 is not None and _libsecp256k1.has_recovery
+
+
+def _parse_pubkey(pubkey_bytes):
+    pubkey = create_string_buffer(64)
+    r = _libsecp256k1.secp256k1_ec_pubkey_parse(
+        _libsecp256k1.ctx, pubkey, pubkey_bytes, len(pubkey_bytes))
+    return pubkey if r else None
+
+
+def _serialize_pubkey(pubkey, compressed):
+    size = 33 if compressed else 65
+    pubkey_serialized = create_string_buffer(size)
+    pubkey_size = c_size_t(size)
+    _libsecp256k1.secp256k1_ec_pubkey_serialize(
+        _libsecp256k1.ctx, pubkey_serialized, byref(pubkey_size), pubkey,
+        SECP256K1_EC_COMPRESSED if compressed else SECP256K1_EC_UNCOMPRESSED)
+    return pubkey_serialized.raw[:pubkey_size.value]
+
+
+def pubkey_tweak_add_batch(pubkey_bytes, tweaks):
+    '''Return the compressed public key pubkey + tweak*G for each 32 byte tweak, or None
+    where that is not a valid key.'''
+    base_pubkey = _parse_pubkey(pubkey_bytes)
+    if base_pubkey is None:
+        raise ValueError('invalid public key')
+    results = []
+    for tweak in tweaks:
+        pubkey = create_string_buffer(base_pubkey.raw, 64)
+        if _libsecp256k1.secp256k1_ec_pubkey_tweak_add(_libsecp256k1.ctx, pubkey, tweak):
+            results.append(_serialize_pubkey(pubkey, True))
+        else:
+            results.append(None)
+    return results
+
+
+def sign_digests_batch(digests, secrets, compressions):
+    '''Sign each 32 byte digest with the matching 32 byte secret.  The signatures are
+    RFC6979 deterministic with low S values.  Returns (DER signature, public key) pairs,
+    the public key serialized as compressed or not.  Each signature is verified before
+    it is returned.'''
+    ctx = _libsecp256k1.ctx
+    results = []
+    for digest, secret, compressed in zip(digests, secrets, compressions):
+        if len(digest) != 32 or len(secret) != 32:
+            raise ValueError('digests and secrets must be 32 bytes')
+        sig = create_string_buffer(64)
+        pubkey = create_string_buffer(64)
+        if (not _libsecp256k1.secp256k1_ecdsa_sign(ctx, sig, digest, secret, None, None) or
+                not _libsecp256k1.secp256k1_ec_pubkey_create(ctx, pubkey, secret)):
+            raise ValueError('invalid private key')
+        if not _libsecp256k1.secp256k1_ecdsa_verify(ctx, sig, digest, pubkey):
+            raise Exception('signature failed to verify')
+        der_sig = create_string_buffer(72)
+        der_size = c_size_t(72)
+        _libsecp256k1.secp256k1_ecdsa_signature_serialize_der(ctx, der_sig, byref(der_size),
+                                                              sig)
+        results.append((der_sig.raw[:der_size.value], _serialize_pubkey(pubkey, compressed)))
+    return results
+
+
+def verify_digests_batch(items):
+    '''Takes (digest, DER signature, public key) triples and returns whether each
+    signature is valid.  High S values are accepted.'''
+    ctx = _libsecp256k1.ctx
+    pubkeys = {}
+    results = []
+    for digest, der_sig, pubkey_bytes in items:
+        if pubkey_bytes not in pubkeys:
+            pubkeys[pubkey_bytes] = _parse_pubkey(pubkey_bytes)
+        pubkey = pubkeys[pubkey_bytes]
+        sig = create_string_buffer(64)
+        if (pubkey is None or len(digest) != 32 or not
+                _libsecp256k1.secp256k1_ecdsa_signature_parse_der(ctx, sig, der_sig,
+                                                                  len(der_sig))):
+            results.append(False)
+            continue
+        _libsecp256k1.secp256k1_ecdsa_signature_normalize(ctx, sig, sig)
+        results.append(1 == _libsecp256k1.secp256k1_ecdsa_verify(ctx, sig, digest, pubkey))
+    return results
+
+
+def recover_pubkeys_batch(items):
+    '''Takes (64 byte compact signature, recovery id, digest) triples and returns the
+    uncompressed public key recovered from each, or None where there is none.'''
+    ctx = _libsecp256k1.ctx
+    results = []
+    for sig_string, recid, digest in items:
+        sig = create_string_buffer(65)
+        pubkey = create_string_buffer(64)
+        if (_libsecp256k1.secp256k1_ecdsa_recoverable_signature_parse_compact(
+                ctx, sig, sig_string, recid) and
+                _libsecp256k1.secp256k1_ecdsa_recover(ctx, pubkey, sig, digest)):
+            results.append(_serialize_pubkey(pubkey, False))
+        else:
+            results.append(None)
+    return results
+
+
 try:
     _libsecp256k1 = load_library()
 except:
@@ -465,6 +465,23 @@ class FxThread(ThreadJob):
             self.history_used_spot = True
         return Decimal(rate) if rate is not None else None
 
+    def history_rates(self, d_ts):
+        '''Return a map of date to rate for the given datetimes, as history_rate would.
+        The rate history of the currency, the spot quote and today's date are fetched
+        once for all of them, and each distinct date is then one dict lookup.'''
+        history = self.exchange.history.get(self.ccy, {})
+        spot = self.exchange.quotes.get(self.ccy)
+        today = datetime.datetime.today().date()
+        rates = {}
+        for date in {d_t.date() for d_t in d_ts}:
+            rate = history.get(date.strftime('%Y-%m-%d'))
+            # As in history_rate, use spot quotes for recent dates without a rate
+            if rate is None and (today - date).days <= 2:
+                rate = spot
+                self.history_used_spot = True
+            rates[date] = Decimal(rate) if rate is not None else None
+        return rates
+
     def historical_value_str(self, satoshis, d_t):
         rate = self.history_rate(d_t)
         return self.value_str(satoshis, rate)
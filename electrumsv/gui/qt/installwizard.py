@@ -13,7 +13,7 @@ from PyQt5.QtWidgets import (
 )
 
 from electrumsv.wallet import Wallet
-from electrumsv.storage import WalletStorage
+from electrumsv.storage import WalletStorage, migrate_to_sqlite
 from electrumsv.util import UserCancelled, InvalidPassword, user_dir, get_electron_cash_user_dir
 from electrumsv.base_wizard import BaseWizard
 from electrumsv.i18n import _
@@ -362,6 +362,12 @@ class InstallWizard(QDialog, MessageBoxMixin, BaseWizard):
             if not self.question(msg):
                 return
             self.storage.upgrade()
+            # Encrypted files stay JSON, as SQLite wallet files cannot be encrypted
+            if not self.storage.is_encrypted() and self.question(
+                    _("Do you also want to convert the wallet to the SQLite format, "
+                      "which saves large wallets faster?  The original file is kept "
+                      "with a '.json' suffix.")):
+                self.storage = migrate_to_sqlite(self.storage)
             self.wallet = Wallet(self.storage)
             return self.wallet
 
@@ -1661,9 +1661,11 @@ class ElectrumWindow(QMainWindow, MessageBoxMixin):
             callback(False)
 
         if self.tx_external_keypairs:
-            task = partial(Transaction.sign, tx, self.tx_external_keypairs)
+            task = partial(Transaction.sign, tx, self.tx_external_keypairs,
+                           processes=self.config.get('sign_processes'))
         else:
-            task = partial(self.wallet.sign_transaction, tx, password)
+            task = partial(self.wallet.sign_transaction, tx, password,
+                           processes=self.config.get('sign_processes'))
         WaitingDialog(self, _('Signing transaction...'), task,
                       on_signed, on_failed)
 
@@ -2710,24 +2712,8 @@ class ElectrumWindow(QMainWindow, MessageBoxMixin):
             plt.show()
 
     def do_export_history(self, wallet, fileName, is_csv):
-        history = wallet.export_history(fx=self.fx)
-        lines = []
-        for item in history:
-            if is_csv:
-                lines.append([item['txid'], item.get('label', ''),
-                              item['confirmations'], item['value'], item['date']])
-            else:
-                lines.append(item)
-
         with open(fileName, "w+") as f:
-            if is_csv:
-                transaction = csv.writer(f, lineterminator='\n')
-                transaction.writerow(["transaction_hash", "label", "confirmations",
-                                      "value", "timestamp"])
-                for line in lines:
-                    transaction.writerow(line)
-            else:
-                f.write(json.dumps(lines, indent=4))
+            wallet.write_export_history(f, is_csv, fx=self.fx)
 
     def sweep_key_dialog(self):
         addresses = self.wallet.get_unused_addresses()
@@ -250,6 +250,16 @@ class Interface:
     MODE_CATCH_UP = 'catch_up'
     MODE_VERIFICATION = 'verification'
 
+    # Bounds of the window of unanswered requests.  The window grows by one request
+    # per window of timely responses, and halves on a server error or a slow response.
+    MIN_WINDOW = 10
+    MAX_WINDOW = 2000
+    INITIAL_WINDOW = 100
+    # A response taking longer than this, in seconds, is slow
+    SLOW_RESPONSE = 5.0
+    # Weight of the latest response in the average response time
+    LATENCY_WEIGHT = 0.1
+
     def __init__(self, server, socket):
         self.server = server
         self.host, _, _ = server.rsplit(':', 2)
@@ -257,10 +267,20 @@ class Interface:
 
         self.pipe = util.SocketPipe(socket)
         self.pipe.set_timeout(0.0)  # Don't wait for data
+        # Send queued requests as JSON-RPC batch arrays.  Responses are accepted in
+        # either form regardless.
+        self.batch_requests = False
         # Dump network messages.  Set at runtime from the console.
         self.debug = False
         self.unsent_requests = []
         self.unanswered_requests = {}
+        # Flow control.  request id -> time sent, for the unanswered requests
+        self.send_times = {}
+        self.window = self.INITIAL_WINDOW
+        self.last_cut = 0
+        self.latency = None
+        self.responses = 0
+        self.errors = 0
         self.last_send = time.time()
         self.closed_remotely = False
 
@@ -291,9 +311,52 @@ class Interface:
         self.unsent_requests.append(args)
 
     def num_requests(self):
-        '''Keep unanswered requests below 100'''
-        n = 100 - len(self.unanswered_requests)
-        return min(n, len(self.unsent_requests))
+        '''Keep unanswered requests within the request window'''
+        n = int(self.window) - len(self.unanswered_requests)
+        return max(0, min(n, len(self.unsent_requests)))
+
+    def on_response(self, wire_id, response):
+        '''Adjust the request window for a response to a request we sent.'''
+        sent = self.send_times.pop(wire_id, None)
+        if sent is None:
+            return
+        latency = time.time() - sent
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += (latency - self.latency) * self.LATENCY_WEIGHT
+        self.responses += 1
+        if response.get('error') is not None:
+            self.errors += 1
+            self.cut_window(sent)
+        elif latency > self.SLOW_RESPONSE:
+            self.cut_window(sent)
+        else:
+            self.window = min(self.MAX_WINDOW, self.window + 1 / self.window)
+
+    def cut_window(self, sent):
+        # Requests sent before the last cut were sent under the old window, so they
+        # do not cut it again
+        if sent >= self.last_cut:
+            self.window = max(self.MIN_WINDOW, self.window / 2)
+            self.last_cut = time.time()
+
+    def request_timeout(self):
+        '''How long, in seconds, the oldest unanswered request can wait for an answer
+        before the server is considered unresponsive.'''
+        if self.latency is None:
+            return 20
+        return max(20, 10 * self.latency)
+
+    def get_flow_status(self):
+        return {
+            'window': int(self.window),
+            'unanswered': len(self.unanswered_requests),
+            'unsent': len(self.unsent_requests),
+            'latency': self.latency,
+            'responses': self.responses,
+            'errors': self.errors,
+        }
 
     def send_requests(self):
         '''Sends queued requests.  Returns False on failure.'''
@@ -302,7 +365,10 @@ class Interface:
         n = self.num_requests()
         wire_requests = self.unsent_requests[0:n]
         try:
-            self.pipe.send_all([make_dict(*r) for r in wire_requests])
+            if self.batch_requests and len(wire_requests) > 1:
+                self.pipe.send_batch([make_dict(*r) for r in wire_requests])
+            else:
+                self.pipe.send_all([make_dict(*r) for r in wire_requests])
         except (OSError, ssl.SSLError) as e:
             self.logger.error("send_requests %s %s", type(e).__name__, e)
             return False
@@ -311,6 +377,7 @@ class Interface:
             if self.debug:
                 self.logger.debug("--> %s", request)
             self.unanswered_requests[request[2]] = request
+            self.send_times[request[2]] = self.last_send
         return True
 
     def ping_required(self):
@@ -354,6 +421,7 @@ class Interface:
             else:
                 request = self.unanswered_requests.pop(wire_id, None)
                 if request:
+                    self.on_response(wire_id, response)
                     responses.append((request, response))
                 else:
                     self.logger.debug("unknown wire ID '%s'", wire_id)
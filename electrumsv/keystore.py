@@ -34,10 +34,10 @@ from ecdsa.curves import SECP256k1
 from ecdsa.util import string_to_number, number_to_string
 from . import bitcoin
 from .bitcoin import bip32_public_derivation, deserialize_xpub, \
-    CKD_pub, bh2u, bfh, DecodeBase58Check, deserialize_xprv, \
+    CKD_pub, CKD_pub_batch, bh2u, bfh, DecodeBase58Check, deserialize_xprv, \
     pw_encode, bip32_root, bip32_private_derivation, \
     bip32_private_key, pw_decode, Hash, is_xpub, is_xprv, is_seed, \
-    seed_type
+    seed_type, ser_to_point
 
 from .address import Address, PublicKey
 from .networks import NetworkConstants
@@ -110,7 +110,7 @@ class Software_KeyStore(KeyStore):
         decrypted = ec.decrypt_message(message)
         return decrypted
 
-    def sign_transaction(self, tx, password):
+    def sign_transaction(self, tx, password, processes=None):
         if self.is_watching_only():
             return
         # Raise if password is not correct.
@@ -121,7 +121,7 @@ class Software_KeyStore(KeyStore):
             keypairs[k] = self.get_private_key(v, password)
         # Sign
         if keypairs:
-            tx.sign(keypairs)
+            tx.sign(keypairs, processes=processes)
 
 
 class Imported_KeyStore(Software_KeyStore):
@@ -268,11 +268,13 @@ class Xpub:
         self.xpub = None
         self.xpub_receive = None
         self.xpub_change = None
+        # for_change -> (chain code, compressed pubkey, curve point) of the branch node
+        self._branch_nodes = {}
 
     def get_master_public_key(self):
         return self.xpub
 
-    def derive_pubkey(self, for_change, n):
+    def get_branch_xpub(self, for_change):
         xpub = self.xpub_change if for_change else self.xpub_receive
         if xpub is None:
             xpub = bip32_public_derivation(self.xpub, "", "/%d"%for_change)
@@ -280,7 +282,24 @@ class Xpub:
                 self.xpub_change = xpub
             else:
                 self.xpub_receive = xpub
-        return self.get_pubkey_from_xpub(xpub, (n,))
+        return xpub
+
+    def get_branch_node(self, for_change):
+        node = self._branch_nodes.get(for_change)
+        if node is None:
+            _, _, _, _, c, cK = deserialize_xpub(self.get_branch_xpub(for_change))
+            node = (c, cK, ser_to_point(cK))
+            self._branch_nodes[for_change] = node
+        return node
+
+    def derive_pubkey(self, for_change, n):
+        return self.derive_pubkeys_range(for_change, n, 1)[0]
+
+    def derive_pubkeys_range(self, for_change, start, count):
+        '''Return the hex public keys for_change/start to for_change/start+count-1.'''
+        c, cK, point = self.get_branch_node(for_change)
+        return [bh2u(cK_n) for cK_n, c_n in CKD_pub_batch(cK, c, range(start, start + count),
+                                                          point)]
 
     @classmethod
     def get_pubkey_from_xpub(self, xpub, sequence):
@@ -470,6 +489,9 @@ class Old_KeyStore(Deterministic_KeyStore):
     def derive_pubkey(self, for_change, n):
         return self.get_pubkey_from_mpk(self.mpk, for_change, n)
 
+    def derive_pubkeys_range(self, for_change, start, count):
+        return [self.derive_pubkey(for_change, n) for n in range(start, start + count)]
+
     def get_private_key_from_stretched_exponent(self, for_change, n, secexp):
         order = generator_secp256k1.order()
         secexp = (secexp + self.get_sequence(self.mpk, for_change, n)) % order
@@ -22,14 +22,13 @@
 # SOFTWARE.
 
 from collections import defaultdict
-import errno
 import json
 import logging
 import os
 import queue
 import random
 import re
-import select
+import selectors
 import socket
 import stat
 import threading
@@ -162,6 +161,18 @@ def serialize_server(host, port, protocol):
     return str(':'.join([host, port, protocol]))
 
 
+class WakeupQueue(queue.Queue):
+    '''A queue that wakes the network thread when something is put on it.'''
+
+    def __init__(self, wakeup):
+        super().__init__()
+        self.wakeup = wakeup
+
+    def put(self, item, block=True, timeout=None):
+        super().put(item, block, timeout)
+        self.wakeup()
+
+
 class Network(util.DaemonThread):
     """The Network class manages a set of connections to remote electrum
     servers, each connected socket is handled by an Interface() object.
@@ -175,6 +186,9 @@ class Network(util.DaemonThread):
           is_connected(), set_parameters(), stop()
     """
 
+    # Seconds the network thread waits on its sockets before doing its periodic work
+    select_timeout = 0.1
+
     def __init__(self, config=None):
         if config is None:
             config = {}  # Do not use mutables as default values!
@@ -248,7 +262,9 @@ class Network(util.DaemonThread):
         self.auto_connect = self.config.get('auto_connect', True)
         self.connecting = set()
         self.requested_chunks = set()
-        self.socket_queue = queue.Queue()
+        # This is made before the proxy is set, which replaces socket.socket.
+        self.open_selector()
+        self.socket_queue = WakeupQueue(self.wakeup)
         self.start_network(deserialize_server(self.default_server)[2],
                            deserialize_proxy(self.config.get('proxy')))
 
@@ -366,6 +382,10 @@ class Network(util.DaemonThread):
             value = self.get_servers()
         elif key == 'interfaces':
             value = self.get_interfaces()
+        elif key == 'flow_control':
+            with self.interface_lock:
+                value = {server: interface.get_flow_status()
+                         for server, interface in self.interfaces.items()}
         return value
 
     def notify(self, key):
@@ -473,7 +493,7 @@ class Network(util.DaemonThread):
         assert not self.interfaces
         self.connecting = set()
         # Get a new queue - no old pending connections thanks!
-        self.socket_queue = queue.Queue()
+        self.socket_queue = WakeupQueue(self.wakeup)
 
     def set_parameters(self, host, port, protocol, proxy, auto_connect):
         proxy_str = serialize_proxy(proxy)
@@ -557,6 +577,10 @@ class Network(util.DaemonThread):
                 self.interfaces.pop(interface.server)
             if interface.server == self.default_server:
                 self.interface = None
+            try:
+                self.selector.unregister(interface)
+            except KeyError:
+                pass
             interface.close()
 
     def add_recent_server(self, server):
@@ -676,6 +700,39 @@ class Network(util.DaemonThread):
         messages = list(messages)
         with self.pending_sends_lock:
             self.pending_sends.append((messages, callback))
+        self.wakeup()
+
+    def open_selector(self):
+        '''The network thread waits on the interface sockets and on a socket pair that
+        other threads write to, to wake it when they have given it work.'''
+        self.selector = selectors.DefaultSelector()
+        self.wakeup_receiver, self.wakeup_sender = socket.socketpair()
+        self.wakeup_receiver.setblocking(False)
+        self.wakeup_sender.setblocking(False)
+        self.selector.register(self.wakeup_receiver, selectors.EVENT_READ)
+
+    def close_selector(self):
+        self.selector.unregister(self.wakeup_receiver)
+        self.selector.close()
+        self.wakeup_receiver.close()
+        self.wakeup_sender.close()
+
+    def stop(self):
+        super().stop()
+        self.wakeup()
+
+    def on_stop(self):
+        self.close_selector()
+        super().on_stop()
+
+    def wakeup(self):
+        '''Wake the network thread if it is waiting on the sockets.  Any thread can call
+        this.'''
+        try:
+            self.wakeup_sender.send(b'\0')
+        except OSError:
+            # The socket buffer is full, so a wakeup is already pending
+            pass
 
     def process_pending_sends(self):
         # Requests needs connectivity.  If we don't have an interface,
@@ -738,6 +795,7 @@ class Network(util.DaemonThread):
         self.add_recent_server(server_key)
 
         interface = Interface(server_key, socket)
+        interface.batch_requests = self.config.get('batch_requests', False)
         interface.blockchain = None
         interface.tip_header = None
         interface.tip = 0
@@ -1172,38 +1230,49 @@ class Network(util.DaemonThread):
         with self.interface_lock:
             interfaces = list(self.interfaces.values())
         for interface in interfaces:
-            if interface.unanswered_requests and time.time() - interface.request_time > 20:
-                # The last request made is still outstanding, and was over 20 seconds ago.
+            if (interface.unanswered_requests and
+                    time.time() - interface.request_time > interface.request_timeout()):
+                # The last request made is still outstanding, and was made longer ago
+                # than the server's responses usually take.
                 interface.logger.error("blockchain request timed out")
                 self.connection_down(interface.server)
                 continue
 
     def wait_on_sockets(self):
-        # Python docs say Windows doesn't like empty selects.
-        # Sleep to prevent busy looping
-        if not self.interfaces:
-            time.sleep(0.1)
-            return
         with self.interface_lock:
             interfaces = list(self.interfaces.values())
-        rin = [i for i in interfaces]
-        win = [i for i in interfaces if i.num_requests()]
+        for interface in interfaces:
+            events = selectors.EVENT_READ
+            if interface.num_requests():
+                events |= selectors.EVENT_WRITE
+            try:
+                if self.selector.get_key(interface).events != events:
+                    self.selector.modify(interface, events)
+            except KeyError:
+                self.selector.register(interface, events)
         try:
-            rout, wout, xout = select.select(rin, win, [], 0.1)
-        except socket.error as e:
-            # TODO: py3, get code from e
-            code = None
-            if code == errno.EINTR:
-                return
-            raise
-        assert not xout
-        for interface in wout:
-            interface.send_requests()
+            ready = self.selector.select(self.select_timeout)
+        except InterruptedError:
+            return
+        rout = []
+        for key, events in ready:
+            if key.fileobj is self.wakeup_receiver:
+                try:
+                    while self.wakeup_receiver.recv(4096):
+                        pass
+                except OSError:
+                    pass
+                continue
+            if events & selectors.EVENT_WRITE:
+                key.fileobj.send_requests()
+            if events & selectors.EVENT_READ:
+                rout.append(key.fileobj)
         for interface in rout:
             self.process_responses(interface)
 
     def init_headers_file(self):
         b = self.blockchains[0]
+        b.flush()
         filename = b.path()
         length = 80 * (bitcoin.NetworkConstants.VERIFICATION_BLOCK_HEIGHT + 1)
         if not os.path.exists(filename) or os.path.getsize(filename) < length:
@@ -1231,6 +1300,10 @@ class Network(util.DaemonThread):
             if self.verified_checkpoint:
                 self.run_jobs()    # Synchronizer and Verifier and Fx
             self.process_pending_sends()
+            for b in self.blockchains.values():
+                b.flush_if_due()
+        for b in self.blockchains.values():
+            b.flush()
         self.stop_network()
         self.on_stop()
 
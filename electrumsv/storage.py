@@ -31,8 +31,11 @@ import json
 import logging
 import os
 import re
+import shutil
+import sqlite3
 import stat
 import threading
+from types import MappingProxyType
 import zlib
 
 from .address import Address
@@ -65,6 +68,12 @@ def multisig_type(wallet_type):
 
 
 class WalletStorage:
+    def __new__(cls, path, manual_upgrades=False):
+        # Existing SQLite wallet files are opened with the SQLite storage engine
+        if cls is WalletStorage and is_sqlite_file(path):
+            cls = SqliteWalletStorage
+        return super().__new__(cls)
+
     def __init__(self, path, manual_upgrades=False):
         logger.debug("wallet path '%s'", path)
         dirname = os.path.dirname(path)
@@ -106,7 +115,9 @@ class WalletStorage:
                     logger.error('Failed to convert label to json format %s', key)
                     continue
                 self.data[key] = value
+        self._post_load()
 
+    def _post_load(self):
         # check here if I need to load a plugin
         t = self.get('wallet_type')
         l = plugin_loaders.get(t)
@@ -147,31 +158,62 @@ class WalletStorage:
         else:
             self.pubkey = None
 
-    def get(self, key, default=None):
+    def get(self, key, default=None, readonly=False):
+        '''Return a copy of the stored value.  With readonly the stored value is returned
+        without copying; dicts and lists are wrapped in read-only views but any nested
+        values are shared with the storage and must not be modified.'''
         with self.lock:
             v = self.data.get(key)
             if v is None:
                 v = default
+            elif readonly:
+                if isinstance(v, dict):
+                    v = MappingProxyType(v)
+                elif isinstance(v, list):
+                    v = tuple(v)
             else:
                 v = copy.deepcopy(v)
         return v
 
-    def put(self, key, value):
-        try:
-            json.dumps(key)
-            json.dumps(value)
-        except:
-            logger.error("json error: cannot save %s", key)
-            return
+    def put(self, key, value, copy_value=True, validate=True):
+        '''Store a value.  With copy_value unset the storage keeps the passed object
+        itself, so the caller must hand over a new object and not modify it afterwards.
+        Unsetting validate skips the JSON serialisation check, for callers that build
+        the value from JSON types themselves.'''
+        if validate:
+            try:
+                json.dumps(key)
+                json.dumps(value)
+            except:
+                logger.error("json error: cannot save %s", key)
+                return
         with self.lock:
             if value is not None:
                 if self.data.get(key) != value:
                     self.modified = True
-                    self.data[key] = copy.deepcopy(value)
+                    self.data[key] = copy.deepcopy(value) if copy_value else value
             elif key in self.data:
                 self.modified = True
                 self.data.pop(key)
 
+    def put_rows(self, key, rows, deleted=()):
+        '''Change some entries of the dictionary stored under key, rather than storing a
+        whole new dictionary.  rows maps entry keys to their new values and deleted holds
+        entry keys to remove.  As with put() with copy_value and validate unset, the
+        values are kept as they are and must be built from JSON types.'''
+        with self.lock:
+            d = self.data.get(key)
+            if not isinstance(d, dict):
+                d = self.data[key] = {}
+            for k in deleted:
+                if k in d:
+                    del d[k]
+                    self.modified = True
+            for k, value in rows.items():
+                if d.get(k) != value:
+                    d[k] = value
+                    self.modified = True
+
     @profiler
     def write(self):
         with self.lock:
@@ -558,3 +600,229 @@ class WalletStorage:
                 msg += ("\nPlease open this file with Electrum 1.9.8, and move "
                         "your coins to a new wallet.")
         raise BaseException(msg)
+
+
+SQLITE_HEADER = b'SQLite format 3\x00'
+
+
+def is_sqlite_file(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(SQLITE_HEADER)) == SQLITE_HEADER
+    except (IOError, OSError):
+        return False
+
+
+class SqliteWalletStorage(WalletStorage):
+    '''Wallet storage kept in an SQLite database.
+
+    The large wallet dictionaries (TABLE_KEYS) are stored one row per dictionary entry in
+    their own table, keyed by the dictionary key.  All other values are JSON encoded into a
+    key-value table.  put() records which rows changed and write() only upserts or deletes
+    those rows, so saving a wallet costs in proportion to what changed rather than to the
+    size of the wallet.  Files of this type cannot be encrypted.
+    '''
+
+    TABLE_KEYS = ('transactions', 'txi', 'txo', 'tx_fees', 'pruned_txo', 'addr_history',
+                  'verified_tx3', 'labels', 'addresses')
+
+    def __init__(self, path, manual_upgrades=False):
+        logger.debug("wallet path '%s'", path)
+        dirname = os.path.dirname(path)
+        if not os.path.exists(dirname):
+            raise RuntimeError(f'directory {dirname} does not exist')
+        self.manual_upgrades = manual_upgrades
+        self.lock = threading.RLock()
+        self.data = {}
+        self.path = path
+        self.modified = False
+        self.pubkey = None
+        self.raw = None
+        self.conn = None
+        # key -> {row key -> JSON text} as last put, for the table keys in table form
+        self._rows = {}
+        # kv keys and table rows that need writing, and tables to rewrite in full
+        self._dirty_kv = set()
+        self._dirty_rows = {}
+        self._reset_tables = set()
+        if self.file_exists():
+            self._read()
+            self._post_load()
+        else:
+            # avoid new wallets getting 'upgraded'
+            self.put('seed_version', FINAL_SEED_VERSION)
+
+    def _connect(self):
+        # The database is only created on the first write so that new wallets are not
+        # seen as existing files before they are saved.
+        if self.conn is None:
+            is_new = not self.file_exists()
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+            if is_new:
+                os.chmod(self.path, stat.S_IREAD | stat.S_IWRITE)
+            with self.conn:
+                self.conn.execute('CREATE TABLE IF NOT EXISTS kv '
+                                  '(key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+                for table in self.TABLE_KEYS:
+                    self.conn.execute('CREATE TABLE IF NOT EXISTS "{}" '
+                                      '(key TEXT PRIMARY KEY, value TEXT NOT NULL)'
+                                      .format(table))
+        return self.conn
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+    def _read(self):
+        conn = self._connect()
+        for key, text in conn.execute('SELECT key, value FROM kv'):
+            self.data[key] = json.loads(text)
+        for table in self.TABLE_KEYS:
+            rows = dict(conn.execute('SELECT key, value FROM "{}"'.format(table)))
+            if rows:
+                self._rows[table] = rows
+                self.data[table] = {k: json.loads(text) for k, text in rows.items()}
+
+    def is_encrypted(self):
+        return False
+
+    def decrypt(self, password):
+        raise BaseException('SQLite wallet files are not encrypted')
+
+    def set_password(self, password, encrypt):
+        if encrypt and password:
+            raise BaseException('SQLite wallet files cannot be encrypted')
+        super().set_password(password, False)
+
+    def _is_table_value(self, key, value):
+        return key in self.TABLE_KEYS and isinstance(value, dict)
+
+    def put(self, key, value, copy_value=True, validate=True):
+        with self.lock:
+            if not self._is_table_value(key, value):
+                if self._is_table_value(key, self.data.get(key)):
+                    self._reset_tables.add(key)
+                    self._rows.pop(key, None)
+                self._dirty_kv.add(key)
+                super().put(key, value, copy_value, validate)
+                return
+
+            # Each row is serialised for writing anyway, which also validates it
+            try:
+                rows = {k: json.dumps(v, sort_keys=True) for k, v in value.items()}
+            except:
+                logger.error("json error: cannot save %s", key)
+                return
+            old_rows = self._rows.get(key)
+            if old_rows is None:
+                # the value was missing or stored in the kv table until now
+                self._reset_tables.add(key)
+                self._dirty_kv.add(key)
+                self.data[key] = {k: json.loads(text) for k, text in rows.items()}
+                self._rows[key] = rows
+                self.modified = True
+                return
+            deleted = [k for k in old_rows if k not in rows]
+            self._update_rows(key, {k: json.loads(text) for k, text in rows.items()
+                                    if old_rows.get(k) != text}, rows, deleted)
+
+    def put_rows(self, key, rows, deleted=()):
+        with self.lock:
+            if key not in self.TABLE_KEYS or self._rows.get(key) is None:
+                # Not stored as a table yet, so the whole dictionary is put
+                value = self.data.get(key)
+                value = dict(value) if isinstance(value, dict) else {}
+                for k in deleted:
+                    value.pop(k, None)
+                value.update(rows)
+                self.put(key, value, copy_value=False)
+                return
+            try:
+                texts = {k: json.dumps(v, sort_keys=True) for k, v in rows.items()}
+            except:
+                logger.error("json error: cannot save %s", key)
+                return
+            self._update_rows(key, rows, texts, deleted)
+
+    def _update_rows(self, key, rows, texts, deleted):
+        '''Apply the changed rows, with their JSON texts, and the deleted row keys to a
+        table key and record them for the next write.'''
+        old_rows = self._rows[key]
+        changed = [k for k in rows if old_rows.get(k) != texts[k]]
+        deleted = [k for k in deleted if k in old_rows]
+        if not changed and not deleted:
+            return
+        data = self.data[key]
+        for k in deleted:
+            del data[k]
+            del old_rows[k]
+        for k in changed:
+            data[k] = rows[k]
+            old_rows[k] = texts[k]
+        self._dirty_rows.setdefault(key, set()).update(changed, deleted)
+        self.modified = True
+
+    def _write(self):
+        if threading.currentThread().isDaemon():
+            logger.error('daemon thread cannot write wallet')
+            return
+        if not self.modified:
+            return
+        conn = self._connect()
+        with conn:
+            for key in self._dirty_kv:
+                value = self.data.get(key)
+                if value is None or key in self._rows:
+                    conn.execute('DELETE FROM kv WHERE key=?', (key,))
+                else:
+                    conn.execute('INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)',
+                                 (key, json.dumps(value)))
+            for table in self._reset_tables:
+                conn.execute('DELETE FROM "{}"'.format(table))
+                conn.executemany('INSERT INTO "{}" (key, value) VALUES (?, ?)'.format(table),
+                                 self._rows.get(table, {}).items())
+            for table, row_keys in self._dirty_rows.items():
+                if table in self._reset_tables:
+                    continue
+                rows = self._rows.get(table, {})
+                conn.executemany('DELETE FROM "{}" WHERE key=?'.format(table),
+                                 [(k,) for k in row_keys if k not in rows])
+                conn.executemany('INSERT OR REPLACE INTO "{}" (key, value) VALUES (?, ?)'
+                                 .format(table),
+                                 [(k, rows[k]) for k in row_keys if k in rows])
+        self._dirty_kv.clear()
+        self._dirty_rows.clear()
+        self._reset_tables.clear()
+        logger.debug("saved '%s'", self.path)
+        self.modified = False
+
+
+def migrate_to_sqlite(storage):
+    '''Convert an opened, unencrypted JSON wallet file to an SQLite wallet file at the
+    same path.  The original file is kept with a '.json' suffix.  Returns the storage for
+    the new file.  SQLite wallet files cannot be encrypted, so encrypted files are not
+    converted: their password would no longer protect the wallet.'''
+    if isinstance(storage, SqliteWalletStorage):
+        return storage
+    if storage.is_encrypted():
+        raise BaseException('encrypted wallet files cannot be converted to SQLite')
+    with storage.lock:
+        temp_path = "%s.tmp.%s" % (storage.path, os.getpid())
+        try:
+            new_storage = SqliteWalletStorage(temp_path, manual_upgrades=True)
+            try:
+                for key, value in storage.data.items():
+                    new_storage.put(key, value)
+                new_storage.write()
+            finally:
+                new_storage.close()
+            # The original is copied aside first, so that the wallet path always holds
+            # a complete wallet file
+            shutil.copy2(storage.path, storage.path + '.json')
+            os.replace(temp_path, storage.path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+    return SqliteWalletStorage(storage.path, manual_upgrades=storage.manual_upgrades)
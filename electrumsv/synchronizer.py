@@ -41,7 +41,10 @@ class Synchronizer(ThreadJob):
     we don't have the full history of, and requests binary transaction
     data of any transactions the wallet doesn't have.
 
-    External interface: __init__() and add() member functions.
+    The wallet's gap limits are only checked when woken by new address
+    history, a new block or a call to wake().
+
+    External interface: __init__(), add() and wake() member functions.
     '''
 
     def __init__(self, wallet, network):
@@ -54,6 +57,8 @@ class Synchronizer(ThreadJob):
         self.requested_hashes = set()
         self.h2addr = {}
         self.lock = Lock()
+        self.synchronize_needed = True
+        self.local_height = None
         self.initialize()
 
     def parse_response(self, response):
@@ -74,6 +79,12 @@ class Synchronizer(ThreadJob):
         with self.lock:
             self.new_addresses.add(address)
 
+    def wake(self):
+        '''Have the next run check the wallet's gap limits.  This can be called from
+        the proxy or GUI threads.'''
+        with self.lock:
+            self.synchronize_needed = True
+
     def subscribe_to_addresses(self, addresses):
         hashes = [addr.to_scripthash_hex() for addr in addresses]
         # Keep a hash -> address mapping
@@ -134,6 +145,8 @@ class Synchronizer(ThreadJob):
         else:
             # Store received history
             self.wallet.receive_history_callback(addr, hist, tx_fees)
+            # The address may now be used, so more may be needed
+            self.wake()
             # Request transactions we don't have
             self.request_missing_txs(hist)
 
@@ -187,14 +200,23 @@ class Synchronizer(ThreadJob):
 
     def run(self):
         '''Called from the network proxy thread main loop.'''
-        # 1. Create new addresses
-        self.wallet.synchronize()
+        # 1. Create new addresses.  Addresses age as blocks arrive, which also
+        # counts towards the gap limit.
+        local_height = self.network.get_local_height()
+        with self.lock:
+            synchronize_needed = (self.synchronize_needed or
+                                  local_height != self.local_height)
+            self.synchronize_needed = False
+        if synchronize_needed:
+            self.local_height = local_height
+            self.wallet.synchronize()
 
         # 2. Subscribe to new addresses
         with self.lock:
             addresses = self.new_addresses
             self.new_addresses = set()
-        self.subscribe_to_addresses(addresses)
+        if addresses:
+            self.subscribe_to_addresses(addresses)
 
         # 3. Detect if situation has changed
         up_to_date = self.is_up_to_date()
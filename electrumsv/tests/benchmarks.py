@@ -0,0 +1,127 @@
+'''Timings of the code paths that were optimised for large wallets.  These are kept out
+of the unit tests, which check the behaviour of the same code.  Run them with
+
+    python -m electrumsv.tests.benchmarks [name ...]
+
+to time all of them, or just those named.'''
+
+import sys
+import time
+
+from electrumsv import ecc_fast, transaction
+from electrumsv.address import Address
+from electrumsv.bitcoin import CKD_pub_batch, deserialize_xpub, sign_digests, verify_digests
+from electrumsv.coinchooser import CoinChooserBranchAndBound, CoinChooserPrivacy
+from electrumsv.util import bfh, bh2u
+
+from .test_bitcoin import Test_batch_ecc, _addresses, _signing_items
+from .test_blockchain import DictBlockchain, _chunk, _daa_headers
+from .test_coinchooser import _make_tx
+from .test_transaction import _hex_serialize, _large_tx, _unsigned_tx
+
+
+benchmarks = {}
+
+def benchmark(func):
+    benchmarks[func.__name__] = func
+    return func
+
+def timed(func, repeat=1):
+    '''Return the result of the last of repeat calls of func and the time they took.'''
+    start = time.perf_counter()
+    for n in range(repeat):
+        result = func()
+    return result, time.perf_counter() - start
+
+
+@benchmark
+def serialize():
+    tx = _large_tx()
+    old, old_time = timed(lambda: _hex_serialize(tx), 5)
+    new, new_time = timed(tx.serialize_bytes, 5)
+    assert bh2u(new) == old
+    return 'serialize {} inputs x5: hex {:.4f}s bytes {:.4f}s'.format(
+        len(tx.inputs()), old_time, new_time)
+
+@benchmark
+def deserialize():
+    raw = _large_tx().serialize()
+    old, old_time = timed(lambda: transaction.deserialize(raw), 5)
+    new, new_time = timed(lambda: transaction.deserialize(bfh(raw)), 5)
+    assert old == new
+    return 'deserialize {} inputs x5: hex {:.4f}s bytes {:.4f}s'.format(
+        len(new['inputs']), old_time, new_time)
+
+@benchmark
+def parallel_signing():
+    n_inputs = 64
+    tx, keypairs = _unsigned_tx(n_inputs)
+    _, serial_time = timed(lambda: tx.sign(keypairs))
+    ptx, keypairs = _unsigned_tx(n_inputs)
+    _, parallel_time = timed(lambda: ptx.sign(keypairs, processes=2))
+    assert ptx.raw == tx.raw
+    return 'sign {} inputs: serial {:.4f}s 2 processes {:.4f}s'.format(
+        n_inputs, serial_time, parallel_time)
+
+@benchmark
+def chunk_bits():
+    headers = _daa_headers(2500)
+    chain = DictBlockchain(dict(headers))
+    chunk, data = _chunk(headers, chain, 400, 2016)
+    old, old_time = timed(
+        lambda: [chain.get_bits(header, chunk) for header in chunk.headers])
+    new, new_time = timed(lambda: chain.get_chunk_bits(chunk))
+    assert new == old
+    return 'chunk bits {} headers: get_bits {:.4f}s get_chunk_bits {:.4f}s'.format(
+        chunk.get_count(), old_time, new_time)
+
+@benchmark
+def batch_ecc():
+    # Full size runs are only quick with libsecp256k1
+    native = ecc_fast.is_batch_available()
+    derivations, verifications = (10000, 1000) if native else (500, 100)
+    _, _, _, _, c, cK = deserialize_xpub(Test_batch_ecc.xpub)
+    keys, derive_time = timed(lambda: CKD_pub_batch(cK, c, range(derivations)))
+    digests, secrets = _signing_items(verifications)
+    signed = sign_digests(digests, secrets, [True] * verifications)
+    items = [(digest, sig, public_key)
+             for digest, (sig, public_key) in zip(digests, signed)]
+    results, verify_time = timed(lambda: verify_digests(items))
+    assert len(keys) == derivations and all(results)
+    return '{} derivations {:.4f}s, {} verifications {:.4f}s ({})'.format(
+        derivations, derive_time, verifications, verify_time,
+        'libsecp256k1' if native else 'python-ecdsa')
+
+@benchmark
+def address_codecs():
+    # A million addresses takes the same per-address time, just longer
+    count = 20000
+    lines = []
+    for fmt in (Address.FMT_BITCOIN, Address.FMT_CASHADDR):
+        addresses = _addresses(count)
+        strings, encode_time = timed(lambda: Address.to_strings(fmt, addresses))
+        decoded, decode_time = timed(lambda: Address.from_strings(strings))
+        assert decoded == addresses
+        lines.append('{} {} addresses: encode {:.4f}s, decode {:.4f}s'.format(
+            count, 'cashaddr' if fmt else 'base58', encode_time, decode_time))
+    return '\n'.join(lines)
+
+@benchmark
+def coin_choosers():
+    values = [10000 + (n * 7919) % 990000 for n in range(2000)]
+    amount = values[10] + values[500] + values[1500] - 400
+    privacy, privacy_time = timed(lambda: _make_tx(CoinChooserPrivacy(), values, amount))
+    bnb, bnb_time = timed(lambda: _make_tx(CoinChooserBranchAndBound(), values, amount))
+    assert len(bnb.outputs()) == 1
+    return ('{} coins: privacy {:.4f}s ({} outputs), branch and bound {:.4f}s '
+            '({} outputs)'.format(len(values), privacy_time, len(privacy.outputs()),
+                                  bnb_time, len(bnb.outputs())))
+
+
+def main(names):
+    for name in names or benchmarks:
+        print(benchmarks[name]())
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
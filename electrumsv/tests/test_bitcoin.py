@@ -1,9 +1,10 @@
 import base64
+import hashlib
 import unittest
 import sys
 from ecdsa.util import number_to_string
 
-from electrumsv.address import Address
+from electrumsv.address import Address, Base58
 from electrumsv.bitcoin import (
     generator_secp256k1, point_to_ser, public_key_to_p2pkh, EC_KEY,
     bip32_root, bip32_public_derivation, bip32_private_derivation, pw_encode,
@@ -12,7 +13,10 @@ from electrumsv.bitcoin import (
     var_int, op_push, regenerate_key,
     verify_message, deserialize_privkey, serialize_privkey,
     is_minikey, is_compressed, is_xpub,
-    xpub_type, is_xprv, is_bip32_derivation, seed_type)
+    xpub_type, is_xprv, is_bip32_derivation, seed_type, deserialize_xpub,
+    CKD_pub, CKD_pub_batch, sign_digests, verify_digests, recover_public_keys,
+    compress_public_key, MySigningKey, SECP256k1)
+from electrumsv import cashaddr, ecc_fast
 from electrumsv.networks import NetworkConstants
 from electrumsv.util import bfh
 
@@ -347,3 +351,142 @@ class Test_seeds(unittest.TestCase):
     def test_seed_type(self):
         for seed_words, _type in self.mnemonics:
             self.assertEqual(_type, seed_type(seed_words), msg=seed_words)
+
+
+def _signing_items(count):
+    digests = [Hash(str(n).encode()) for n in range(count)]
+    secrets = [Hash(b'secret' + str(n % 10).encode()) for n in range(count)]
+    return digests, secrets
+
+
+class Test_batch_ecc(unittest.TestCase):
+
+    xpub = 'xpub6H1LXWLaKsWFhvm6RVpEL9P4KfRZSW7abD2ttkWP3SSQvnyA8FSVqNTEcYFgJS2UaFcxupHiYkro49S8yGasTvXEYBVPamhGW6cFJodrTHy'
+
+    def test_CKD_pub_batch(self):
+        _, _, _, _, c, cK = deserialize_xpub(self.xpub)
+        ns = list(range(10)) + [1000000000]
+        self.assertEqual(CKD_pub_batch(cK, c, ns), [CKD_pub(cK, c, n) for n in ns])
+        with self.assertRaises(Exception):
+            CKD_pub_batch(cK, c, [0x80000000])
+
+    def test_sign_digests(self):
+        digests, secrets = _signing_items(3)
+        results = sign_digests(digests, secrets, [True, False, True])
+        for digest, secret, compressed, (sig, public_key) in zip(
+                digests, secrets, [True, False, True], results):
+            private_key = MySigningKey.from_string(secret, curve=SECP256k1)
+            expected_sig = private_key.sign_digest_deterministic(
+                digest, hashfunc=hashlib.sha256, sigencode=ecdsa.util.sigencode_der)
+            self.assertEqual(sig, expected_sig)
+            self.assertEqual(public_key.hex(),
+                             public_key_from_private_key(secret, compressed))
+
+    def test_verify_digests(self):
+        digests, secrets = _signing_items(2)
+        (sig0, key0), (sig1, key1) = sign_digests(digests, secrets, [True, False])
+        items = [(digests[0], sig0, key0), (digests[1], sig1, key1),
+                 (digests[1], sig0, key0), (digests[0], sig0, key1),
+                 (digests[0], b'\x30\x00', key0)]
+        self.assertEqual(verify_digests(items), [True, True, False, False, False])
+
+    def test_recover_public_keys(self):
+        digests, secrets = _signing_items(1)
+        sig, public_key = sign_digests(digests, secrets, [True])[0]
+        order = generator_secp256k1.order()
+        r, s = ecdsa.util.sigdecode_der(sig, order)
+        sig_string = ecdsa.util.sigencode_string(r, s, order)
+        recovered = [compress_public_key(key)
+                     for key in recover_public_keys(sig_string, digests[0])
+                     if key is not None]
+        self.assertIn(public_key, recovered)
+
+    def test_batches(self):
+        _, _, _, _, c, cK = deserialize_xpub(self.xpub)
+        self.assertEqual(len(CKD_pub_batch(cK, c, range(50))), 50)
+        digests, secrets = _signing_items(20)
+        signed = sign_digests(digests, secrets, [True] * 20)
+        items = [(digest, sig, public_key)
+                 for digest, (sig, public_key) in zip(digests, signed)]
+        self.assertEqual(verify_digests(items), [True] * 20)
+
+
+def _base58_encode(be_bytes):
+    # The digit at a time encoding the bulk codec must agree with
+    value = int.from_bytes(be_bytes, 'big')
+    txt = ''
+    while value:
+        value, mod = divmod(value, 58)
+        txt = Base58.chars[mod] + txt
+    return '1' * (len(be_bytes) - len(be_bytes.lstrip(b'\0'))) + txt
+
+
+def _addresses(count):
+    # Fresh objects, so nothing is served from the string caches
+    return [Address(hashlib.sha256(n.to_bytes(4, 'big')).digest()[:20], n % 2)
+            for n in range(count)]
+
+
+class Test_address_codecs(unittest.TestCase):
+
+    def test_base58(self):
+        for n in range(300):
+            be_bytes = bytes(n % 3) + hashlib.sha256(n.to_bytes(2, 'big')).digest()[:n % 33]
+            txt = _base58_encode(be_bytes)
+            self.assertEqual(Base58.encode(be_bytes), txt)
+            if txt:
+                self.assertEqual(Base58.decode(txt), be_bytes)
+        for txt in ('0', '1O', 'z\u00e9'):
+            with self.assertRaises(Exception):
+                Base58.decode(txt)
+
+    def test_cashaddr(self):
+        for n in range(1, 70):
+            data = hashlib.sha256(bytes([n])).digest() * 3
+            data = data[:n]
+            values = cashaddr._convertbits(data, 8, 5, True)
+            self.assertEqual(cashaddr._bytes_to_5bit(data), values)
+            values = bytes(value & 31 for value in data)
+            self.assertEqual(cashaddr._5bit_to_bytes(values),
+                             cashaddr._convertbits(values, 5, 8, False))
+
+    def test_from_strings(self):
+        addresses = _addresses(50)
+        strings = Address.to_strings(Address.FMT_CASHADDR, addresses)
+        strings += Address.to_strings(Address.FMT_BITCOIN, addresses)
+        decoded = Address.from_strings(strings)
+        self.assertEqual(decoded, addresses * 2)
+        repeated = Address.from_strings(strings[:1] * 2)
+        self.assertIs(repeated[0], repeated[1])
+
+    def test_round_trip(self):
+        for fmt in (Address.FMT_BITCOIN, Address.FMT_CASHADDR):
+            addresses = _addresses(200)
+            strings = Address.to_strings(fmt, addresses)
+            self.assertEqual(strings, [address.to_string(fmt) for address in addresses])
+            self.assertEqual(Address.from_strings(strings), addresses)
+
+
+class Test_address_cache(unittest.TestCase):
+
+    def test_cached_encodings(self):
+        address = Address.from_string('1BpEi6DfDAUFd7GtittLSdBeYJvcoaVggu')
+        other = Address(address.hash160, address.kind)
+        self.assertEqual(address, other)
+        self.assertEqual(hash(address), hash(other))
+        for fmt in (Address.FMT_BITCOIN, Address.FMT_CASHADDR):
+            self.assertEqual(address.to_string(fmt), other.to_string(fmt))
+            self.assertIs(other.to_string(fmt), other.to_string(fmt))
+        self.assertEqual(address.to_scripthash_hex(), other.to_scripthash_hex())
+        self.assertIs(other.to_script(), other.to_script())
+
+    def test_network_change(self):
+        address = Address.from_string('1BpEi6DfDAUFd7GtittLSdBeYJvcoaVggu')
+        NetworkConstants.set_testnet()
+        try:
+            self.assertEqual(address.to_string(Address.FMT_BITCOIN),
+                             'mrLC19Je2BuWQDkWSTriGYPyQJXKkkBmCx')
+        finally:
+            NetworkConstants.set_mainnet()
+        self.assertEqual(address.to_string(Address.FMT_BITCOIN),
+                         '1BpEi6DfDAUFd7GtittLSdBeYJvcoaVggu')
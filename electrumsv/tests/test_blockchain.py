@@ -1,4 +1,9 @@
+import os
+import shutil
+import tempfile
 import unittest
+from unittest.mock import patch
+
 from electrumsv import blockchain as bc
 
 
@@ -74,3 +79,250 @@ class TestBlockchain(unittest.TestCase):
         # MTP(1010) is TimeStamp(1005), MTP(1004) is TimeStamp(999)
         hdr = {'block_height': block['block_height'] + 1}
         self.assertEqual(chain.get_bits(hdr, chunk), 0x1801b553)
+
+
+class DictBlockchain(bc.Blockchain):
+    '''A blockchain whose stored headers are kept in a dictionary.'''
+
+    def __init__(self, headers):
+        self.base_height = 0
+        self.parent_base_height = None
+        self.headers = headers
+
+    def read_header(self, height, chunk=None):
+        if chunk is not None and chunk.contains_height(height):
+            return chunk.get_header_at_height(height)
+        return self.headers.get(height)
+
+
+def _daa_headers(count):
+    # A chain under the November 2017 DAA with irregular block intervals
+    z = '00' * 32
+    block = {
+        'version': 4,
+        'prev_block_hash': z,
+        'merkle_root': z,
+        'timestamp': 1510600000,
+        'bits': 0x18015ddc,
+        'nonce': 0,
+        'block_height': 0
+    }
+    headers = {0: block}
+    chain = DictBlockchain(headers)
+    for height in range(1, count):
+        interval = (height * 7919) % 1500 - 200
+        if height < 200:
+            bits = block['bits']
+        else:
+            bits = chain.get_bits({'block_height': height,
+                                   'timestamp': block['timestamp'] + interval})
+        block = get_block(block, interval, bits)
+        headers[height] = block
+    return headers
+
+
+def _chunk(headers, chain, base_height, count):
+    data = b''.join(bytes.fromhex(bc.serialize_header(headers[height]))
+                    for height in range(base_height, base_height + count))
+    for height in range(base_height, base_height + count):
+        del chain.headers[height]
+    return bc.HeaderChunk(base_height, data), data
+
+
+class TestChunkBits(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.headers = _daa_headers(1300)
+
+    def test_matches_get_bits(self):
+        for base_height in (200, 300, 1000):
+            chain = DictBlockchain(dict(self.headers))
+            chunk, data = _chunk(self.headers, chain, base_height, 200)
+            expected = [chain.get_bits(header, chunk) for header in chunk.headers]
+            self.assertEqual(chain.get_chunk_bits(chunk), expected)
+            self.assertEqual(expected, [header['bits'] for header in chunk.headers])
+
+    def test_verify_chunk(self):
+        chain = DictBlockchain(dict(self.headers))
+        chunk, data = _chunk(self.headers, chain, 400, 100)
+        # The hashes link and the bits match, but these headers were never mined
+        with self.assertRaisesRegex(bc.VerifyError, 'insufficient proof of work'):
+            chain.verify_chunk(400, data)
+        data = data[:4] + bytes(32) + data[36:]
+        with self.assertRaisesRegex(bc.VerifyError, 'prev hash mismatch'):
+            chain.verify_chunk(400, data)
+
+
+class FakeConfig(object):
+
+    def __init__(self, path):
+        self.path = path
+
+
+class TestHeadersFile(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.chain = bc.Blockchain(FakeConfig(self.path), 0, None)
+        open(self.chain.path(), 'wb').close()
+        z = '00' * 32
+        block = {
+            'version': 4,
+            'prev_block_hash': z,
+            'merkle_root': z,
+            'timestamp': 1510600000,
+            'bits': 0x18015ddc,
+            'nonce': 0,
+            'block_height': 0
+        }
+        self.blocks = [block]
+        for n in range(9):
+            self.blocks.append(get_block(self.blocks[-1], 600, block['bits']))
+
+    def tearDown(self):
+        for chain in list(bc.blockchains.values()) + [self.chain]:
+            chain.close_mmap()
+        bc.blockchains.clear()
+        shutil.rmtree(self.path)
+
+    def _save_headers(self, chain, blocks):
+        for block in blocks:
+            chain.save_header(block)
+
+    def test_read_after_writes(self):
+        chain = self.chain
+        self.assertIsNone(chain.read_header(0))
+        for block in self.blocks[:5]:
+            chain.save_header(block)
+            self.assertEqual(chain.read_header(block['block_height']), block)
+        # The file has grown since it was mapped
+        for block in self.blocks[5:]:
+            chain.save_header(block)
+        for block in self.blocks[1:]:
+            height = block['block_height']
+            self.assertEqual(chain.read_header(height), block)
+            self.assertEqual(chain.get_hash(height), bc.hash_header(block))
+        self.assertIsNone(chain.read_header(10))
+
+        # Overwritten and truncated headers are not served from the cache
+        block = get_block(self.blocks[3], 300, self.blocks[3]['bits'])
+        chain.write(bytes.fromhex(bc.serialize_header(block)), 4 * bc.HEADER_SIZE)
+        self.assertEqual(chain.height(), 4)
+        self.assertEqual(chain.read_header(4), block)
+        self.assertIsNone(chain.read_header(5))
+        self.assertEqual(os.path.getsize(chain.path()), 5 * bc.HEADER_SIZE)
+
+    def test_appends_buffered(self):
+        chain = self.chain
+        self._save_headers(chain, self.blocks[:3])
+        self.assertEqual(os.path.getsize(chain.path()), 0)
+        self.assertEqual(chain.height(), 2)
+        self.assertEqual(chain.read_header(2), self.blocks[2])
+        chain.flush_if_due()
+        self.assertEqual(os.path.getsize(chain.path()), 0)
+        chain.flush_interval = 0
+        chain.flush_if_due()
+        self.assertEqual(os.path.getsize(chain.path()), 3 * bc.HEADER_SIZE)
+        self.assertEqual(chain.read_header(2), self.blocks[2])
+
+    def test_recover(self):
+        os.mkdir(os.path.join(self.path, 'forks'))
+        chain = bc.Blockchain(FakeConfig(self.path), 4, 0)
+        open(chain.path(), 'wb').close()
+        data = b''.join(bytes.fromhex(bc.serialize_header(block))
+                        for block in self.blocks[4:8])
+        chain.write(data, 0)
+        chain.flush()
+        with open(chain.path(), 'ab') as f:
+            # A header that does not link, one never written and a partial one
+            f.write(bytes.fromhex(bc.serialize_header(self.blocks[9])))
+            f.write(bytes(bc.HEADER_SIZE))
+            f.write(b'\1' * 30)
+        chain.close_mmap()
+        chain = bc.Blockchain(FakeConfig(self.path), 4, 0)
+        self.assertEqual(chain.height(), 7)
+        self.assertEqual(os.path.getsize(chain.path()), 4 * bc.HEADER_SIZE)
+        self.assertEqual(chain.read_header(7), self.blocks[7])
+        chain.close_mmap()
+
+    def test_fork_survives_crash(self):
+        os.mkdir(os.path.join(self.path, 'forks'))
+        main = self.chain
+        bc.blockchains[0] = main
+        self._save_headers(main, self.blocks[:5])
+        main.flush()
+        fork_block = get_block(self.blocks[3], 300, self.blocks[3]['bits'])
+        fork = main.fork(fork_block)
+        # Nothing more is flushed before the process dies
+        self.assertEqual(os.path.getsize(fork.path()), bc.HEADER_SIZE)
+        fork.close_mmap()
+        main.close_mmap()
+        # An empty fork file, as left by a crash before the fix
+        open(os.path.join(self.path, 'forks', 'fork_0_7'), 'wb').close()
+        bc.blockchains.clear()
+
+        chains = bc.read_blockchains(FakeConfig(self.path))
+        self.assertEqual(sorted(chains), [0, 4])
+        self.assertEqual(chains[4].height(), 4)
+        self.assertEqual(chains[4].read_header(4), fork_block)
+        self.assertFalse(os.path.exists(os.path.join(self.path, 'forks', 'fork_0_7')))
+
+    def test_swap_with_parent(self):
+        os.mkdir(os.path.join(self.path, 'forks'))
+        main = self.chain
+        bc.blockchains[0] = main
+        self._save_headers(main, self.blocks)
+        fork_blocks = [get_block(self.blocks[4], 300, self.blocks[4]['bits'])]
+        for n in range(6):
+            fork_blocks.append(get_block(fork_blocks[-1], 300, self.blocks[4]['bits']))
+        fork = main.fork(fork_blocks[0])
+        bc.blockchains[5] = fork
+        self._save_headers(fork, fork_blocks[1:])
+
+        # The fork is now the longer chain and has taken over the main headers file
+        self.assertEqual(fork.base_height, 0)
+        self.assertIsNone(fork.parent_base_height)
+        self.assertEqual(main.base_height, 5)
+        self.assertEqual(fork.height(), 11)
+        self.assertEqual(main.height(), 9)
+        for block in self.blocks[1:5] + fork_blocks:
+            self.assertEqual(fork.read_header(block['block_height']), block)
+        for block in self.blocks[5:]:
+            self.assertEqual(main.read_header(block['block_height']), block)
+        self.assertEqual(main.read_header(4), self.blocks[4])
+        self.assertEqual(os.listdir(os.path.join(self.path, 'forks')), ['fork_0_5'])
+
+    def test_swap_survives_crash(self):
+        fdir = os.path.join(self.path, 'forks')
+        os.mkdir(fdir)
+        main = self.chain
+        bc.blockchains[0] = main
+        self._save_headers(main, self.blocks)
+        fork_blocks = [get_block(self.blocks[4], 300, self.blocks[4]['bits'])]
+        for n in range(5):
+            fork_blocks.append(get_block(fork_blocks[-1], 300, self.blocks[4]['bits']))
+        fork = main.fork(fork_blocks[0])
+        bc.blockchains[5] = fork
+        self._save_headers(fork, fork_blocks[1:5])
+        # The process dies once the parent's headers have been copied aside
+        with patch.object(bc.Blockchain, 'finish_swap', side_effect=SystemExit):
+            with self.assertRaises(SystemExit):
+                fork.save_header(fork_blocks[5])
+        self.assertIn('swap_0_5', os.listdir(fdir))
+        fork.close_mmap()
+        main.close_mmap()
+        # Leftovers of a copy that was never completed
+        open(os.path.join(fdir, 'swap_0_7.tmp'), 'wb').close()
+        open(os.path.join(fdir, 'fork_0_5.swap'), 'wb').close()
+        bc.blockchains.clear()
+
+        chains = bc.read_blockchains(FakeConfig(self.path))
+        self.assertEqual(sorted(chains), [0, 5])
+        self.assertEqual(chains[0].height(), 10)
+        self.assertEqual(chains[5].height(), 9)
+        for block in self.blocks[:5] + fork_blocks:
+            self.assertEqual(chains[0].read_header(block['block_height']), block)
+        for block in self.blocks[5:]:
+            self.assertEqual(chains[5].read_header(block['block_height']), block)
+        self.assertEqual(sorted(os.listdir(fdir)), ['fork_0_5', 'fork_0_5.swap'])
@@ -0,0 +1,85 @@
+import unittest
+
+from electrumsv.address import Address
+from electrumsv.bitcoin import TYPE_ADDRESS
+from electrumsv import coinchooser
+from electrumsv.coinchooser import (
+    CoinChooserBranchAndBound, CoinChooserPrivacy, P2PKH_OUTPUT_SIZE, get_coin_chooser
+)
+
+PUBKEY = '0279be667ef9dcbbac55a06295ce870b07029bfcdb2dce28d959f2815b16f81798'
+ADDRESS = Address.from_pubkey(PUBKEY)
+
+
+def _coin(n, value, address=None):
+    return {
+        'type': 'p2pkh',
+        'address': address or Address.from_P2PKH_hash(n.to_bytes(20, 'big')),
+        'prevout_hash': '%064x' % n,
+        'prevout_n': 0,
+        'value': value,
+        'num_sig': 1,
+        'signatures': [None],
+        'x_pubkeys': [PUBKEY],
+        'pubkeys': [PUBKEY],
+    }
+
+
+def _fee_estimator(size):
+    return size
+
+
+class FakeConfig(object):
+    def __init__(self, values):
+        self.values = values
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+
+def _make_tx(chooser, values, amount):
+    coins = [_coin(n + 1, value) for n, value in enumerate(values)]
+    outputs = [(TYPE_ADDRESS, ADDRESS, amount)]
+    return chooser.make_tx(coins, outputs, [ADDRESS], _fee_estimator, 546)
+
+
+class TestBranchAndBound(unittest.TestCase):
+
+    def test_search(self):
+        chooser = CoinChooserBranchAndBound()
+        values = [50, 40, 30, 20, 10]
+        self.assertEqual([0, 3], chooser.branch_and_bound(values, 70, 70))
+        self.assertIsNone(chooser.branch_and_bound(values, 151, 200))
+        self.assertIsNone(chooser.branch_and_bound([50, 50], 60, 70))
+        # The closest to the target wins
+        self.assertEqual([0], chooser.branch_and_bound([100, 60, 45], 100, 110))
+
+    def test_changeless(self):
+        values = [20000, 300000, 1000000, 70000, 5000000]
+        tx = _make_tx(CoinChooserBranchAndBound(), values, 369300)
+        self.assertEqual(1, len(tx.outputs()))
+        self.assertEqual({300000, 70000}, {txin['value'] for txin in tx.inputs()})
+        self.assertLess(tx.get_fee(), tx.estimated_size() + P2PKH_OUTPUT_SIZE + 546)
+
+    def test_fallback(self):
+        # No subset comes close enough to the amount to drop the change
+        values = [1000000, 3000000]
+        tx = _make_tx(CoinChooserBranchAndBound(), values, 500000)
+        expected = _make_tx(CoinChooserPrivacy(), values, 500000)
+        self.assertEqual(2, len(tx.outputs()))
+        self.assertEqual(expected.serialize(), tx.serialize())
+
+    def test_config(self):
+        self.assertIsInstance(get_coin_chooser(FakeConfig({})), CoinChooserPrivacy)
+        config = FakeConfig({'coin_chooser': 'BranchAndBound'})
+        self.assertEqual('BranchAndBound', coinchooser.get_name(config))
+        self.assertIsInstance(get_coin_chooser(config), CoinChooserBranchAndBound)
+        config = FakeConfig({'coin_chooser': 'Unknown'})
+        self.assertEqual('Privacy', coinchooser.get_name(config))
+
+    def test_many_coins(self):
+        values = [10000 + (n * 7919) % 990000 for n in range(200)]
+        amount = values[10] + values[50] + values[150] - 400
+        tx = _make_tx(CoinChooserBranchAndBound(), values, amount)
+        self.assertEqual(1, len(tx.outputs()))
+        self.assertLess(tx.get_fee(), tx.estimated_size() + P2PKH_OUTPUT_SIZE + 546)
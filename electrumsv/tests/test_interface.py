@@ -1,6 +1,11 @@
+import json
+import selectors
+import socket
+import threading
+import time
 import unittest
 
-from electrumsv import interface
+from electrumsv import interface, network, util
 
 
 class TestInterface(unittest.TestCase):
@@ -24,3 +29,211 @@ class TestInterface(unittest.TestCase):
         self.assertTrue(i.check_host_name(
             peercert={'subject': [('commonName', 'foo.bar.com')]},
             name='foo.bar.com'))
+
+
+class FakeSocket(object):
+
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+        self.sent = b''
+
+    def settimeout(self, t):
+        pass
+
+    def recv(self, size):
+        if not self.chunks:
+            raise socket.timeout
+        return self.chunks.pop(0)
+
+    def send(self, data):
+        self.sent += bytes(data)
+        return len(data)
+
+
+class TestSocketPipe(unittest.TestCase):
+
+    def test_split_messages(self):
+        pipe = util.SocketPipe(FakeSocket([b'{"id": 1}\n{"id"', b': 2}\nbad\n', b'{"id": 3}\n']))
+        self.assertEqual(pipe.get(), {'id': 1})
+        self.assertEqual(pipe.get(), {'id': 2})
+        self.assertEqual(pipe.get(), {'id': 3})
+        with self.assertRaises(util.timeout):
+            pipe.get()
+        self.assertEqual(pipe.message, b'')
+
+    def test_batch_response(self):
+        pipe = util.SocketPipe(FakeSocket([b'[{"id": 1}, {"id": 2}]\n{"id": 3}\n']))
+        self.assertEqual([pipe.get() for n in range(3)], [{'id': 1}, {'id': 2}, {'id': 3}])
+
+    def test_partial_message_scanned_once(self):
+        pipe = util.SocketPipe(FakeSocket([b'{"id": 1}\n{"id": ', b'2', b'}\n']))
+        self.assertEqual(pipe.get(), {'id': 1})
+        self.assertIsNone(pipe.parse_message())
+        self.assertEqual((bytes(pipe.message), pipe.scanned), (b'{"id": ', 7))
+        self.assertEqual(pipe.get(), {'id': 2})
+
+    def test_crlf(self):
+        pipe = util.SocketPipe(FakeSocket([b'{"id": 1}\r\n{"id": 2}\r', b'\n']))
+        self.assertEqual([pipe.get() for n in range(2)], [{'id': 1}, {'id': 2}])
+
+    def test_closed(self):
+        pipe = util.SocketPipe(FakeSocket([b'{"id": 1}', b'']))
+        self.assertIsNone(pipe.get())
+
+    def test_send_requests(self):
+        fake = FakeSocket([])
+        i = interface.Interface('host:1:t', fake)
+        i.queue_request('server.version', [], 0)
+        i.queue_request('server.banner', [], 1)
+        i.send_requests()
+        self.assertEqual(fake.sent.count(b'\n'), 2)
+        self.assertEqual(set(i.unanswered_requests), {0, 1})
+
+        fake.sent = b''
+        i.batch_requests = True
+        i.queue_request('server.version', [], 2)
+        i.queue_request('server.banner', [], 3)
+        i.send_requests()
+        self.assertEqual(json.loads(fake.sent.decode()),
+                         [{'method': 'server.version', 'params': [], 'id': 2},
+                          {'method': 'server.banner', 'params': [], 'id': 3}])
+
+
+class TestFlowControl(unittest.TestCase):
+
+    def _interface(self, count):
+        i = interface.Interface('host:1:t', FakeSocket([]))
+        for n in range(count):
+            i.queue_request('blockchain.scripthash.get_history', [n], n)
+        return i
+
+    def test_window_limits_requests(self):
+        i = self._interface(300)
+        i.send_requests()
+        self.assertEqual(len(i.unanswered_requests), i.INITIAL_WINDOW)
+        self.assertEqual(i.num_requests(), 0)
+
+    def test_window_grows(self):
+        i = self._interface(300)
+        i.send_requests()
+        for n in range(100):
+            i.on_response(n, {'id': n, 'result': []})
+        # One more request per window of timely responses
+        self.assertAlmostEqual(i.window, 101, delta=0.1)
+        self.assertEqual(i.get_flow_status()['responses'], 100)
+
+    def test_window_cut(self):
+        i = self._interface(300)
+        i.send_requests()
+        i.on_response(0, {'id': 0, 'error': 'busy'})
+        self.assertEqual(i.window, i.INITIAL_WINDOW / 2)
+        # Sent before the cut, so no further cut
+        i.on_response(1, {'id': 1, 'error': 'busy'})
+        self.assertEqual(i.window, i.INITIAL_WINDOW / 2)
+        self.assertEqual(i.errors, 2)
+
+        # A slow response to a request sent after the cut
+        i.last_cut -= i.SLOW_RESPONSE * 4
+        i.send_times[2] = i.last_cut + i.SLOW_RESPONSE
+        i.on_response(2, {'id': 2, 'result': []})
+        self.assertEqual(i.window, i.INITIAL_WINDOW / 4)
+        self.assertGreaterEqual(i.request_timeout(), 20)
+
+
+class TestWakeupQueue(unittest.TestCase):
+
+    def test_put_wakes(self):
+        wakeups = []
+        q = network.WakeupQueue(lambda: wakeups.append(1))
+        q.put('connection')
+        self.assertEqual(wakeups, [1])
+        self.assertEqual(q.get_nowait(), 'connection')
+
+
+class FakeInterface(object):
+
+    def __init__(self, server):
+        self.server = server
+        self.sock, self.peer = socket.socketpair()
+        self.requests = 0
+        self.sends = 0
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def num_requests(self):
+        return self.requests
+
+    def send_requests(self):
+        self.sends += 1
+        self.requests = 0
+
+    def close(self):
+        self.sock.close()
+        self.peer.close()
+
+
+class TestSelectorLoop(unittest.TestCase):
+
+    def setUp(self):
+        # Just the parts of the network the selector loop uses
+        self.network = network.Network.__new__(network.Network)
+        self.network.interfaces = {}
+        self.network.interface = None
+        self.network.interface_lock = threading.RLock()
+        self.network.default_server = None
+        self.responses = []
+        self.network.process_responses = self.responses.append
+        self.network.open_selector()
+
+    def tearDown(self):
+        for interface in list(self.network.interfaces.values()):
+            self.network.close_interface(interface)
+        self.network.close_selector()
+
+    def test_register_and_unregister(self):
+        n = self.network
+        interface = n.interfaces['a'] = FakeInterface('a')
+        n.wait_on_sockets()
+        self.assertEqual(n.selector.get_key(interface).events, selectors.EVENT_READ)
+
+        interface.requests = 2
+        n.wait_on_sockets()
+        self.assertEqual(interface.sends, 1)
+        self.assertEqual(n.selector.get_key(interface).events,
+                         selectors.EVENT_READ | selectors.EVENT_WRITE)
+
+        interface.peer.send(b'{}\n')
+        n.wait_on_sockets()
+        self.assertEqual(self.responses, [interface])
+        self.assertEqual(n.selector.get_key(interface).events, selectors.EVENT_READ)
+
+        n.close_interface(interface)
+        self.assertEqual([key.fileobj for key in n.selector.get_map().values()],
+                         [n.wakeup_receiver])
+
+    def test_wakeup_interrupts_select(self):
+        n = self.network
+        n.select_timeout = 5.0
+        timer = threading.Timer(0.05, n.wakeup)
+        timer.start()
+        start = time.time()
+        n.wait_on_sockets()
+        self.assertLess(time.time() - start, 2.0)
+        timer.join()
+        # The wakeup was drained, so the next wait times out
+        n.select_timeout = 0.05
+        start = time.time()
+        n.wait_on_sockets()
+        self.assertGreaterEqual(time.time() - start, 0.04)
+
+    def test_close_selector(self):
+        n = self.network
+        selector, receiver, sender = n.selector, n.wakeup_receiver, n.wakeup_sender
+        n.close_selector()
+        self.assertEqual(receiver.fileno(), -1)
+        self.assertEqual(sender.fileno(), -1)
+        self.assertIsNone(selector.get_map())
+        # Waking a stopped network is harmless
+        n.wakeup()
+        n.open_selector()
@@ -1,9 +1,13 @@
 import unittest
 
 from electrumsv import transaction
-from electrumsv.address import Address
-from electrumsv.keystore import xpubkey_to_address
-from electrumsv.util import bh2u
+from electrumsv.address import Address, PublicKey
+from electrumsv.bitcoin import (
+    Hash, int_to_hex, var_int, public_key_from_private_key, serialize_privkey,
+    TYPE_ADDRESS
+)
+from electrumsv.keystore import Imported_KeyStore, xpubkey_to_address
+from electrumsv.util import bfh, bh2u
 
 unsigned_blob = '010000000149f35e43fefd22d8bb9e4b3ff294c6286154c25712baf6ab77b646e5074d6aed010000005701ff4c53ff0488b21e0000000000000000004f130d773e678a58366711837ec2e33ea601858262f8eaef246a7ebd19909c9a03c3b30e38ca7d797fee1223df1c9827b2a9f3379768f520910260220e0560014600002300feffffffd8e43201000000000118e43201000000001976a914e158fb15c888037fdc40fb9133b4c1c3c688706488ac5fbd0700'
 signed_blob = '010000000149f35e43fefd22d8bb9e4b3ff294c6286154c25712baf6ab77b646e5074d6aed010000006a473044022025bdc804c6fe30966f6822dc25086bc6bb0366016e68e880cf6efd2468921f3202200e665db0404f6d6d9f86f73838306ac55bb0d0f6040ac6047d4e820f24f46885412103b5bbebceeb33c1b61f649596b9c3611c6b2853a1f6b48bce05dd54f667fa2166feffffff0118e43201000000001976a914e158fb15c888037fdc40fb9133b4c1c3c688706488ac5fbd0700'
@@ -177,6 +181,131 @@ class TestTransaction(unittest.TestCase):
         self.assertEqual('2caab5a11fa1ec0f5bb014b8858d00fecf2c001e15d22ad04379ad7b36fef305', tx.txid())
 
 
+
+def _hex_serialize(tx):
+    # The ASCII hex string concatenation serialize() used before it was bytes-native
+    def serialize_input(txin):
+        script = tx.input_script(txin)
+        return (bh2u(bfh(txin['prevout_hash'])[::-1]) + int_to_hex(txin['prevout_n'], 4) +
+                var_int(len(script)//2) + script +
+                int_to_hex(txin.get('sequence', 0xffffffff - 1), 4))
+    def serialize_output(output):
+        script = tx.pay_script(output[1])
+        return int_to_hex(output[2], 8) + var_int(len(script)//2) + script
+    inputs = tx.inputs()
+    outputs = tx.outputs()
+    return (int_to_hex(tx.version, 4) +
+            var_int(len(inputs)) + ''.join(serialize_input(txin) for txin in inputs) +
+            var_int(len(outputs)) + ''.join(serialize_output(o) for o in outputs) +
+            int_to_hex(tx.locktime, 4))
+
+
+def _large_tx(n_inputs=500, n_outputs=50):
+    template = transaction.Transaction(signed_blob)
+    txin = template.inputs()[0]
+    inputs = []
+    for n in range(n_inputs):
+        txin = dict(txin)
+        txin['prevout_hash'] = bh2u(Hash(str(n).encode()))
+        txin['prevout_n'] = n % 3
+        inputs.append(txin)
+    outputs = template.outputs() * n_outputs
+    return transaction.Transaction.from_io(inputs, outputs, locktime=507231)
+
+
+class TestLargeTransaction(unittest.TestCase):
+
+    def test_serialize(self):
+        tx = _large_tx(50, 5)
+        old = _hex_serialize(tx)
+        self.assertEqual(bh2u(tx.serialize_bytes()), old)
+        self.assertEqual(tx.serialize(), old)
+
+    def test_deserialize(self):
+        raw = _large_tx(50, 5).serialize()
+        new = transaction.deserialize(bfh(raw))
+        self.assertEqual(transaction.deserialize(raw), new)
+        self.assertEqual(len(new['inputs']), 50)
+
+    def test_sighash_parts_cached(self):
+        tx = _large_tx(n_inputs=10, n_outputs=2)
+        for txin in tx.inputs():
+            txin['value'] = 20112600
+
+        def fresh():
+            return transaction.Transaction.from_io(tx.inputs(), tx.outputs(),
+                                                   locktime=tx.locktime)
+
+        parts = tx.sighash_parts()
+        self.assertIs(tx.sighash_parts(), parts)
+        self.assertEqual(tx.serialize_preimage(3), fresh().serialize_preimage(3))
+
+        tx.add_outputs(tx.outputs()[:1])
+        self.assertNotEqual(tx.sighash_parts()[2], parts[2])
+        self.assertEqual(tx.serialize_preimage(3), fresh().serialize_preimage(3))
+
+        tx.add_inputs([dict(tx.inputs()[0], prevout_n=7)])
+        tx.BIP_LI01_sort()
+        self.assertNotEqual(tx.sighash_parts()[0], parts[0])
+        self.assertEqual(tx.serialize_preimage(3), fresh().serialize_preimage(3))
+
+        tx.locktime += 1
+        self.assertEqual(tx.serialize_preimage(3), fresh().serialize_preimage(3))
+
+
+
+def _unsigned_tx(n_inputs):
+    keypairs = {}
+    inputs = []
+    for n in range(n_inputs):
+        sec = (n + 1).to_bytes(32, 'big')
+        pubkey = public_key_from_private_key(sec, True)
+        keypairs[pubkey] = (sec, True)
+        inputs.append({
+            'type': 'p2pkh',
+            'address': PublicKey.from_string(pubkey).address,
+            'prevout_hash': bh2u(Hash(str(n).encode())),
+            'prevout_n': 0,
+            'value': 10000,
+            'num_sig': 1,
+            'signatures': [None],
+            'x_pubkeys': [pubkey],
+            'pubkeys': [pubkey],
+        })
+    outputs = [(TYPE_ADDRESS, Address.from_string('1MYXdf4moacvaEKZ57ozerpJ3t9xSeN6LK'),
+                n_inputs * 9000)]
+    return transaction.Transaction.from_io(inputs, outputs), keypairs
+
+
+class TestParallelSigning(unittest.TestCase):
+
+    def test_matches_serial(self):
+        tx, keypairs = _unsigned_tx(16)
+        tx.sign(keypairs)
+        self.assertTrue(tx.is_complete())
+        ptx, keypairs = _unsigned_tx(16)
+        ptx.sign(keypairs, processes=2)
+        self.assertEqual(ptx.raw, tx.raw)
+
+    def test_keystore_passes_processes(self):
+        tx, keypairs = _unsigned_tx(16)
+        tx.sign(keypairs)
+        ptx, keypairs = _unsigned_tx(16)
+        keystore = Imported_KeyStore({})
+        for sec, compressed in keypairs.values():
+            keystore.import_privkey(serialize_privkey(sec, compressed, 'p2pkh'), None)
+        keystore.sign_transaction(ptx, None, processes=2)
+        self.assertEqual(ptx.raw, tx.raw)
+
+    def test_partial_keys(self):
+        tx, keypairs = _unsigned_tx(4)
+        del keypairs[tx.inputs()[1]['x_pubkeys'][0]]
+        tx.sign(keypairs, processes=2)
+        self.assertFalse(tx.is_complete())
+        self.assertEqual([bool(txin['signatures'][0]) for txin in tx.inputs()],
+                         [True, False, True, True])
+
+
 class NetworkMock(object):
 
     def __init__(self, unspent):
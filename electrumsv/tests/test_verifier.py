@@ -0,0 +1,80 @@
+import unittest
+
+from electrumsv.verifier import SPV
+
+
+class FakeBlockchain(object):
+
+    def __init__(self, headers):
+        self.headers = headers
+
+    def read_header(self, height):
+        return self.headers.get(height)
+
+
+class FakeInterface(object):
+
+    def __init__(self, blockchain):
+        self.blockchain = blockchain
+        self.server = 'server'
+
+
+class FakeNetwork(object):
+
+    def __init__(self, height):
+        self.height = height
+        self.interface = FakeInterface(FakeBlockchain({h: {} for h in range(1, height+1)}))
+        self.requested_chunks = set()
+        self.merkle_requests = []
+
+    def blockchain(self):
+        return self.interface.blockchain
+
+    def get_local_height(self):
+        return self.height
+
+    def get_merkle_for_transaction(self, tx_hash, tx_height, callback):
+        self.merkle_requests.append(tx_hash)
+
+
+class FakeWallet(object):
+
+    def __init__(self, unverified):
+        self.unverified_tx = unverified
+
+    def get_unverified_txs(self):
+        return self.unverified_tx
+
+
+class TestSPV(unittest.TestCase):
+
+    def test_only_queued_requested(self):
+        network = FakeNetwork(100)
+        wallet = FakeWallet({'a': 50, 'b': 0})
+        spv = SPV(network, wallet)
+        spv.run()
+        self.assertEqual(network.merkle_requests, ['a'])
+
+        # Nothing new is queued, so nothing is looked at
+        wallet.unverified_tx['c'] = 60
+        spv.run()
+        self.assertEqual(network.merkle_requests, ['a'])
+
+        spv.add('c')
+        spv.run()
+        self.assertEqual(network.merkle_requests, ['a', 'c'])
+
+    def test_waits_for_header(self):
+        network = FakeNetwork(100)
+        wallet = FakeWallet({'a': 101})
+        spv = SPV(network, wallet)
+        spv.run()
+        spv.run()
+        self.assertEqual(network.merkle_requests, [])
+        self.assertEqual(spv.waiting, {'a'})
+
+        network.height = 101
+        network.interface.blockchain.headers[101] = {}
+        spv.run()
+        self.assertEqual(network.merkle_requests, ['a'])
+        self.assertEqual(spv.waiting, set())
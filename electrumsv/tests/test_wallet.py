@@ -4,9 +4,22 @@ import os
 import shutil
 import sys
 import tempfile
+import threading
 import unittest
+from unittest.mock import patch
 
-from electrumsv.storage import WalletStorage, FINAL_SEED_VERSION
+from electrumsv import keystore
+from electrumsv.address import Address
+from electrumsv.bitcoin import TYPE_ADDRESS
+from electrumsv.commands import Commands
+from electrumsv.keystore import Xpub
+from electrumsv.storage import (
+    WalletStorage, SqliteWalletStorage, FINAL_SEED_VERSION, migrate_to_sqlite
+)
+from electrumsv.transaction import Transaction
+from electrumsv.wallet import (
+    ImportedAddressWallet, Standard_Wallet, TransactionCache
+)
 
 
 class FakeSynchronizer(object):
@@ -67,3 +80,566 @@ class TestWalletStorage(WalletTestCase):
         with open(self.wallet_path, "r") as f:
             contents = f.read()
         self.assertEqual(some_dict, json.loads(contents))
+
+    def test_readonly_get(self):
+        storage = WalletStorage(self.wallet_path)
+        storage.put('d', {'a': [1, 2]})
+        storage.put('l', ['x', 'y'])
+        d = storage.get('d', readonly=True)
+        self.assertEqual({'a': [1, 2]}, dict(d))
+        with self.assertRaises(TypeError):
+            d['b'] = 1
+        self.assertEqual(('x', 'y'), storage.get('l', readonly=True))
+        self.assertEqual({}, storage.get('missing', {}, readonly=True))
+
+    def test_put_without_copy(self):
+        storage = WalletStorage(self.wallet_path)
+        value = {'a': 'b'}
+        storage.put('d', value, copy_value=False, validate=False)
+        self.assertIs(value, storage.data['d'])
+        storage.put('e', {'a': 'b'})
+        self.assertIsNot(value, storage.data['e'])
+        # invalid values are still refused when validating
+        storage.put('f', {'a': object()})
+        self.assertIsNone(storage.get('f'))
+
+
+class TestSqliteWalletStorage(WalletTestCase):
+
+    def _row_count(self, storage, table):
+        return storage.conn.execute('SELECT COUNT(*) FROM "{}"'.format(table)).fetchone()[0]
+
+    def test_new_file_created_on_write(self):
+        storage = SqliteWalletStorage(self.wallet_path)
+        self.assertFalse(storage.file_exists())
+        storage.put('a', 'b')
+        storage.write()
+        self.assertTrue(storage.file_exists())
+
+    def test_write_and_read(self):
+        storage = SqliteWalletStorage(self.wallet_path)
+        storage.put('labels', {'x': 'label x', 'y': 'label y'})
+        storage.put('txi', {'aa': {'addr': [['bb:0', 100]]}})
+        storage.put('addresses', ['1abc'])
+        storage.put('use_change', False)
+        storage.write()
+
+        storage = WalletStorage(self.wallet_path)
+        self.assertIsInstance(storage, SqliteWalletStorage)
+        self.assertEqual({'x': 'label x', 'y': 'label y'}, storage.get('labels'))
+        self.assertEqual({'aa': {'addr': [['bb:0', 100]]}}, storage.get('txi'))
+        self.assertEqual(['1abc'], storage.get('addresses'))
+        self.assertEqual(False, storage.get('use_change'))
+        self.assertEqual(FINAL_SEED_VERSION, storage.get('seed_version'))
+        self.assertEqual(2, self._row_count(storage, 'labels'))
+
+    def test_only_changed_rows_written(self):
+        storage = SqliteWalletStorage(self.wallet_path)
+        labels = {str(i): 'label {}'.format(i) for i in range(100)}
+        storage.put('labels', labels)
+        storage.write()
+
+        labels['5'] = 'changed'
+        labels['100'] = 'added'
+        del labels['7']
+        storage.put('labels', labels)
+        self.assertEqual({'labels': {'5', '7', '100'}}, storage._dirty_rows)
+        storage.write()
+        self.assertEqual({}, storage._dirty_rows)
+
+        storage = WalletStorage(self.wallet_path)
+        self.assertEqual(labels, storage.get('labels'))
+
+    def test_put_rows(self):
+        storage = SqliteWalletStorage(self.wallet_path)
+        storage.put_rows('labels', {'x': 'label x', 'y': 'label y'})
+        storage.write()
+
+        storage.put_rows('labels', {'x': 'label x', 'y': 'changed', 'z': 'label z'},
+                         ['w', 'x'])
+        self.assertEqual({'labels': {'x', 'y', 'z'}}, storage._dirty_rows)
+        storage.write()
+
+        storage = WalletStorage(self.wallet_path)
+        self.assertEqual({'y': 'changed', 'z': 'label z'}, storage.get('labels'))
+
+    def test_migrate_from_json(self):
+        storage = WalletStorage(self.wallet_path)
+        storage.put('labels', {'x': 'label x'})
+        storage.put('frozen_coins', ['aa:0'])
+        storage.write()
+
+        new_storage = migrate_to_sqlite(storage)
+        self.assertIsInstance(new_storage, SqliteWalletStorage)
+        self.assertTrue(os.path.exists(self.wallet_path + '.json'))
+        storage = WalletStorage(self.wallet_path)
+        self.assertIsInstance(storage, SqliteWalletStorage)
+        self.assertEqual({'x': 'label x'}, storage.get('labels'))
+        self.assertEqual(['aa:0'], storage.get('frozen_coins'))
+
+
+    def test_migrate_failure_keeps_original(self):
+        storage = WalletStorage(self.wallet_path)
+        storage.put('labels', {'x': 'label x'})
+        storage.write()
+
+        with patch.object(SqliteWalletStorage, '_write', side_effect=IOError):
+            with self.assertRaises(IOError):
+                migrate_to_sqlite(storage)
+        self.assertEqual(['somewallet'], os.listdir(self.user_dir))
+        storage = WalletStorage(self.wallet_path)
+        self.assertNotIsInstance(storage, SqliteWalletStorage)
+        self.assertEqual({'x': 'label x'}, storage.get('labels'))
+
+        # A '.json' file left by an earlier conversion does not stop this one
+        open(self.wallet_path + '.json', 'w').close()
+        migrate_to_sqlite(storage).close()
+        storage = WalletStorage(self.wallet_path)
+        self.assertIsInstance(storage, SqliteWalletStorage)
+        storage.close()
+        with open(self.wallet_path + '.json') as f:
+            self.assertIn('label x', f.read())
+
+
+class TestTransactionCache(unittest.TestCase):
+    signed_blob = ('010000000149f35e43fefd22d8bb9e4b3ff294c6286154c25712baf6ab77b646e5074d6aed'
+                   '010000006a473044022025bdc804c6fe30966f6822dc25086bc6bb0366016e68e880cf6e'
+                   'fd2468921f3202200e665db0404f6d6d9f86f73838306ac55bb0d0f6040ac6047d4e820f'
+                   '24f46885412103b5bbebceeb33c1b61f649596b9c3611c6b2853a1f6b48bce05dd54f667'
+                   'fa2166feffffff0118e43201000000001976a914e158fb15c888037fdc40fb9133b4c1c3'
+                   'c688706488ac5fbd0700')
+
+    def test_lazy_lookup(self):
+        cache = TransactionCache([('a', self.signed_blob)])
+        self.assertEqual(0, len(cache._cache))
+        self.assertIn('a', cache)
+        self.assertEqual(len(self.signed_blob) // 2, cache.raw_size('a'))
+        tx = cache['a']
+        self.assertEqual(self.signed_blob, str(tx))
+        self.assertIs(tx, cache.get('a'))
+        self.assertEqual([('a', self.signed_blob)], cache.raw_items())
+        self.assertIsNone(cache.get('b'))
+
+    def test_eviction(self):
+        cache = TransactionCache((str(i), self.signed_blob) for i in range(5))
+        cache.max_cached = 2
+        first = cache['0']
+        cache['1'], cache['2']
+        self.assertEqual(['1', '2'], list(cache._cache))
+        self.assertIsNot(first, cache['0'])
+        del cache['0']
+        self.assertEqual(['1', '2', '3', '4'], sorted(cache))
+
+
+def _make_tx(inputs, outputs, keypairs):
+    tx = Transaction.from_io(inputs, outputs)
+    tx.sign(keypairs)
+    return tx
+
+
+class TestWalletCoins(WalletTestCase):
+    '''Exercises the wallet's incremental coin and balance tracking.'''
+
+    # Private keys 1 and 2 with their compressed public keys
+    keys = [
+        (b'\0' * 31 + b'\1',
+         '0279be667ef9dcbbac55a06295ce870b07029bfcdb2dce28d959f2815b16f81798'),
+        (b'\0' * 31 + b'\2',
+         '02c6047f9441ed7d6d3045406e95c07cd85c778e4b8cef3ca7abac09b95c709ee5'),
+    ]
+
+    def setUp(self):
+        super().setUp()
+        self.addresses = [Address.from_pubkey(pubkey) for sec, pubkey in self.keys]
+        storage = WalletStorage(self.wallet_path)
+        self.wallet = ImportedAddressWallet(storage)
+        for address in self.addresses:
+            self.wallet.import_address(address)
+
+    def _spend(self, key_index, prevout_hash, prevout_n, value, outputs):
+        sec, pubkey = self.keys[key_index]
+        txin = {
+            'type': 'p2pkh',
+            'address': self.addresses[key_index],
+            'prevout_hash': prevout_hash,
+            'prevout_n': prevout_n,
+            'value': value,
+            'num_sig': 1,
+            'signatures': [None],
+            'x_pubkeys': [pubkey],
+            'pubkeys': [pubkey],
+        }
+        outputs = [(TYPE_ADDRESS, addr, v) for addr, v in outputs]
+        return _make_tx([txin], outputs, {pubkey: (sec, True)})
+
+    def _receive(self, tx, height):
+        tx_hash = tx.txid()
+        for address in self.addresses:
+            if tx.has_address(address):
+                hist = self.wallet.get_address_history(address) + [(tx_hash, height)]
+                self.wallet.receive_history_callback(address, hist, {})
+        self.wallet.receive_tx_callback(tx_hash, tx, height)
+        return tx_hash
+
+    def test_utxos_follow_transactions(self):
+        a0, a1 = self.addresses
+        fund = self._spend(1, 'ab' * 32, 0, 100000, [(a0, 60000), (a0, 30000)])
+        fund_hash = self._receive(fund, 100)
+        coins = self.wallet.get_utxos()
+        self.assertEqual({(c['prevout_hash'], c['prevout_n']) for c in coins},
+                         {(fund_hash, 0), (fund_hash, 1)})
+        self.assertEqual(100, coins[0]['height'])
+        self.assertEqual(sorted([30000, 60000]), sorted(c['value'] for c in coins))
+
+        spend = self._spend(0, fund_hash, 0, 60000, [(a1, 50000)])
+        spend_hash = self._receive(spend, 0)
+        coins = self.wallet.get_utxos()
+        self.assertEqual({(c['prevout_hash'], c['prevout_n']) for c in coins},
+                         {(fund_hash, 1), (spend_hash, 0)})
+        self.assertEqual([], self.wallet.get_utxos(confirmed_only=True, domain=[a1]))
+        self.assertEqual(list(self.wallet.get_addr_utxo(a1)), [spend_hash + ':0'])
+
+        # Dropping the spend from the history restores the spent coin.
+        self.wallet.receive_history_callback(a1, [], {})
+        self.wallet.receive_history_callback(a0, [(fund_hash, 100)], {})
+        coins = self.wallet.get_utxos()
+        self.assertEqual({(c['prevout_hash'], c['prevout_n']) for c in coins},
+                         {(fund_hash, 0), (fund_hash, 1)})
+
+    def test_frozen_coins_excluded(self):
+        a0, a1 = self.addresses
+        fund = self._spend(1, 'cd' * 32, 0, 100000, [(a0, 60000), (a0, 30000)])
+        fund_hash = self._receive(fund, 100)
+        self.wallet.set_frozen_coin_state([fund_hash + ':0'], True)
+        coins = self.wallet.get_utxos(exclude_frozen=True)
+        self.assertEqual([(fund_hash, 1)], [(c['prevout_hash'], c['prevout_n']) for c in coins])
+        self.wallet.set_frozen_state([a0], True)
+        self.assertEqual([], self.wallet.get_utxos(exclude_frozen=True))
+        self.assertEqual(2, len(self.wallet.get_utxos()))
+
+    def test_balances_follow_transactions(self):
+        a0, a1 = self.addresses
+        fund = self._spend(1, 'ef' * 32, 0, 100000, [(a0, 60000), (a0, 30000)])
+        fund_hash = self._receive(fund, 100)
+        self.assertEqual((90000, 0, 0), self.wallet.get_balance())
+        self.assertEqual((90000, 0, 0), self.wallet.get_addr_balance(a0))
+
+        spend = self._spend(0, fund_hash, 0, 60000, [(a1, 50000)])
+        self._receive(spend, 0)
+        # the unconfirmed spend is deducted from the unconfirmed balance
+        self.assertEqual((90000, -60000, 0), self.wallet.get_addr_balance(a0))
+        self.assertEqual((0, 50000, 0), self.wallet.get_addr_balance(a1))
+        self.assertEqual((90000, -10000, 0), self.wallet.get_balance())
+
+        self.wallet.set_frozen_coin_state([fund_hash + ':1'], True)
+        self.assertEqual((60000, -10000, 0),
+                         self.wallet.get_balance(exclude_frozen_coins=True))
+        self.assertEqual((30000, 0, 0), self.wallet.get_frozen_balance())
+        self.wallet.set_frozen_coin_state([fund_hash + ':1'], False)
+        self.wallet.set_frozen_state([a1], True)
+        self.assertEqual((0, 50000, 0), self.wallet.get_frozen_balance())
+        self.assertEqual((90000, -60000, 0),
+                         self.wallet.get_balance(exclude_frozen_addresses=True))
+
+    def test_delete_address(self):
+        a0, a1 = self.addresses
+        self.assertTrue(self.wallet.is_mine(a1))
+        self.wallet.delete_address(a1)
+        self.assertFalse(self.wallet.is_mine(a1))
+        self.assertTrue(self.wallet.is_mine(a0))
+        self.wallet.import_address(a1)
+        self.assertTrue(self.wallet.is_mine(a1))
+
+    def test_remove_transaction_prunes_spends(self):
+        a0, a1 = self.addresses
+        fund = self._spend(1, '12' * 32, 0, 100000, [(a0, 60000)])
+        fund_hash = self._receive(fund, 100)
+        spend = self._spend(0, fund_hash, 0, 60000, [(a1, 50000)])
+        spend_hash = self._receive(spend, 101)
+        self.assertEqual({a0: [(fund_hash + ':0', 60000)]}, self.wallet.txi[spend_hash])
+
+        self.wallet.remove_transaction(fund_hash)
+        self.assertEqual(spend_hash, self.wallet.pruned_txo[fund_hash + ':0'])
+        self.assertEqual({}, self.wallet.txi[spend_hash])
+        self.assertIsNone(self.wallet.get_tx_delta(spend_hash, a1))
+
+        self.wallet.add_transaction(fund_hash, fund)
+        self.assertNotIn(fund_hash + ':0', self.wallet.pruned_txo)
+        self.assertEqual({a0: [(fund_hash + ':0', 60000)]}, self.wallet.txi[spend_hash])
+        self.assertEqual(50000, self.wallet.get_tx_delta(spend_hash, a1))
+
+    def test_save_only_changes(self):
+        a0, a1 = self.addresses
+        self.wallet.migrate_storage()
+        storage = self.wallet.storage
+        fund = self._spend(1, '9a' * 32, 0, 100000, [(a0, 60000)])
+        fund_hash = self._receive(fund, 100)
+        self.wallet.save_transactions(write=True)
+
+        spend = self._spend(0, fund_hash, 0, 60000, [(a1, 50000)])
+        spend_hash = self._receive(spend, 101)
+        with patch.object(storage, 'put', wraps=storage.put) as put:
+            self.wallet.save_transactions()
+        put.assert_not_called()
+        self.assertEqual({spend_hash}, storage._dirty_rows['txi'])
+        self.assertEqual({a0.to_storage_string(), a1.to_storage_string()},
+                         storage._dirty_rows['addr_history'])
+        storage.write()
+
+        self.wallet.remove_transaction(fund_hash)
+        self.wallet.save_transactions(write=True)
+        self.wallet.storage.close()
+        wallet = ImportedAddressWallet(WalletStorage(self.wallet_path))
+        self.assertEqual(self.wallet.txi, wallet.txi)
+        self.assertEqual(self.wallet.txo, wallet.txo)
+        self.assertEqual({fund_hash + ':0': spend_hash}, wallet.pruned_txo)
+        for addr in self.addresses:
+            self.assertEqual(self.wallet.get_address_history(addr),
+                             [tuple(item) for item in wallet.get_address_history(addr)])
+        self.assertEqual(spend.raw, wallet.transactions[spend_hash].raw)
+        wallet.storage.close()
+
+    def _check_history(self):
+        wallet = self.wallet
+        expected = wallet.get_history(wallet.get_addresses())
+        self.assertEqual(wallet.get_history(), expected)
+        return expected
+
+    def test_history_follows_transactions(self):
+        a0, a1 = self.addresses
+        fund = self._spend(1, '34' * 32, 0, 100000, [(a0, 60000), (a0, 30000)])
+        fund_hash = self._receive(fund, 100)
+        spend = self._spend(0, fund_hash, 0, 60000, [(a1, 50000)])
+        spend_hash = self._receive(spend, 0)
+        history = self._check_history()
+        self.assertEqual([row[0] for row in history], [fund_hash, spend_hash])
+        # The funding input is from an unknown transaction, so its delta is unknown
+        self.assertEqual([row[4] for row in history], [None, -10000])
+        self.assertEqual([row[5] for row in history], [90000, 80000])
+
+        # Confirmed in a block below the funding transaction's position
+        for address in self.addresses:
+            hist = [(tx_hash, 101 if tx_hash == spend_hash else height)
+                    for tx_hash, height in self.wallet.get_address_history(address)]
+            self.wallet.receive_history_callback(address, hist, {})
+        history = self._check_history()
+        self.assertEqual(history[1][1], 101)
+
+        self.assertEqual(self.wallet.get_history(offset=1), history[1:])
+        self.assertEqual(self.wallet.get_history(limit=1), history[:1])
+        self.assertEqual(self.wallet.get_history(from_height=101), history[1:])
+        self.assertEqual(self.wallet.get_history(to_height=101), history[:1])
+        self.assertEqual(self.wallet.get_history(from_height=102), [])
+
+        # Dropped from the histories, as on a reorg
+        for address in self.addresses:
+            hist = [(tx_hash, height)
+                    for tx_hash, height in self.wallet.get_address_history(address)
+                    if tx_hash != spend_hash]
+            self.wallet.receive_history_callback(address, hist, {})
+        history = self._check_history()
+        self.assertEqual([row[0] for row in history], [fund_hash])
+
+        self.wallet.remove_transaction(fund_hash)
+        history = self._check_history()
+        self.assertEqual(history[0][4], 0)
+
+    def test_history_marks_from_other_threads(self):
+        a0, a1 = self.addresses
+        hashes = [self._receive(self._spend(1, '%02x' % (n + 64) * 32, 0, 100000,
+                                            [(a0, 1000 * (n + 1))]), 100 + n)
+                  for n in range(3)]
+        self.wallet.get_history()
+        self.wallet.add_unverified_tx(hashes[1], 101)
+
+        # Another thread is part way through marking rows while they are recomputed
+        started = threading.Event()
+        recomputing = threading.Event()
+        def tx_hashes():
+            yield hashes[1]
+            started.set()
+            recomputing.wait(0.2)
+            self.wallet.unverified_tx[hashes[0]] = 120
+            yield hashes[0]
+        thread = threading.Thread(target=self.wallet._invalidate_history,
+                                  args=(tx_hashes(),))
+        thread.start()
+        started.wait()
+        get_tx_delta = self.wallet.get_tx_delta
+        def recomputing_get_tx_delta(tx_hash, address):
+            recomputing.set()
+            thread.join(0.1)
+            return get_tx_delta(tx_hash, address)
+        with patch.object(self.wallet, 'get_tx_delta', side_effect=recomputing_get_tx_delta):
+            self.wallet.get_history()
+        thread.join()
+        history = self.wallet.get_history()
+        self.assertEqual((hashes[0], 120), history[-1][:2])
+        self._check_history()
+
+    def test_migrate_storage_command(self):
+        a0, a1 = self.addresses
+        fund = self._spend(1, '78' * 32, 0, 100000, [(a0, 60000)])
+        fund_hash = self._receive(fund, 100)
+        self.wallet.set_label(fund_hash, 'fund')
+
+        result = Commands(None, self.wallet, None).migratestorage()
+        self.assertEqual({'converted': True, 'path': self.wallet_path}, result)
+        self.assertIsInstance(self.wallet.storage, SqliteWalletStorage)
+        self.assertIs(self.wallet.storage, self.wallet.contacts.storage)
+        self.assertTrue(os.path.exists(self.wallet_path + '.json'))
+
+        self.wallet.storage.close()
+        wallet = ImportedAddressWallet(WalletStorage(self.wallet_path))
+        self.assertIsInstance(wallet.storage, SqliteWalletStorage)
+        self.assertEqual(self.wallet.txo, wallet.txo)
+        self.assertEqual((60000, 0, 0), wallet.get_balance())
+        self.assertEqual('fund', wallet.get_label(fund_hash))
+        wallet.storage.close()
+
+    def test_export_history_changed_between_pages(self):
+        a0, a1 = self.addresses
+        for n in range(5):
+            tx = self._spend(1, '%02x' % (n + 16) * 32, 0, 100000, [(a0, 1000 * (n + 1))])
+            self._receive(tx, 200 + n)
+        self.wallet.export_page_size = 2
+        wallet = self.wallet
+        expected = wallet.export_history()
+        # Confirmed below the rows already read, which shifts every later row
+        change_history = lambda: self._receive(
+            self._spend(1, '99' * 32, 0, 100000, [(a0, 7000)]), 150)
+
+        class ChangingFx(object):
+            calls = 0
+            def history_rates(self, d_ts):
+                self.calls += 1
+                # The first page has been read when the history changes
+                if self.calls == 1:
+                    change_history()
+                return {d_t.date(): None for d_t in d_ts}
+            def value_str(self, satoshis, rate):
+                return 'No data'
+
+        # The export is of the history as it was when the export started
+        items = wallet.export_history(fx=ChangingFx())
+        self.assertEqual(5, len(items))
+        self.assertEqual([(item['txid'], item['balance']) for item in items],
+                         [(item['txid'], item['balance']) for item in expected])
+        self.assertEqual(6, len(wallet.export_history()))
+
+        f = StringIO()
+        wallet.write_export_history(f, False)
+        self.assertEqual(f.getvalue(), json.dumps(wallet.export_history(), indent=4))
+
+    def test_addresses_interned_on_load(self):
+        a0, a1 = self.addresses
+        fund = self._spend(1, '56' * 32, 0, 100000, [(a0, 60000), (a0, 30000)])
+        fund_hash = self._receive(fund, 100)
+        spend = self._spend(0, fund_hash, 0, 60000, [(a1, 50000)])
+        spend_hash = self._receive(spend, 101)
+        self.wallet.save_transactions(write=True)
+
+        with patch.object(Address, 'from_string', wraps=Address.from_string) as from_string:
+            wallet = ImportedAddressWallet(WalletStorage(self.wallet_path))
+        # One decode per distinct address, however often it is stored
+        decoded = [args[0] for args, kwargs in from_string.call_args_list]
+        self.assertTrue(decoded)
+        self.assertEqual(sorted(decoded), sorted(set(decoded)))
+        self.assertEqual(2, len(wallet._addresses))
+        stored = {address: address for address in wallet.get_addresses()}
+        for d in (wallet.txi[spend_hash], wallet.txo[fund_hash], wallet.txo[spend_hash],
+                  wallet._history):
+            for address in d:
+                self.assertIs(stored[address], address)
+        self.assertEqual(self.wallet.txo, wallet.txo)
+        self.assertEqual(self.wallet.txi, wallet.txi)
+
+    def test_export_history_streams(self):
+        a0, a1 = self.addresses
+        hashes = []
+        for n in range(5):
+            tx = self._spend(1, '%02x' % n * 32, 0, 100000, [(a0, 1000 * (n + 1))])
+            hashes.append(self._receive(tx, 100 + n))
+        self.wallet.export_page_size = 2
+
+        class FakeFx(object):
+            lookups = 0
+            def history_rates(self, d_ts):
+                self.lookups += 1
+                return {d_t.date(): None for d_t in d_ts}
+            def value_str(self, satoshis, rate):
+                return 'No data'
+
+        fx = FakeFx()
+        items = self.wallet.export_history(fx=fx)
+        self.assertEqual([item['txid'] for item in items], hashes)
+        self.assertEqual(items[0]['fiat_value'], 'No data')
+        # One batch of rates per page
+        self.assertEqual(fx.lookups, 3)
+        self.assertEqual(self.wallet.export_history(self.wallet.get_addresses()),
+                         self.wallet.export_history())
+
+        f = StringIO()
+        self.wallet.write_export_history(f, False)
+        self.assertEqual(f.getvalue(), json.dumps(self.wallet.export_history(), indent=4))
+        f = StringIO()
+        self.wallet.write_export_history(f, True)
+        lines = f.getvalue().splitlines()
+        self.assertEqual(len(lines), 6)
+        self.assertTrue(lines[1].startswith(hashes[0] + ','))
+
+
+class TestDeterministicAddresses(WalletTestCase):
+
+    xpub = ('xpub661MyMwAqRbcFsrzES8RWNiD7RxDqT4p8NjvTY9mLi8xdphQ9x1TiY8GnqCpQx4LqJBdcGeXrsAa2b2G7'
+            'ZcjJcest9wHcqYfTqXmQja6vfV')
+
+    def setUp(self):
+        super().setUp()
+        storage = WalletStorage(self.wallet_path)
+        storage.put('keystore', keystore.from_xpub(self.xpub).dump())
+        storage.put('stored_height', 1000)
+        self.wallet = Standard_Wallet(storage)
+
+    def test_derive_pubkeys_range(self):
+        keystore = self.wallet.keystore
+        for for_change in (0, 1):
+            branch = keystore.get_branch_xpub(for_change)
+            expected = [Xpub.get_pubkey_from_xpub(self.xpub, (for_change, n))
+                        for n in range(3, 8)]
+            self.assertEqual(keystore.derive_pubkeys_range(for_change, 3, 5), expected)
+            self.assertEqual(keystore.derive_pubkey(for_change, 5), expected[2])
+            self.assertEqual(Xpub.get_pubkey_from_xpub(branch, (5,)), expected[2])
+
+    def test_synchronize_fills_gap(self):
+        wallet = self.wallet
+        wallet.synchronize()
+        receiving = list(wallet.get_receiving_addresses())
+        self.assertEqual(len(receiving), 20)
+        self.assertEqual(len(wallet.get_change_addresses()), 6)
+        self.assertEqual(receiving[7],
+                         Address.from_pubkey(wallet.keystore.derive_pubkey(False, 7)))
+
+        wallet._history[receiving[14]] = [('ab' * 32, 900)]
+        wallet.synchronize()
+        self.assertEqual(len(wallet.get_receiving_addresses()), 35)
+        # Unconfirmed use does not make an address old
+        wallet._history[wallet.get_receiving_addresses()[34]] = [('cd' * 32, 0)]
+        wallet.synchronize()
+        self.assertEqual(len(wallet.get_receiving_addresses()), 35)
+        self.assertEqual(wallet.get_receiving_addresses()[:20], receiving)
+
+    def test_address_index(self):
+        wallet = self.wallet
+        wallet.synchronize()
+        receiving = wallet.get_receiving_addresses()
+        change = wallet.get_change_addresses()
+        self.assertTrue(wallet.is_mine(receiving[3]))
+        self.assertFalse(wallet.is_change(receiving[3]))
+        self.assertEqual(wallet.get_address_index(receiving[3]), (False, 3))
+        self.assertTrue(wallet.is_change(change[5]))
+        self.assertEqual(wallet.get_address_index(change[5]), (True, 5))
+
+        address = wallet.create_new_address(True)
+        self.assertEqual(wallet.get_address_index(address), (True, 6))
+        self.assertFalse(wallet.is_mine(Address.from_string('1MYXdf4moacvaEKZ57ozerpJ3t9xSeN6LK')))
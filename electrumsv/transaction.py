@@ -23,19 +23,18 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-import hashlib
+from concurrent.futures import ProcessPoolExecutor
 import logging
 import struct
 
 import ecdsa
-from ecdsa.curves import SECP256k1
 
 # Note: The deserialization code originally comes from ABE.
 
 from .bitcoin import (
     to_bytes, TYPE_PUBKEY, TYPE_ADDRESS, TYPE_SCRIPT, hash_encode, op_push, Hash,
-    MyVerifyingKey, point_to_ser, push_script, public_key_to_p2pk_script, int_to_hex,
-    var_int, public_key_from_private_key, regenerate_key, MySigningKey
+    push_script, public_key_to_p2pk_script, int_to_hex, var_int, var_int_bytes,
+    sign_digests, verify_digests, recover_public_keys, compress_public_key
 )
 from .address import (
     PublicKey, Address, Script, ScriptOutput, hash160, UnknownAddress, OpCodes as opcodes
@@ -49,6 +48,10 @@ from .keystore import xpubkey_to_address, xpubkey_to_pubkey
 
 NO_SIGNATURE = 'ff'
 
+pack_le_int32 = struct.Struct('<i').pack
+pack_le_uint32 = struct.Struct('<I').pack
+pack_le_uint64 = struct.Struct('<Q').pack
+
 logger = logging.getLogger("transaction")
 
 
@@ -69,8 +72,14 @@ class BCDataStream(object):
 
     def write(self, _bytes):  # Initialize with string of _bytes
         if self.input is None:
-            self.input = bytearray(_bytes)
+            # Immutable input is read in place; it is only copied if appended to
+            if isinstance(_bytes, bytes):
+                self.input = _bytes
+            else:
+                self.input = bytearray(_bytes)
         else:
+            if not isinstance(self.input, bytearray):
+                self.input = bytearray(self.input)
             self.input += bytearray(_bytes)
 
     def read_string(self, encoding='ascii'):
@@ -375,8 +384,9 @@ def parse_output(vds, i):
 
 
 def deserialize(raw):
+    '''Deserialize a raw transaction given as hex or bytes.'''
     vds = BCDataStream()
-    vds.write(bfh(raw))
+    vds.write(raw if isinstance(raw, bytes) else bfh(raw))
     d = {}
     start = vds.read_cursor
     d['version'] = vds.read_int32()
@@ -426,6 +436,8 @@ class Transaction:
             raise BaseException("cannot initialize transaction", raw)
         self._inputs = None
         self._outputs = None
+        # (hashPrevouts, hashSequence, hashOutputs) shared by every input's preimage
+        self._sighash_parts = None
         self.locktime = 0
         self.version = 1
 
@@ -438,6 +450,7 @@ class Transaction:
     def update(self, raw):
         self.raw = raw
         self._inputs = None
+        self._sighash_parts = None
         self.deserialize()
 
     def inputs(self):
@@ -472,19 +485,18 @@ class Transaction:
             for sig in sigs2:
                 if sig in sigs1:
                     continue
-                pre_hash = Hash(bfh(self.serialize_preimage(i)))
+                pre_hash = self.preimage_hash(i)
                 # der to string
                 order = ecdsa.ecdsa.generator_secp256k1.order()
                 r, s = ecdsa.util.sigdecode_der(bfh(sig[:-2]), order)
                 sig_string = ecdsa.util.sigencode_string(r, s, order)
-                compressed = True
-                for recid in range(4):
-                    public_key = MyVerifyingKey.from_signature(
-                        sig_string, recid, pre_hash, curve = SECP256k1)
-                    pubkey = bh2u(point_to_ser(public_key.pubkey.point, compressed))
+                for public_key in recover_public_keys(sig_string, pre_hash):
+                    if public_key is None:
+                        continue
+                    pubkey = bh2u(compress_public_key(public_key))
                     if pubkey in pubkeys:
-                        public_key.verify_digest(sig_string, pre_hash,
-                                                 sigdecode=ecdsa.util.sigdecode_string)
+                        if not verify_digests([(pre_hash, bfh(sig[:-2]), public_key)])[0]:
+                            raise ecdsa.BadSignatureError("Bad signature")
                         j = pubkeys.index(pubkey)
                         logger.debug("adding sig %s %s %s %s", i, j, pubkey, sig)
                         self._inputs[i]['signatures'][j] = sig
@@ -614,77 +626,115 @@ class Transaction:
         else:
             raise RuntimeError('Unknown txin type', _type)
 
+    # The serialize_*_bytes methods are the implementation; the hex methods
+    # are kept for callers that want the ASCII hex form.
+
+    @classmethod
+    def serialize_outpoint_bytes(self, txin):
+        return bfh(txin['prevout_hash'])[::-1] + pack_le_uint32(txin['prevout_n'])
+
     @classmethod
     def serialize_outpoint(self, txin):
-        return bh2u(bfh(txin['prevout_hash'])[::-1]) + int_to_hex(txin['prevout_n'], 4)
+        return bh2u(self.serialize_outpoint_bytes(txin))
 
     @classmethod
-    def serialize_input(self, txin, script, estimate_size=False):
-        # Prev hash and index
-        s = self.serialize_outpoint(txin)
-        # Script length, script, sequence
-        s += var_int(len(script)//2)
-        s += script
-        s += int_to_hex(txin.get('sequence', 0xffffffff - 1), 4)
+    def serialize_input_bytes(self, txin, script, estimate_size=False):
+        '''As for serialize_input, but script is bytes and so is the result.'''
+        # Prev hash and index, script length, script, sequence
+        parts = [
+            self.serialize_outpoint_bytes(txin),
+            var_int_bytes(len(script)),
+            script,
+            pack_le_uint32(txin.get('sequence', 0xffffffff - 1)),
+        ]
         # offline signing needs to know the input value
         if ('value' in txin   # Legacy txs
             and not (estimate_size or self.is_txin_complete(txin))):
-            s += int_to_hex(txin['value'], 8)
-        return s
+            parts.append(pack_le_uint64(txin['value']))
+        return b''.join(parts)
+
+    @classmethod
+    def serialize_input(self, txin, script, estimate_size=False):
+        return bh2u(self.serialize_input_bytes(txin, bfh(script), estimate_size))
 
     def BIP_LI01_sort(self):
         # See https://github.com/kristovatlas/rfc/blob/master/bips/bip-li01.mediawiki
         self._inputs.sort(key = lambda i: (i['prevout_hash'], i['prevout_n']))
         self._outputs.sort(key = lambda o: (o[2], self.pay_script(o[1])))
+        self._sighash_parts = None
 
-    def serialize_output(self, output):
+    def serialize_output_bytes(self, output):
         output_type, addr, amount = output
-        s = int_to_hex(amount, 8)
-        script = self.pay_script(addr)
-        s += var_int(len(script)//2)
-        s += script
-        return s
+        script = addr.to_script()
+        return pack_le_uint64(amount) + var_int_bytes(len(script)) + script
+
+    def serialize_output(self, output):
+        return bh2u(self.serialize_output_bytes(output))
 
     @classmethod
     def nHashType(cls):
         '''Hash type in hex.'''
         return 0x01 | (cls.SIGHASH_FORKID + (cls.FORKID << 8))
 
-    def serialize_preimage(self, i):
-        nVersion = int_to_hex(self.version, 4)
-        nHashType = int_to_hex(self.nHashType(), 4)
-        nLocktime = int_to_hex(self.locktime, 4)
-        inputs = self.inputs()
-        outputs = self.outputs()
-        txin = inputs[i]
-
-        hashPrevouts = bh2u(Hash(bfh(''.join(self.serialize_outpoint(txin) for txin in inputs))))
-        hashSequence = bh2u(Hash(bfh(''.join(int_to_hex(txin.get('sequence', 0xffffffff - 1), 4)
-                                             for txin in inputs))))
-        hashOutputs = bh2u(Hash(bfh(''.join(self.serialize_output(o) for o in outputs))))
-        outpoint = self.serialize_outpoint(txin)
-        preimage_script = self.get_preimage_script(txin)
-        scriptCode = var_int(len(preimage_script) // 2) + preimage_script
+    def sighash_parts(self):
+        '''Return (hashPrevouts, hashSequence, hashOutputs).  They are the same for every
+        input so are computed once and cached until the inputs or outputs change.'''
+        if self._sighash_parts is None:
+            inputs = self.inputs()
+            outputs = self.outputs()
+            hashPrevouts = Hash(b''.join(self.serialize_outpoint_bytes(txin)
+                                         for txin in inputs))
+            hashSequence = Hash(b''.join(pack_le_uint32(txin.get('sequence', 0xffffffff - 1))
+                                         for txin in inputs))
+            hashOutputs = Hash(b''.join(self.serialize_output_bytes(o) for o in outputs))
+            self._sighash_parts = (hashPrevouts, hashSequence, hashOutputs)
+        return self._sighash_parts
+
+    def serialize_preimage_bytes(self, i):
+        txin = self.inputs()[i]
+        hashPrevouts, hashSequence, hashOutputs = self.sighash_parts()
+        preimage_script = bfh(self.get_preimage_script(txin))
         try:
-            amount = int_to_hex(txin['value'], 8)
+            amount = pack_le_uint64(txin['value'])
         except KeyError:
             raise InputValueMissing
-        nSequence = int_to_hex(txin.get('sequence', 0xffffffff - 1), 4)
-        preimage = (nVersion + hashPrevouts + hashSequence + outpoint +
-                    scriptCode + amount + nSequence + hashOutputs + nLocktime + nHashType)
-        return preimage
+        return b''.join((
+            pack_le_int32(self.version),
+            hashPrevouts,
+            hashSequence,
+            self.serialize_outpoint_bytes(txin),
+            var_int_bytes(len(preimage_script)),
+            preimage_script,
+            amount,
+            pack_le_uint32(txin.get('sequence', 0xffffffff - 1)),
+            hashOutputs,
+            pack_le_uint32(self.locktime),
+            pack_le_uint32(self.nHashType()),
+        ))
 
-    def serialize(self, estimate_size=False):
-        nVersion = int_to_hex(self.version, 4)
-        nLocktime = int_to_hex(self.locktime, 4)
+    def serialize_preimage(self, i):
+        return bh2u(self.serialize_preimage_bytes(i))
+
+    def preimage_hash(self, i):
+        '''The double SHA256 digest signed for input i.'''
+        return Hash(self.serialize_preimage_bytes(i))
+
+    def serialize_bytes(self, estimate_size=False):
         inputs = self.inputs()
         outputs = self.outputs()
-        txins = var_int(len(inputs)) + ''.join(
-            self.serialize_input(txin, self.input_script(txin, estimate_size), estimate_size)
+        parts = [pack_le_int32(self.version), var_int_bytes(len(inputs))]
+        parts.extend(
+            self.serialize_input_bytes(txin, bfh(self.input_script(txin, estimate_size)),
+                                       estimate_size)
             for txin in inputs
         )
-        txouts = var_int(len(outputs)) + ''.join(self.serialize_output(o) for o in outputs)
-        return nVersion + txins + txouts + nLocktime
+        parts.append(var_int_bytes(len(outputs)))
+        parts.extend(self.serialize_output_bytes(o) for o in outputs)
+        parts.append(pack_le_uint32(self.locktime))
+        return b''.join(parts)
+
+    def serialize(self, estimate_size=False):
+        return bh2u(self.serialize_bytes(estimate_size))
 
     def hash(self):
         logger.warning("deprecated tx.hash()")
@@ -693,17 +743,18 @@ class Transaction:
     def txid(self):
         if not self.is_complete():
             return None
-        ser = self.serialize()
-        return bh2u(Hash(bfh(ser))[::-1])
+        return bh2u(Hash(self.serialize_bytes())[::-1])
 
     def add_inputs(self, inputs):
         self._inputs.extend(inputs)
+        self._sighash_parts = None
         self.raw = None
 
     def add_outputs(self, outputs):
         assert all(isinstance(output[1], (PublicKey, Address, ScriptOutput))
                    for output in outputs)
         self._outputs.extend(outputs)
+        self._sighash_parts = None
         self.raw = None
 
     def input_value(self):
@@ -718,14 +769,14 @@ class Transaction:
     @profiler
     def estimated_size(self):
         '''Return an estimated tx size in bytes.'''
-        return (len(self.serialize(True)) // 2 if not self.is_complete() or self.raw is None
+        return (len(self.serialize_bytes(True)) if not self.is_complete() or self.raw is None
                 else len(self.raw) // 2)  # ASCII hex string
 
     @classmethod
     def estimated_input_size(self, txin):
         '''Return an estimated of serialized input size in bytes.'''
         script = self.input_script(txin, True)
-        return len(self.serialize_input(txin, script, True)) // 2  # ASCII hex string
+        return len(self.serialize_input_bytes(txin, bfh(script), True))
 
     def signature_count(self):
         r = 0
@@ -742,33 +793,43 @@ class Transaction:
         s, r = self.signature_count()
         return r == s
 
-    def sign(self, keypairs):
+    def sign(self, keypairs, processes=None):
+        '''Sign the inputs we have keys for.  If processes is more than 1, the
+        signatures are made in a pool of that many worker processes that only lives for
+        this call.  Signing is deterministic so the result is the same either way.'''
+        # Work out which (input, pubkey) slots to sign first, as the serial loop would
+        jobs = []
         for i, txin in enumerate(self.inputs()):
             num = txin['num_sig']
             pubkeys, x_pubkeys = self.get_sorted_pubkeys(txin)
+            count = len([sig for sig in txin['signatures'] if sig])
             for j, x_pubkey in enumerate(x_pubkeys):
-                signatures = [sig for sig in txin['signatures'] if sig]
-                if len(signatures) == num:
+                if count == num:
                     # txin is complete
                     break
                 if x_pubkey in keypairs.keys():
                     logger.debug("adding signature for %s", x_pubkey)
                     sec, compressed = keypairs.get(x_pubkey)
-                    pubkey = public_key_from_private_key(sec, compressed)
-                    # add signature
-                    pre_hash = Hash(bfh(self.serialize_preimage(i)))
-                    pkey = regenerate_key(sec)
-                    secexp = pkey.secret
-                    private_key = MySigningKey.from_secret_exponent(secexp, curve = SECP256k1)
-                    public_key = private_key.get_verifying_key()
-                    sig = private_key.sign_digest_deterministic(
-                        pre_hash, hashfunc=hashlib.sha256,
-                        sigencode = ecdsa.util.sigencode_der)
-                    assert public_key.verify_digest(sig, pre_hash,
-                                                    sigdecode=ecdsa.util.sigdecode_der)
-                    txin['signatures'][j] = bh2u(sig) + int_to_hex(self.nHashType() & 255, 1)
-                    txin['pubkeys'][j] = pubkey # needed for fd keys
-                    self._inputs[i] = txin
+                    jobs.append((i, j, sec, compressed))
+                    if not txin['signatures'][j]:
+                        count += 1
+
+        preimages = [self.serialize_preimage_bytes(i) for i, j, sec, compressed in jobs]
+        secs = [sec for i, j, sec, compressed in jobs]
+        compressions = [compressed for i, j, sec, compressed in jobs]
+        if processes and processes > 1 and len(jobs) > 1:
+            chunksize = max(1, len(jobs) // (processes * 4))
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                results = list(executor.map(sign_preimage, preimages, secs, compressions,
+                                            chunksize=chunksize))
+        else:
+            results = sign_preimages(preimages, secs, compressions)
+
+        sighash_byte = int_to_hex(self.nHashType() & 255, 1)
+        for (i, j, sec, compressed), (sig, pubkey) in zip(jobs, results):
+            txin = self._inputs[i]
+            txin['signatures'][j] = bh2u(sig) + sighash_byte
+            txin['pubkeys'][j] = pubkey # needed for fd keys
         logger.debug("is_complete %s", self.is_complete())
         self.raw = self.serialize()
 
@@ -804,6 +865,18 @@ class Transaction:
         return out
 
 
+def sign_preimages(preimages, secs, compressions):
+    '''Sign transaction preimages.  Returns (DER signature, hex public key) pairs.'''
+    return [(sig, bh2u(public_key)) for sig, public_key in
+            sign_digests([Hash(preimage) for preimage in preimages], secs, compressions)]
+
+
+def sign_preimage(preimage, sec, compressed):
+    '''Sign a transaction preimage.  Returns the DER signature and the hex public key.
+    Module level so that process pool workers can run it.'''
+    return sign_preimages([preimage], [sec], [compressed])[0]
+
+
 def tx_from_str(txt):
     "json or raw hexadecimal"
     import json
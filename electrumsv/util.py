@@ -23,7 +23,7 @@
 
 import binascii
 from decimal import Decimal
-from collections import defaultdict
+from collections import defaultdict, deque
 from datetime import datetime
 import json
 import hmac
@@ -490,18 +490,6 @@ builtin_raw_input = builtins.input
 builtins.input = raw_input
 
 
-def parse_json(message):
-    # TODO: check \r\n pattern
-    n = message.find(b'\n')
-    if n==-1:
-        return None, message
-    try:
-        j = json.loads(message[0:n].decode('utf8'))
-    except:
-        j = None
-    return j, message[n+1:]
-
-
 class timeout(Exception):
     pass
 
@@ -509,9 +497,19 @@ TimeoutException = timeout # Future compat. with Electrum codebase/cherrypicking
 
 
 class SocketPipe:
+    # Bytes asked of the socket per recv, so that a burst of responses is read in a
+    # few calls
+    recv_size = 65536
+
     def __init__(self, socket):
         self.socket = socket
-        self.message = b''
+        # Received data; messages before self.offset have already been parsed, and
+        # there is no newline between self.offset and self.scanned
+        self.message = bytearray()
+        self.offset = 0
+        self.scanned = 0
+        # Messages of a batch response not yet returned
+        self.pending = deque()
         self.set_timeout(0.1)
         self.recv_time = time.time()
 
@@ -521,13 +519,39 @@ class SocketPipe:
     def idle_time(self):
         return time.time() - self.recv_time
 
+    def parse_message(self):
+        '''Return the next message in the received data, or None if there is no
+        complete message.  The messages of a batch response are returned one by one.'''
+        while not self.pending:
+            # A \r before the \n is whitespace to json.loads, so \r\n also works
+            n = self.message.find(b'\n', max(self.offset, self.scanned))
+            if n == -1:
+                # Only keep the incomplete message, and do not search it again when more
+                # of it arrives
+                del self.message[:self.offset]
+                self.offset = 0
+                self.scanned = len(self.message)
+                return None
+            start, self.offset = self.offset, n + 1
+            try:
+                with memoryview(self.message) as view:
+                    line = str(view[start:n], 'utf8')
+                message = json.loads(line)
+            except:
+                continue
+            if isinstance(message, list):
+                self.pending.extend(message)
+            elif message is not None:
+                self.pending.append(message)
+        return self.pending.popleft()
+
     def get(self):
         while True:
-            response, self.message = parse_json(self.message)
+            response = self.parse_message()
             if response is not None:
                 return response
             try:
-                data = self.socket.recv(1024)
+                data = self.socket.recv(self.recv_size)
             except socket.timeout:
                 raise timeout
             except ssl.SSLError:
@@ -561,7 +585,12 @@ class SocketPipe:
         out = b''.join((json.dumps(request) + '\n').encode('utf8') for request in requests)
         self._send(out)
 
+    def send_batch(self, requests):
+        '''Send the requests as a single JSON-RPC batch array.'''
+        self.send(requests)
+
     def _send(self, out):
+        out = memoryview(out)
         while out:
             sent = self.socket.send(out)
             out = out[sent:]
@@ -22,6 +22,7 @@
 # SOFTWARE.
 
 import logging
+from threading import Lock
 
 from .util import ThreadJob, bh2u
 from .bitcoin import Hash, hash_decode, hash_encode, NetworkConstants
@@ -33,7 +34,12 @@ logger = logging.getLogger("verifier")
 class InnerNodeOfSpvProofIsValidTx(Exception): pass
 
 class SPV(ThreadJob):
-    """ Simple Payment Verification """
+    """ Simple Payment Verification
+
+    Rather than walking all the wallet's unverified transactions on every run, only
+    those queued by the wallet with add() are looked at.  Those that cannot be verified
+    until we have their header are put aside until a new block or chunk arrives.
+    """
 
     def __init__(self, network, wallet):
         self.wallet = wallet
@@ -41,6 +47,17 @@ class SPV(ThreadJob):
         self.blockchain = network.blockchain()
         self.merkle_roots = {}  # txid -> merkle root (once it has been verified)
         self.requested_merkle = set()  # txid set of pending requests
+        self.lock = Lock()
+        self.queued = set(wallet.get_unverified_txs())
+        # Transactions waiting on a header, and the chunks they are waiting on
+        self.waiting = set()
+        self.waiting_chunks = set()
+        self.local_height = None
+
+    def add(self, tx_hash):
+        '''Queue a transaction to be verified.  This can be called from any thread.'''
+        with self.lock:
+            self.queued.add(tx_hash)
 
     def run(self):
         interface = self.network.interface
@@ -53,14 +70,32 @@ class SPV(ThreadJob):
             logger.error("no blockchain for interface '%s'", interface.server)
             return
 
+        with self.lock:
+            queued = self.queued
+            self.queued = set()
         local_height = self.network.get_local_height()
+        if (local_height != self.local_height or
+                not self.waiting_chunks <= self.network.requested_chunks):
+            self.local_height = local_height
+            queued |= self.waiting
+            self.waiting = set()
+            self.waiting_chunks = set()
+
         unverified = self.wallet.get_unverified_txs()
-        for tx_hash, tx_height in unverified.items():
-            # do not request merkle branch if we already requested it
+        for tx_hash in queued:
+            tx_height = unverified.get(tx_hash)
+            # do not request merkle branch if it was verified since being queued
+            if tx_height is None:
+                continue
+            # or if we already requested it
             if tx_hash in self.requested_merkle or tx_hash in self.merkle_roots:
                 continue
+            # or for unconfirmed transactions, which are queued again once mined
+            if tx_height <= 0:
+                continue
             # or before headers are available
-            if tx_height <= 0 or tx_height > local_height:
+            if tx_height > local_height:
+                self.waiting.add(tx_hash)
                 continue
 
             # if it's in the checkpoint region, we still might not have the header
@@ -74,6 +109,8 @@ class SPV(ThreadJob):
                     if self.network.request_chunk(interface, index):
                         interface.logger.debug("verifier requesting chunk %s for height %s",
                                                index, tx_height)
+                    self.waiting_chunks.add(index)
+                self.waiting.add(tx_hash)
                 continue
             # request now
             self.network.get_merkle_for_transaction(
@@ -27,8 +27,11 @@
 #   - Standard_Wallet: one keystore, P2PKH
 #   - Multisig_Wallet: several keystores, P2SH
 
+from bisect import bisect_left
 import copy
-from collections import defaultdict, namedtuple
+import csv
+from collections import defaultdict, namedtuple, OrderedDict
+from collections.abc import MutableMapping
 from decimal import Decimal
 import errno
 from functools import partial
@@ -36,6 +39,7 @@ import json
 import logging
 import os
 import random
+import textwrap
 import threading
 import time
 
@@ -49,10 +53,11 @@ from .address import Address, Script, ScriptOutput, PublicKey
 from .bitcoin import COINBASE_MATURITY, TYPE_ADDRESS, is_minikey, Hash
 from .version import PACKAGE_VERSION
 from .keystore import (
-    load_keystore, Hardware_KeyStore, Imported_KeyStore, BIP32_KeyStore, xpubkey_to_address
+    load_keystore, Hardware_KeyStore, Imported_KeyStore, BIP32_KeyStore,
+    Software_KeyStore, xpubkey_to_address
 )
 from .networks import NetworkConstants
-from .storage import multisig_type
+from .storage import migrate_to_sqlite, multisig_type
 
 from . import transaction
 from .transaction import Transaction
@@ -160,10 +165,193 @@ def sweep(privkeys, network, config, recipient, fee=None, imax=100):
 
     tx = Transaction.from_io(inputs, outputs, locktime=locktime)
     tx.BIP_LI01_sort()
-    tx.sign(keypairs)
+    tx.sign(keypairs, processes=config.get('sign_processes'))
     return tx
 
 
+class TransactionCache(MutableMapping):
+    '''A map of tx hash to Transaction that holds the transactions as raw bytes and only
+    creates Transaction objects when they are looked up.  The most recently used objects
+    are kept, so that hot transactions are not deserialized again on every lookup.'''
+
+    max_cached = 1000
+
+    def __init__(self, raw_txs=()):
+        self._lock = threading.RLock()
+        self._raw = {tx_hash: bytes.fromhex(raw) for tx_hash, raw in raw_txs}
+        self._cache = OrderedDict()
+
+    def _cache_tx(self, tx_hash, tx):
+        self._cache[tx_hash] = tx
+        self._cache.move_to_end(tx_hash)
+        while len(self._cache) > self.max_cached:
+            self._cache.popitem(last=False)
+
+    def __getitem__(self, tx_hash):
+        with self._lock:
+            tx = self._cache.get(tx_hash)
+            if tx is None:
+                tx = Transaction(self._raw[tx_hash].hex())
+            self._cache_tx(tx_hash, tx)
+            return tx
+
+    def __setitem__(self, tx_hash, tx):
+        with self._lock:
+            self._raw[tx_hash] = bytes.fromhex(str(tx))
+            self._cache_tx(tx_hash, tx)
+
+    def __delitem__(self, tx_hash):
+        with self._lock:
+            del self._raw[tx_hash]
+            self._cache.pop(tx_hash, None)
+
+    def __contains__(self, tx_hash):
+        return tx_hash in self._raw
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._raw))
+
+    def __len__(self):
+        return len(self._raw)
+
+    def raw_size(self, tx_hash):
+        '''The size in bytes of the transaction.'''
+        return len(self._raw[tx_hash])
+
+    def raw_hex(self, tx_hash):
+        '''The raw hex of the transaction, or None if there is no such transaction.'''
+        raw = self._raw.get(tx_hash)
+        return None if raw is None else raw.hex()
+
+    def raw_items(self):
+        '''The (tx_hash, raw hex) pairs of all transactions, without creating any
+        Transaction objects.'''
+        with self._lock:
+            return [(tx_hash, raw.hex()) for tx_hash, raw in self._raw.items()]
+
+
+class AddressTable(object):
+    '''Interns the wallet's addresses.  Each stored address string is decoded once, and
+    equal Address objects are replaced by a single shared object that caches its string
+    encodings, so loading and saving cost one conversion per distinct address rather
+    than one per occurrence.'''
+
+    def __init__(self):
+        # Address -> the shared Address object
+        self._addresses = {}
+        # address string -> the shared Address object
+        self._strings = {}
+
+    def __len__(self):
+        return len(self._addresses)
+
+    def intern(self, address):
+        return self._addresses.setdefault(address, address)
+
+    def from_string(self, text):
+        address = self._strings.get(text)
+        if address is None:
+            address = self.intern(Address.from_string(text))
+            self._strings[text] = address
+        return address
+
+    def from_strings(self, texts):
+        texts = list(texts)
+        new_texts = [text for text in set(texts) if text not in self._strings]
+        for text, address in zip(new_texts, Address.from_strings(new_texts)):
+            self._strings[text] = self.intern(address)
+        return [self._strings[text] for text in texts]
+
+    def to_string(self, address):
+        return self.intern(address).to_string(Address.FMT_BITCOIN)
+
+    def to_Address_dict(self, d):
+        '''Convert a dict of strings to a dict of Address objects.'''
+        return dict(zip(self.from_strings(d), d.values()))
+
+
+class HistoryCache(object):
+    '''The wallet-wide transaction history in position order, with running totals
+    of the transaction deltas.  Rows are patched as transactions change rather than
+    the whole history being rebuilt.'''
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        # Sorted (txpos, tx_hash) keys, and the delta of each (None if unknown)
+        self._keys = []
+        self._deltas = []
+        # (total, unknowns) for each row: the sum of the known deltas and the number of
+        # unknown deltas up to and including the row.  Only the first _valid are current.
+        self._totals = []
+        self._valid = 0
+        self._key_of = {}
+
+    def snapshot(self):
+        '''Return a copy of the cache, which can be read a page at a time while this one
+        changes.  Only the lists of rows are copied, not the keys and totals in them.'''
+        self._update_totals()
+        snapshot = HistoryCache()
+        snapshot._keys = list(self._keys)
+        snapshot._deltas = list(self._deltas)
+        snapshot._totals = list(self._totals)
+        snapshot._valid = self._valid
+        snapshot._key_of = dict(self._key_of)
+        return snapshot
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, tx_hash):
+        return tx_hash in self._key_of
+
+    def remove(self, tx_hash):
+        key = self._key_of.pop(tx_hash, None)
+        if key is not None:
+            i = bisect_left(self._keys, key)
+            del self._keys[i]
+            del self._deltas[i]
+            self._valid = min(self._valid, i)
+
+    def set(self, tx_hash, txpos, delta):
+        self.remove(tx_hash)
+        key = (txpos, tx_hash)
+        i = bisect_left(self._keys, key)
+        self._keys.insert(i, key)
+        self._deltas.insert(i, delta)
+        self._key_of[tx_hash] = key
+        self._valid = min(self._valid, i)
+
+    def index_of_height(self, height):
+        '''The index of the first row at or above height.'''
+        return bisect_left(self._keys, ((height, ), ))
+
+    def rows(self, start, stop):
+        '''Yield (tx_hash, delta, total, unknowns) for the rows start to stop - 1.'''
+        self._update_totals()
+        for i in range(start, stop):
+            total, unknowns = self._totals[i]
+            yield self._keys[i][1], self._deltas[i], total, unknowns
+
+    def final_totals(self):
+        self._update_totals()
+        return self._totals[-1] if self._totals else (0, 0)
+
+    def _update_totals(self):
+        n = self._valid
+        del self._totals[n:]
+        total, unknowns = self._totals[-1] if n else (0, 0)
+        for delta in self._deltas[n:]:
+            if delta is None:
+                unknowns += 1
+            else:
+                total += delta
+            self._totals.append((total, unknowns))
+        self._valid = len(self._totals)
+
+
 class Abstract_Wallet:
     """
     Wallet classes are created to handle various address generation methods.
@@ -180,28 +368,47 @@ class Abstract_Wallet:
         # verifier (SPV) and synchronizer are started in start_threads
         self.synchronizer = None
         self.verifier = None
+        self._addresses = AddressTable()
 
         self.gap_limit_for_change = 6 # constant
         # saved fields
         self.use_change            = storage.get('use_change', True)
         self.multiple_change       = storage.get('multiple_change', False)
-        self.labels                = storage.get('labels', {})
+        self.labels                = dict(storage.get('labels', {}, readonly=True))
         # Frozen addresses
-        frozen_addresses = storage.get('frozen_addresses',[])
-        self.frozen_addresses = set(Address.from_string(addr)
-                                    for addr in frozen_addresses)
+        frozen_addresses = storage.get('frozen_addresses', [], readonly=True)
+        self.frozen_addresses = set(self._addresses.from_strings(frozen_addresses))
         # Frozen coins (UTXOs) -- note that we have 2 independent
         # levels of "freezing": address-level and coin-level.  The two
         # types of freezing are flagged independently of each other
         # and 'spendable' is defined as a coin that satisfies BOTH
         # levels of freezing.
-        self.frozen_coins = set(storage.get('frozen_coins', []))
+        self.frozen_coins = set(storage.get('frozen_coins', [], readonly=True))
         # address -> list(txid, height)
-        history = storage.get('addr_history',{})
-        self._history = self.to_Address_dict(history)
+        history = storage.get('addr_history', {}, readonly=True)
+        self._history = self._addresses.to_Address_dict(history)
+        # Cached balances.  Address -> {exclude_frozen_coins: (balance, height)} and
+        # (exclude_frozen_coins, exclude_frozen_addresses) -> (balance, height), where
+        # height is the local height the balance depends on (coinbase maturity) or None.
+        self._addr_balances = {}
+        self._wallet_balances = {}
+        # The wallet-wide history.  The transactions in _history_dirty have changed
+        # and their rows are recomputed the next time the history is read.
+        self._history_cache = HistoryCache()
+        self._history_dirty = set()
+        self._history_rebuild = True
+        # What changed since the transactions were last saved, so that only those entries
+        # are stored: transaction hashes (for transactions, txi, txo and tx_fees), the
+        # pruned_txo keys and the history addresses.  Everything is saved while
+        # _save_all is set.
+        self._unsaved_txs = set()
+        self._unsaved_pruned = set()
+        self._unsaved_addrs = set()
+        self._save_all = False
 
         self.load_keystore()
         self.load_addresses()
+        self.build_address_index()
         self.load_transactions()
         self.build_reverse_history()
 
@@ -218,7 +425,7 @@ class Abstract_Wallet:
 
         # Verified transactions.  Each value is a (height, timestamp,
         # block_pos) tuple.  Access with self.lock.
-        self.verified_tx = storage.get('verified_tx3', {})
+        self.verified_tx = dict(storage.get('verified_tx3', {}, readonly=True))
 
         # there is a difference between wallet.up_to_date and interface.is_up_to_date()
         # interface.is_up_to_date() returns true when all requests have been answered and processed
@@ -228,6 +435,7 @@ class Abstract_Wallet:
         self.lock = threading.RLock()
         self.transaction_lock = threading.RLock()
 
+        self.build_utxo_index()
         self.check_history()
 
         # save wallet type the first time
@@ -238,67 +446,128 @@ class Abstract_Wallet:
         self.invoices = InvoiceStore(self.storage)
         self.contacts = Contacts(self.storage)
 
-    @classmethod
-    def to_Address_dict(cls, d):
-        '''Convert a dict of strings to a dict of Adddress objects.'''
-        return {Address.from_string(text): value for text, value in d.items()}
-
-    @classmethod
-    def from_Address_dict(cls, d):
-        '''Convert a dict of Address objects to a dict of strings.'''
-        return {addr.to_string(Address.FMT_BITCOIN): value
-                for addr, value in d.items()}
-
     def __str__(self):
         return self.basename()
 
     def get_master_public_key(self):
         return None
 
+    def _load_tx_io(self, d):
+        '''Convert a stored txi or txo dict to the wallet's form.  The entry lists are
+        copied as they are modified in place, and are not copied by the storage.'''
+        from_string = self._addresses.from_string
+        return {tx_hash: {from_string(text): [tuple(item) for item in l]
+                          for text, l in value.items()}
+                for tx_hash, value in d.items()}
+
+    def _save_tx_io(self, d):
+        return {tx_hash: self._save_tx_io_entry(value) for tx_hash, value in d.items()}
+
+    def _save_tx_io_entry(self, value):
+        to_string = self._addresses.to_string
+        return {to_string(addr): list(l) for addr, l in value.items()}
+
+    @staticmethod
+    def _changed_rows(d, keys, convert):
+        '''Return the entries of d with the given keys as (rows, deleted), where rows
+        maps the keys present to their converted values and deleted lists the others.'''
+        rows = {}
+        deleted = []
+        for k in keys:
+            if k in d:
+                rows[k] = convert(d[k])
+            else:
+                deleted.append(k)
+        return rows, deleted
+
     @profiler
     def load_transactions(self):
-        txi = self.storage.get('txi', {})
-        self.txi = {tx_hash: self.to_Address_dict(value)
-                    for tx_hash, value in txi.items()}
-        txo = self.storage.get('txo', {})
-        self.txo = {tx_hash: self.to_Address_dict(value)
-                    for tx_hash, value in txo.items()}
-        self.tx_fees = self.storage.get('tx_fees', {})
-        self.pruned_txo = self.storage.get('pruned_txo', {})
-        tx_list = self.storage.get('transactions', {})
-        self.transactions = {}
+        # Read-only views avoid deep copies of what are the largest storage values
+        self.txi = self._load_tx_io(self.storage.get('txi', {}, readonly=True))
+        self.txo = self._load_tx_io(self.storage.get('txo', {}, readonly=True))
+        self.tx_fees = dict(self.storage.get('tx_fees', {}, readonly=True))
+        self.pruned_txo = dict(self.storage.get('pruned_txo', {}, readonly=True))
+        self.build_spend_index()
+        tx_list = self.storage.get('transactions', {}, readonly=True)
+        raw_txs = []
         for tx_hash, raw in tx_list.items():
-            tx = Transaction(raw)
-            self.transactions[tx_hash] = tx
             if (self.txi.get(tx_hash) is None and
                     self.txo.get(tx_hash) is None and
-                    tx_hash not in self.pruned_txo.values()):
+                    tx_hash not in self._pruned_spends):
                 self.logger.debug("removing unreferenced tx %s", tx_hash)
-                self.transactions.pop(tx_hash)
+                self._unsaved_txs.add(tx_hash)
+                continue
+            raw_txs.append((tx_hash, raw))
+        # Transaction objects are only created when looked up
+        self.transactions = TransactionCache(raw_txs)
 
     @profiler
     def save_transactions(self, write=False):
+        # These values are built here from JSON types, so the storage can take them
+        # without copying or validating them.
         with self.transaction_lock:
-            tx = {}
-            for k,v in self.transactions.items():
-                tx[k] = str(v)
-            self.storage.put('transactions', tx)
-            txi = {tx_hash: self.from_Address_dict(value)
-                   for tx_hash, value in self.txi.items()}
-            txo = {tx_hash: self.from_Address_dict(value)
-                   for tx_hash, value in self.txo.items()}
-            self.storage.put('txi', txi)
-            self.storage.put('txo', txo)
-            self.storage.put('tx_fees', self.tx_fees)
-            self.storage.put('pruned_txo', self.pruned_txo)
-            history = self.from_Address_dict(self._history)
-            self.storage.put('addr_history', history)
+            if self._save_all:
+                self._save_all_transactions()
+            else:
+                self._save_changed_transactions()
+            self._save_all = False
+            self._unsaved_txs = set()
+            self._unsaved_pruned = set()
+            self._unsaved_addrs = set()
             if write:
                 self.storage.write()
 
+    def _save_all_transactions(self):
+        put = partial(self.storage.put, copy_value=False, validate=False)
+        put('transactions', dict(self.transactions.raw_items()))
+        put('txi', self._save_tx_io(self.txi))
+        put('txo', self._save_tx_io(self.txo))
+        put('tx_fees', dict(self.tx_fees))
+        put('pruned_txo', dict(self.pruned_txo))
+        to_string = self._addresses.to_string
+        history = {to_string(addr): list(hist)
+                   for addr, hist in self._history.items()}
+        put('addr_history', history)
+
+    def _save_changed_transactions(self):
+        # Only the entries that changed since the last save are built and stored, so a
+        # save costs in proportion to the changes rather than to the size of the wallet
+        put_rows = self.storage.put_rows
+        tx_hashes = self._unsaved_txs
+        raw_txs = {}
+        for tx_hash in tx_hashes:
+            raw = self.transactions.raw_hex(tx_hash)
+            if raw is not None:
+                raw_txs[tx_hash] = raw
+        put_rows('transactions', raw_txs, [h for h in tx_hashes if h not in raw_txs])
+        put_rows('txi', *self._changed_rows(self.txi, tx_hashes, self._save_tx_io_entry))
+        put_rows('txo', *self._changed_rows(self.txo, tx_hashes, self._save_tx_io_entry))
+        put_rows('tx_fees', *self._changed_rows(self.tx_fees, tx_hashes, lambda v: v))
+        put_rows('pruned_txo', *self._changed_rows(self.pruned_txo, self._unsaved_pruned,
+                                                   lambda v: v))
+        rows, deleted = self._changed_rows(self._history, self._unsaved_addrs, list)
+        to_string = self._addresses.to_string
+        put_rows('addr_history', {to_string(addr): hist for addr, hist in rows.items()},
+                 [to_string(addr) for addr in deleted])
+
+    def migrate_storage(self):
+        '''Convert the wallet file to the SQLite storage format, which writes only what
+        changed.  The original file is kept with a '.json' suffix.  Encrypted wallet
+        files cannot be converted.'''
+        with self.lock, self.transaction_lock:
+            self.save_transactions()
+            self.save_verified_tx()
+            self.storage.write()
+            storage = migrate_to_sqlite(self.storage)
+            self.storage = storage
+            self.invoices.storage = storage
+            self.contacts.storage = storage
+        return storage
+
     def save_verified_tx(self, write=False):
         with self.lock:
-            self.storage.put('verified_tx3', self.verified_tx)
+            self.storage.put('verified_tx3', dict(self.verified_tx), copy_value=False,
+                             validate=False)
             if write:
                 self.storage.write()
 
@@ -308,34 +577,156 @@ class Abstract_Wallet:
             self.txo = {}
             self.tx_fees = {}
             self.pruned_txo = {}
-        self.save_transactions()
+            self.build_spend_index()
         with self.lock:
             self._history = {}
             self.tx_addr_hist = {}
+            self._addr_utxos = {}
+            self._history_rebuild = True
+        with self.transaction_lock:
+            self._save_all = True
+        self.save_transactions()
+        self._invalidate_balances()
 
     @profiler
     def build_reverse_history(self):
         self.tx_addr_hist = {}
+        intern = self._addresses.intern
         for addr, hist in self._history.items():
+            addr = intern(addr)
             for tx_hash, h in hist:
-                s = self.tx_addr_hist.get(tx_hash, set())
-                s.add(addr)
-                self.tx_addr_hist[tx_hash] = s
+                self.tx_addr_hist.setdefault(tx_hash, set()).add(addr)
+
+    @profiler
+    def build_spend_index(self):
+        # prevout_hash -> set of ("prevout_hash:n", spending tx_hash, address) for the
+        # entries in txi, so the spends of a transaction are found without a full scan.
+        self._txi_spends = {}
+        # spending tx_hash -> set of "prevout_hash:n" keys of pruned_txo
+        self._pruned_spends = {}
+        for tx_hash, d in self.txi.items():
+            for addr, l in d.items():
+                for ser, v in l:
+                    self._add_txi_spend(ser, tx_hash, addr)
+        for ser, tx_hash in self.pruned_txo.items():
+            self._pruned_spends.setdefault(tx_hash, set()).add(ser)
+
+    def _add_txi_spend(self, ser, tx_hash, addr):
+        prev_hash = ser.split(':')[0]
+        self._txi_spends.setdefault(prev_hash, set()).add((ser, tx_hash, addr))
+
+    def _remove_txi_spends(self, tx_hash, d):
+        '''Remove the txi entries d of transaction tx_hash from the spend index.'''
+        for addr, l in d.items():
+            for ser, v in l:
+                prev_hash = ser.split(':')[0]
+                spends = self._txi_spends.get(prev_hash)
+                if spends is not None:
+                    spends.discard((ser, tx_hash, addr))
+                    if not spends:
+                        del self._txi_spends[prev_hash]
+
+    def _add_pruned_txo(self, ser, tx_hash):
+        self.pruned_txo[ser] = tx_hash
+        self._unsaved_pruned.add(ser)
+        self._pruned_spends.setdefault(tx_hash, set()).add(ser)
+
+    def _pop_pruned_txo(self, ser):
+        tx_hash = self.pruned_txo.pop(ser)
+        self._unsaved_pruned.add(ser)
+        spends = self._pruned_spends.get(tx_hash)
+        if spends is not None:
+            spends.discard(ser)
+            if not spends:
+                del self._pruned_spends[tx_hash]
+        return tx_hash
+
+    @profiler
+    def build_utxo_index(self):
+        # address -> {"prevout_hash:n": (prevout_hash, prevout_n, height, value, is_cb)}
+        # Only addresses with unspent coins have an entry.
+        self._addr_utxos = {}
+        for addr in self._history:
+            self._update_addr_utxos(addr)
+
+    def _invalidate_balances(self, addresses=None):
+        '''Drop the cached balances of the given addresses, or of all addresses if None.
+        The wallet-wide totals are always dropped.'''
+        with self.transaction_lock:
+            if addresses is None:
+                self._addr_balances.clear()
+            else:
+                for addr in addresses:
+                    self._addr_balances.pop(addr, None)
+            self._wallet_balances.clear()
+
+    def _invalidate_history(self, tx_hashes):
+        '''Mark the history rows of the given transactions to be recomputed.  This takes
+        the lock _update_history_cache swaps the set under, so no mark is lost.'''
+        with self.transaction_lock:
+            self._history_dirty.update(tx_hashes)
+
+    def _update_history_cache(self):
+        '''Bring the wallet-wide history cache up to date.  Call with self.lock held.'''
+        with self.transaction_lock:
+            if self._history_rebuild:
+                self._history_rebuild = False
+                self._history_cache.clear()
+                self._history_dirty = set(self.tx_addr_hist)
+            dirty, self._history_dirty = self._history_dirty, set()
+            for tx_hash in dirty:
+                addresses = [addr for addr in self.tx_addr_hist.get(tx_hash, ())
+                             if self.is_mine(addr)]
+                if not addresses:
+                    self._history_cache.remove(tx_hash)
+                    continue
+                delta = 0
+                for addr in addresses:
+                    addr_delta = self.get_tx_delta(tx_hash, addr)
+                    if addr_delta is None:
+                        delta = None
+                        break
+                    delta += addr_delta
+                self._history_cache.set(tx_hash, self.get_txpos(tx_hash), delta)
+
+    def _update_addr_utxos(self, address):
+        '''Recompute the unspent coins of one address.  This must be called whenever the
+        history of the address changes, or a transaction touching it is added or removed.'''
+        self._invalidate_balances([address])
+        received, sent = self.get_addr_io(address)
+        for txo in sent:
+            received.pop(txo, None)
+            # cleanup/detect if the 'frozen coin' was spent and
+            # remove it from the frozen coin set
+            self.frozen_coins.discard(txo)
+        if received:
+            coins = {}
+            for txo, (tx_height, value, is_cb) in received.items():
+                prevout_hash, prevout_n = txo.split(':')
+                coins[txo] = (prevout_hash, int(prevout_n), tx_height, value, is_cb)
+            self._addr_utxos[address] = coins
+        else:
+            self._addr_utxos.pop(address, None)
 
     @profiler
     def check_history(self):
         save = False
-        my_addrs = [addr for addr in self._history if self.is_mine(addr)]
+        intern = self._addresses.intern
+        my_addrs = [intern(addr) for addr in self._history if self.is_mine(addr)]
 
         for addr in set(self._history) - set(my_addrs):
+            self._invalidate_history(tx_hash for tx_hash, height in self._history[addr])
             self._history.pop(addr)
+            self._unsaved_addrs.add(addr)
+            self._addr_utxos.pop(addr, None)
+            self._invalidate_balances([addr])
             save = True
 
         for addr in my_addrs:
             hist = self._history[addr]
 
             for tx_hash, tx_height in hist:
-                if (tx_hash in self.pruned_txo.values() or
+                if (tx_hash in self._pruned_spends or
                         self.txi.get(tx_hash) or
                         self.txo.get(tx_hash)):
                     continue
@@ -362,8 +753,8 @@ class Abstract_Wallet:
         d = self.storage.get('addresses', {})
         if not isinstance(d, dict):
             d = {}
-        self.receiving_addresses = Address.from_strings(d.get('receiving', []))
-        self.change_addresses = Address.from_strings(d.get('change', []))
+        self.receiving_addresses = self._addresses.from_strings(d.get('receiving', []))
+        self.change_addresses = self._addresses.from_strings(d.get('change', []))
 
     def synchronize(self):
         pass
@@ -405,22 +796,28 @@ class Abstract_Wallet:
 
         return changed
 
+    def build_address_index(self):
+        '''Build the map of the wallet's addresses to their (is_change, index) pairs that
+        is_mine, is_change and get_address_index use.  Subclasses that add or remove
+        addresses keep it up to date.'''
+        self._addr_index = {}
+        for is_change, addresses in ((False, self.get_receiving_addresses()),
+                                     (True, self.get_change_addresses())):
+            for n, address in enumerate(addresses):
+                self._addr_index[address] = (is_change, n)
+
     def is_mine(self, address):
         assert not isinstance(address, str)
-        return address in self.get_addresses()
+        return address in self._addr_index
 
     def is_change(self, address):
         assert not isinstance(address, str)
-        return address in self.change_addresses
+        return self._addr_index.get(address, (False, None))[0]
 
     def get_address_index(self, address):
         try:
-            return False, self.receiving_addresses.index(address)
-        except ValueError:
-            pass
-        try:
-            return True, self.change_addresses.index(address)
-        except ValueError:
+            return self._addr_index[address]
+        except KeyError:
             pass
         assert not isinstance(address, str)
         raise Exception("Address {} not found".format(address))
@@ -438,20 +835,25 @@ class Abstract_Wallet:
         return self.get_pubkeys(*sequence)
 
     def add_unverified_tx(self, tx_hash, tx_height):
-        if tx_height == 0 and tx_hash in self.verified_tx:
-            self.verified_tx.pop(tx_hash)
-            if self.verifier:
-                self.verifier.merkle_roots.pop(tx_hash, None)
-
-        # tx will be verified only if height > 0
-        if tx_hash not in self.verified_tx:
-            self.unverified_tx[tx_hash] = tx_height
+        with self.lock:
+            if tx_height == 0 and tx_hash in self.verified_tx:
+                self.verified_tx.pop(tx_hash)
+                if self.verifier:
+                    self.verifier.merkle_roots.pop(tx_hash, None)
+
+            # tx will be verified only if height > 0
+            if tx_hash not in self.verified_tx:
+                self.unverified_tx[tx_hash] = tx_height
+                if self.verifier:
+                    self.verifier.add(tx_hash)
+            self._invalidate_history([tx_hash])
 
     def add_verified_tx(self, tx_hash, info):
         # Remove from the unverified map and add to the verified map and
         self.unverified_tx.pop(tx_hash, None)
         with self.lock:
             self.verified_tx[tx_hash] = info  # (tx_height, timestamp, pos)
+            self._invalidate_history([tx_hash])
         height, conf, timestamp = self.get_tx_height(tx_hash)
         self.network.trigger_callback('verified', tx_hash, height, conf, timestamp)
 
@@ -471,6 +873,7 @@ class Abstract_Wallet:
                     if not header or header.get('timestamp') != timestamp:
                         self.verified_tx.pop(tx_hash, None)
                         txs.add(tx_hash)
+            self._invalidate_history(txs)
         return txs
 
     def get_local_height(self):
@@ -512,7 +915,7 @@ class Abstract_Wallet:
         "effect of tx on address"
         assert isinstance(address, Address)
         # pruned
-        if tx_hash in self.pruned_txo.values():
+        if tx_hash in self._pruned_spends:
             return None
         delta = 0
         # substract the value of coins sent from address
@@ -527,7 +930,7 @@ class Abstract_Wallet:
 
     def get_wallet_delta(self, tx):
         """ effect of tx on wallet """
-        addresses = self.get_addresses()
+        addresses = self._addr_index
         is_relevant = False
         is_mine = False
         is_pruned = False
@@ -636,29 +1039,22 @@ class Abstract_Wallet:
                 sent[txi] = height
         return received, sent
 
+    def _make_utxo(self, address, txo, coin):
+        prevout_hash, prevout_n, tx_height, value, is_cb = coin
+        return {
+            'address':address,
+            'value':value,
+            'prevout_n':prevout_n,
+            'prevout_hash':prevout_hash,
+            'height':tx_height,
+            'coinbase':is_cb,
+            'is_frozen_coin':txo in self.frozen_coins
+        }
+
     def get_addr_utxo(self, address):
-        coins, spent = self.get_addr_io(address)
-        for txi in spent:
-            coins.pop(txi)
-            if txi in self.frozen_coins:
-                # cleanup/detect if the 'frozen coin' was spent and
-                # remove it from the frozen coin set
-                self.frozen_coins.remove(txi)
-        out = {}
-        for txo, v in coins.items():
-            tx_height, value, is_cb = v
-            prevout_hash, prevout_n = txo.split(':')
-            x = {
-                'address':address,
-                'value':value,
-                'prevout_n':int(prevout_n),
-                'prevout_hash':prevout_hash,
-                'height':tx_height,
-                'coinbase':is_cb,
-                'is_frozen_coin':txo in self.frozen_coins
-            }
-            out[txo] = x
-        return out
+        with self.transaction_lock:
+            coins = list(self._addr_utxos.get(address, {}).items())
+        return {txo: self._make_utxo(address, txo, coin) for txo, coin in coins}
 
     # return the total amount ever received by an address
     def get_addr_received(self, address):
@@ -670,23 +1066,40 @@ class Abstract_Wallet:
     # only checks for coin-level freezing, not address-level.
     def get_addr_balance(self, address, exclude_frozen_coins = False):
         assert isinstance(address, Address)
-        received, sent = self.get_addr_io(address)
-        c = u = x = 0
-        for txo, (tx_height, v, is_cb) in received.items():
-            if exclude_frozen_coins and txo in self.frozen_coins:
-                continue
-            if is_cb and tx_height + COINBASE_MATURITY > self.get_local_height():
-                x += v
-            elif tx_height > 0:
-                c += v
-            else:
-                u += v
-            if txo in sent:
-                if sent[txo] > 0:
-                    c -= v
+        balance, height = self._get_addr_balance_entry(address, exclude_frozen_coins,
+                                                       self.get_local_height())
+        return balance
+
+    def _get_addr_balance_entry(self, address, exclude_frozen_coins, local_height):
+        '''Return a (balance, height) cache entry for the address, computing it if it is
+        missing or was computed at a different height than one it depends on.'''
+        with self.transaction_lock:
+            entries = self._addr_balances.setdefault(address, {})
+            entry = entries.get(exclude_frozen_coins)
+            if entry is not None and entry[1] in (None, local_height):
+                return entry
+            received, sent = self.get_addr_io(address)
+            c = u = x = 0
+            height_dependent = False
+            for txo, (tx_height, v, is_cb) in received.items():
+                if exclude_frozen_coins and txo in self.frozen_coins:
+                    continue
+                if is_cb:
+                    height_dependent = True
+                if is_cb and tx_height + COINBASE_MATURITY > local_height:
+                    x += v
+                elif tx_height > 0:
+                    c += v
                 else:
-                    u -= v
-        return c, u, x
+                    u += v
+                if txo in sent:
+                    if sent[txo] > 0:
+                        c -= v
+                    else:
+                        u -= v
+            entry = ((c, u, x), local_height if height_dependent else None)
+            entries[exclude_frozen_coins] = entry
+            return entry
 
     def get_spendable_coins(self, domain, config, isInvoice = False):
         confirmed_only = config.get('confirmed_only', False)
@@ -698,22 +1111,26 @@ class Abstract_Wallet:
     def get_utxos(self, domain=None, exclude_frozen=False, mature=False, confirmed_only=False):
         '''Note exclude_frozen=True checks for BOTH address-level and coin-level frozen status. '''
         coins = []
-        if domain is None:
-            domain = self.get_addresses()
-        if exclude_frozen:
-            domain = set(domain) - self.frozen_addresses
-        for addr in domain:
-            utxos = self.get_addr_utxo(addr)
-            for x in utxos.values():
-                if exclude_frozen and x['is_frozen_coin']:
+        with self.transaction_lock:
+            # Only addresses holding coins are in the index, so the default domain
+            # costs nothing for the (usually many) empty addresses.
+            if domain is None:
+                domain = list(self._addr_utxos)
+            if exclude_frozen:
+                domain = set(domain) - self.frozen_addresses
+            addr_coins = [(addr, list(self._addr_utxos[addr].items()))
+                          for addr in domain if addr in self._addr_utxos]
+        local_height = self.get_local_height() if mature else 0
+        for addr, items in addr_coins:
+            for txo, coin in items:
+                prevout_hash, prevout_n, tx_height, value, is_cb = coin
+                if exclude_frozen and txo in self.frozen_coins:
                     continue
-                if confirmed_only and x['height'] <= 0:
+                if confirmed_only and tx_height <= 0:
                     continue
-                if (mature and x['coinbase'] and
-                        x['height'] + COINBASE_MATURITY > self.get_local_height()):
+                if mature and is_cb and tx_height + COINBASE_MATURITY > local_height:
                     continue
-                coins.append(x)
-                continue
+                coins.append(self._make_utxo(addr, txo, coin))
         return coins
 
     def dummy_address(self):
@@ -735,16 +1152,31 @@ class Abstract_Wallet:
         return (cc_all-cc_no_f), (uu_all-uu_no_f), (xx_all-xx_no_f)
 
     def get_balance(self, domain=None, exclude_frozen_coins=False, exclude_frozen_addresses=False):
+        local_height = self.get_local_height()
+        key = None
         if domain is None:
+            # The wallet-wide totals are cached until any address balance changes
+            key = (exclude_frozen_coins, exclude_frozen_addresses)
+            with self.transaction_lock:
+                entry = self._wallet_balances.get(key)
+            if entry is not None and entry[1] in (None, local_height):
+                return entry[0]
             domain = self.get_addresses()
         if exclude_frozen_addresses:
             domain = set(domain) - self.frozen_addresses
         cc = uu = xx = 0
-        for addr in domain:
-            c, u, x = self.get_addr_balance(addr, exclude_frozen_coins)
-            cc += c
-            uu += u
-            xx += x
+        height = None
+        with self.transaction_lock:
+            for addr in domain:
+                (c, u, x), addr_height = self._get_addr_balance_entry(
+                    addr, exclude_frozen_coins, local_height)
+                cc += c
+                uu += u
+                xx += x
+                if addr_height is not None:
+                    height = addr_height
+            if key is not None:
+                self._wallet_balances[key] = ((cc, uu, xx), height)
         return cc, uu, xx
 
     def get_address_history(self, address):
@@ -754,7 +1186,13 @@ class Abstract_Wallet:
     def add_transaction(self, tx_hash, tx):
         is_coinbase = tx.inputs()[0]['type'] == 'coinbase'
         with self.transaction_lock:
+            # addresses whose coins have to be refreshed in the utxo index
+            touched = set()
+            # transactions whose history rows have to be recomputed
+            changed = {tx_hash}
             # add inputs
+            if tx_hash in self.txi:
+                self._remove_txi_spends(tx_hash, self.txi[tx_hash])
             self.txi[tx_hash] = d = {}
             for txi in tx.inputs():
                 addr = txi.get('address')
@@ -764,15 +1202,18 @@ class Abstract_Wallet:
                     ser = prevout_hash + ':%d'%prevout_n
                 # find value from prev output
                 if self.is_mine(addr):
+                    addr = self._addresses.intern(addr)
                     dd = self.txo.get(prevout_hash, {})
                     for n, v, is_cb in dd.get(addr, []):
                         if n == prevout_n:
                             if d.get(addr) is None:
                                 d[addr] = []
                             d[addr].append((ser, v))
+                            self._add_txi_spend(ser, tx_hash, addr)
+                            touched.add(addr)
                             break
                     else:
-                        self.pruned_txo[ser] = tx_hash
+                        self._add_pruned_txo(ser, tx_hash)
 
             # add outputs
             self.txo[tx_hash] = d = {}
@@ -780,54 +1221,70 @@ class Abstract_Wallet:
                 ser = tx_hash + ':%d'%n
                 _type, addr, v = txo
                 if self.is_mine(addr):
+                    addr = self._addresses.intern(addr)
                     if not addr in d:
                         d[addr] = []
                     d[addr].append((n, v, is_coinbase))
+                    touched.add(addr)
                 # give v to txi that spends me
                 next_tx = self.pruned_txo.get(ser)
                 if next_tx is not None:
-                    self.pruned_txo.pop(ser)
+                    addr = self._addresses.intern(addr)
+                    self._pop_pruned_txo(ser)
+                    changed.add(next_tx)
                     dd = self.txi.get(next_tx, {})
                     if dd.get(addr) is None:
                         dd[addr] = []
                     dd[addr].append((ser, v))
+                    if next_tx in self.txi:
+                        self._add_txi_spend(ser, next_tx, addr)
+                    touched.add(addr)
             # save
             self.transactions[tx_hash] = tx
+            self._unsaved_txs.update(changed)
+            for addr in touched:
+                self._update_addr_utxos(addr)
+            self._invalidate_history(changed)
 
     def remove_transaction(self, tx_hash):
         with self.transaction_lock:
             self.logger.debug("removing tx from history %s", tx_hash)
             #tx = self.transactions.pop(tx_hash)
-            for ser, hh in list(self.pruned_txo.items()):
-                if hh == tx_hash:
-                    self.pruned_txo.pop(ser)
+            touched = set(self.txi.get(tx_hash, {})) | set(self.txo.get(tx_hash, {}))
+            for ser in list(self._pruned_spends.get(tx_hash, ())):
+                self._pop_pruned_txo(ser)
             # add tx to pruned_txo, and undo the txi addition
-            for next_tx, dd in self.txi.items():
-                for addr, l in list(dd.items()):
-                    ll = l[:]
-                    for item in ll:
-                        ser, v = item
-                        prev_hash, prev_n = ser.split(':')
-                        if prev_hash == tx_hash:
-                            l.remove(item)
-                            self.pruned_txo[ser] = next_tx
-                    if l == []:
-                        dd.pop(addr)
-                    else:
-                        dd[addr] = l
+            changed = {tx_hash}
+            for ser, next_tx, addr in self._txi_spends.pop(tx_hash, ()):
+                changed.add(next_tx)
+                dd = self.txi[next_tx]
+                l = [item for item in dd.get(addr, []) if item[0] != ser]
+                self._add_pruned_txo(ser, next_tx)
+                touched.add(addr)
+                if l == []:
+                    dd.pop(addr, None)
+                else:
+                    dd[addr] = l
             try:
-                self.txi.pop(tx_hash)
+                self._remove_txi_spends(tx_hash, self.txi.pop(tx_hash))
                 self.txo.pop(tx_hash)
             except KeyError:
                 self.logger.error("tx was not in history %s", tx_hash)
+            self._unsaved_txs.update(changed)
+            for addr in touched:
+                self._update_addr_utxos(addr)
+            self._invalidate_history(changed)
 
     def receive_tx_callback(self, tx_hash, tx, tx_height):
         self.add_transaction(tx_hash, tx)
         self.add_unverified_tx(tx_hash, tx_height)
 
     def receive_history_callback(self, addr, hist, tx_fees):
+        addr = self._addresses.intern(addr)
         with self.lock:
             old_hist = self.get_address_history(addr)
+            self._invalidate_history(tx_hash for tx_hash, height in old_hist)
+            self._invalidate_history(tx_hash for tx_hash, height in hist)
             for tx_hash, height in old_hist:
                 if (tx_hash, height) not in hist:
                     # remove tx if it's not referenced in histories
@@ -835,6 +1292,10 @@ class Abstract_Wallet:
                     if not self.tx_addr_hist[tx_hash]:
                         self.remove_transaction(tx_hash)
             self._history[addr] = hist
+            # coin heights are taken from the address history
+            with self.transaction_lock:
+                self._unsaved_addrs.add(addr)
+                self._update_addr_utxos(addr)
 
         for tx_hash, tx_height in hist:
             # add it in case it was previously unconfirmed
@@ -851,15 +1312,59 @@ class Abstract_Wallet:
                 self.add_transaction(tx_hash, tx)
 
         # Store fees
-        self.tx_fees.update(tx_fees)
+        with self.transaction_lock:
+            self.tx_fees.update(tx_fees)
+            self._unsaved_txs.update(tx_fees)
 
         if self.network:
             self.network.trigger_callback('on_history')
 
-    def get_history(self, domain=None):
-        # get domain
-        if domain is None:
-            domain = self.get_addresses()
+    def get_history(self, domain=None, offset=0, limit=None, from_height=None,
+                    to_height=None):
+        '''Return the history as (tx_hash, height, conf, timestamp, delta, balance)
+        rows, oldest first.  If from_height or to_height is given only confirmed rows
+        with from_height <= height < to_height are returned; unconfirmed rows follow
+        the confirmed ones and are kept when to_height is None.  offset and limit then
+        select a page of those rows.
+
+        The history of the whole wallet is kept up to date incrementally, so a page
+        of it costs little more than the rows returned.'''
+        if domain is not None:
+            rows = self._get_domain_history(domain)
+            if from_height is not None or to_height is not None:
+                rows = [row for row in rows
+                        if (0 < row[1] and (from_height is None or row[1] >= from_height)
+                            and (to_height is None or row[1] < to_height))
+                        or (row[1] <= 0 and to_height is None)]
+            stop = None if limit is None else offset + limit
+            return rows[offset:stop]
+
+        with self.lock:
+            self._update_history_cache()
+            cache = self._history_cache
+            start = 0 if from_height is None else cache.index_of_height(from_height)
+            stop = len(cache) if to_height is None else cache.index_of_height(to_height)
+            start = min(start + offset, stop)
+            if limit is not None:
+                stop = min(stop, start + limit)
+            return self._history_rows(cache, sum(self.get_balance()), start, stop)
+
+    def _history_rows(self, cache, wallet_balance, start, stop):
+        '''The get_history rows for the rows start to stop - 1 of cache, an up to date
+        history cache or a snapshot of one, given the wallet balance it ends with.'''
+        final_total, final_unknowns = cache.final_totals()
+        h2 = []
+        for tx_hash, delta, total, unknowns in cache.rows(start, stop):
+            height, conf, timestamp = self.get_tx_height(tx_hash)
+            # A balance is only known if the deltas after it are all known
+            if unknowns == final_unknowns:
+                balance = wallet_balance - (final_total - total)
+            else:
+                balance = None
+            h2.append((tx_hash, height, conf, timestamp, delta, balance))
+        return h2
+
+    def _get_domain_history(self, domain):
         # 1. Get the history of each address in the domain, maintain the
         #    delta of a tx as the sum of its deltas on domain addresses
         tx_deltas = defaultdict(int)
@@ -894,49 +1399,100 @@ class Abstract_Wallet:
 
         return h2
 
+    # Rows of history read and exported at a time
+    export_page_size = 1000
+
     def export_history(self, domain=None, from_timestamp=None, to_timestamp=None,
                        fx=None, show_addresses=False):
-        h = self.get_history(domain)
-        out = []
-        for tx_hash, height, conf, timestamp, value, balance in h:
-            if from_timestamp and timestamp < from_timestamp:
-                continue
-            if to_timestamp and timestamp >= to_timestamp:
-                continue
-            item = {
-                'txid':tx_hash,
-                'height':height,
-                'confirmations':conf,
-                'timestamp':timestamp,
-                'value': format_satoshis(value, is_diff=True) if value is not None else '--',
-                'balance': format_satoshis(balance)
-            }
-            if item['height']>0:
-                date_str = format_time(timestamp) if timestamp is not None else _("unverified")
-            else:
-                date_str = _("unconfirmed")
-            item['date'] = date_str
-            item['label'] = self.get_label(tx_hash)
-            if show_addresses:
-                tx = self.transactions.get(tx_hash)
-                tx.deserialize()
-                input_addresses = []
-                output_addresses = []
-                for x in tx.inputs():
-                    if x['type'] == 'coinbase': continue
-                    addr = x.get('address')
-                    if addr is None: continue
-                    input_addresses.append(addr.to_ui_string())
-                for addr, v in tx.get_outputs():
-                    output_addresses.append(addr.to_ui_string())
-                item['input_addresses'] = input_addresses
-                item['output_addresses'] = output_addresses
+        return list(self.iter_export_history(domain, from_timestamp, to_timestamp, fx,
+                                             show_addresses))
+
+    def iter_export_history(self, domain=None, from_timestamp=None, to_timestamp=None,
+                            fx=None, show_addresses=False):
+        '''Yield the export_history items in history order.  The history is read a page
+        at a time and the fiat rates of a page are looked up together, so memory use
+        does not grow with the size of the history.  The pages are read from a snapshot
+        of the history taken at the start, so changes to the history while it is
+        exported do not mix rows and balances from different histories.'''
+        for page in self._iter_history_pages(domain):
+            rows = [row for row in page
+                    if not (from_timestamp and row[3] < from_timestamp)
+                    and not (to_timestamp and row[3] >= to_timestamp)]
             if fx is not None:
-                date = timestamp_to_datetime(time.time() if conf <= 0 else timestamp)
-                item['fiat_value'] = fx.historical_value_str(value, date)
-                item['fiat_balance'] = fx.historical_value_str(balance, date)
-            out.append(item)
-        return out
+                now = time.time()
+                dates = [timestamp_to_datetime(now if conf <= 0 else timestamp)
+                         for tx_hash, height, conf, timestamp, value, balance in rows]
+                rates = fx.history_rates(dates)
+            for n, (tx_hash, height, conf, timestamp, value, balance) in enumerate(rows):
+                item = {
+                    'txid':tx_hash,
+                    'height':height,
+                    'confirmations':conf,
+                    'timestamp':timestamp,
+                    'value': format_satoshis(value, is_diff=True) if value is not None else '--',
+                    'balance': format_satoshis(balance)
+                }
+                if item['height']>0:
+                    date_str = format_time(timestamp) if timestamp is not None else _("unverified")
+                else:
+                    date_str = _("unconfirmed")
+                item['date'] = date_str
+                item['label'] = self.get_label(tx_hash)
+                if show_addresses:
+                    tx = self.transactions.get(tx_hash)
+                    tx.deserialize()
+                    input_addresses = []
+                    output_addresses = []
+                    for x in tx.inputs():
+                        if x['type'] == 'coinbase': continue
+                        addr = x.get('address')
+                        if addr is None: continue
+                        input_addresses.append(addr.to_ui_string())
+                    for addr, v in tx.get_outputs():
+                        output_addresses.append(addr.to_ui_string())
+                    item['input_addresses'] = input_addresses
+                    item['output_addresses'] = output_addresses
+                if fx is not None:
+                    rate = rates[dates[n].date()]
+                    item['fiat_value'] = fx.value_str(value, rate)
+                    item['fiat_balance'] = fx.value_str(balance, rate)
+                yield item
+
+    def _iter_history_pages(self, domain):
+        size = self.export_page_size
+        if domain is not None:
+            # A domain's history is computed whole, so only do it once
+            history = self.get_history(domain)
+            for offset in range(0, len(history), size):
+                yield history[offset:offset + size]
+            return
+        with self.lock:
+            self._update_history_cache()
+            cache = self._history_cache.snapshot()
+            wallet_balance = sum(self.get_balance())
+        for start in range(0, len(cache), size):
+            yield self._history_rows(cache, wallet_balance, start,
+                                     min(len(cache), start + size))
+
+    def write_export_history(self, f, is_csv, **kwargs):
+        '''Write the exported history to the text file f as CSV or JSON, one item at a
+        time.  The keyword arguments are those of iter_export_history.'''
+        items = self.iter_export_history(**kwargs)
+        if is_csv:
+            writer = csv.writer(f, lineterminator='\n')
+            writer.writerow(["transaction_hash", "label", "confirmations",
+                             "value", "timestamp"])
+            for item in items:
+                writer.writerow([item['txid'], item.get('label', ''),
+                                 item['confirmations'], item['value'], item['date']])
+        else:
+            # The same text as json.dumps(list(items), indent=4)
+            separator = '[\n'
+            for item in items:
+                f.write(separator)
+                f.write(textwrap.indent(json.dumps(item, indent=4), '    '))
+                separator = ',\n'
+            f.write('[]' if separator == '[\n' else '\n]')
 
     def get_label(self, tx_hash):
         label = self.labels.get(tx_hash, '')
@@ -957,12 +1513,11 @@ class Abstract_Wallet:
 
     def get_tx_status(self, tx_hash, height, conf, timestamp):
         if conf == 0:
-            tx = self.transactions.get(tx_hash)
-            if not tx:
+            if tx_hash not in self.transactions:
                 return 3, 'unknown'
             fee = self.tx_fees.get(tx_hash)
             if fee and self.network and self.network.config.has_fee_estimates():
-                size = len(tx.raw)/2
+                size = self.transactions.raw_size(tx_hash)
                 low_fee = int(self.network.config.dynfee(0)*size/1000)
                 is_lowfee = fee < low_fee * 0.5
             else:
@@ -1034,7 +1589,7 @@ class Abstract_Wallet:
         if i_max is None:
             # Let the coin chooser select the coins to spend
             max_change = self.max_change_outputs if self.multiple_change else 1
-            coin_chooser = coinchooser.CoinChooserPrivacy()
+            coin_chooser = coinchooser.get_coin_chooser(config)
             tx = coin_chooser.make_tx(inputs, outputs, change_addrs[:max_change],
                                       fee_estimator, self.dust_threshold())
         else:
@@ -1068,7 +1623,7 @@ class Abstract_Wallet:
     def mktx(self, outputs, password, config, fee=None, change_addr=None, domain=None):
         coins = self.get_spendable_coins(domain, config)
         tx = self.make_unsigned_transaction(coins, outputs, config, fee, change_addr)
-        self.sign_transaction(tx, password)
+        self.sign_transaction(tx, password, processes=config.get('sign_processes'))
         return tx
 
     def is_frozen(self, addr):
@@ -1101,6 +1656,8 @@ class Abstract_Wallet:
                 self.frozen_addresses |= set(addrs)
             else:
                 self.frozen_addresses -= set(addrs)
+            # address-level freezing only affects the wallet-wide totals
+            self._invalidate_balances([])
             frozen_addresses = [addr.to_storage_string()
                                 for addr in self.frozen_addresses]
             self.storage.put('frozen_addresses', frozen_addresses)
@@ -1116,12 +1673,17 @@ class Abstract_Wallet:
         to be defined as spendable.
         '''
         ok = 0
+        touched = set()
         for utxo in utxos:
             if isinstance(utxo, str):
                 if freeze:
                     self.frozen_coins |= { utxo }
                 else:
                     self.frozen_coins -= { utxo }
+                prevout_hash, prevout_n = utxo.split(':')
+                for addr, l in self.txo.get(prevout_hash, {}).items():
+                    if any(n == int(prevout_n) for n, v, is_cb in l):
+                        touched.add(addr)
                 ok += 1
             elif isinstance(utxo, dict) and self.is_mine(utxo['address']):
                 txo = "{}:{}".format(utxo['prevout_hash'], utxo['prevout_n'])
@@ -1130,7 +1692,9 @@ class Abstract_Wallet:
                 else:
                     self.frozen_coins -= { txo }
                 utxo['is_frozen_coin'] = bool(freeze)
+                touched.add(utxo['address'])
                 ok += 1
+        self._invalidate_balances(touched)
         if ok:
             self.storage.put('frozen_coins', list(self.frozen_coins))
         return ok
@@ -1148,7 +1712,9 @@ class Abstract_Wallet:
         for tx_hash in list(self.transactions):
             if tx_hash not in vr:
                 self.logger.debug("removing transaction %s", tx_hash)
-                self.transactions.pop(tx_hash)
+                with self.transaction_lock:
+                    self.transactions.pop(tx_hash)
+                    self._unsaved_txs.add(tx_hash)
 
     def start_threads(self, network):
         self.network = network
@@ -1244,9 +1810,13 @@ class Abstract_Wallet:
         if self.is_mine(address):
             txin['type'] = self.get_txin_type(address)
             # Bitcoin SV needs value to sign
-            received, spent = self.get_addr_io(address)
-            item = received.get(txin['prevout_hash']+':%d'%txin['prevout_n'])
-            tx_height, value, is_cb = item
+            txo = txin['prevout_hash'] + ':%d' % txin['prevout_n']
+            coin = self._addr_utxos.get(address, {}).get(txo)
+            if coin is not None:
+                value = coin[3]
+            else:
+                received, spent = self.get_addr_io(address)
+                tx_height, value, is_cb = received[txo]
             txin['value'] = value
             self.add_input_sig_info(txin, address)
 
@@ -1311,7 +1881,7 @@ class Abstract_Wallet:
                               else None)
         tx.output_info = info
 
-    def sign_transaction(self, tx, password):
+    def sign_transaction(self, tx, password, processes=None):
         if self.is_watching_only():
             return
         # add input values for signing
@@ -1323,7 +1893,12 @@ class Abstract_Wallet:
         # sign
         for k in self.get_keystores():
             try:
-                if k.can_sign(tx):
+                if not k.can_sign(tx):
+                    continue
+                # Only software keystores can spread the signing over processes
+                if isinstance(k, Software_KeyStore):
+                    k.sign_transaction(tx, password, processes=processes)
+                else:
                     k.sign_transaction(tx, password)
             except UserCancelled:
                 continue
@@ -1538,8 +2113,11 @@ class Abstract_Wallet:
 
     def add_address(self, address):
         assert isinstance(address, Address)
+        address = self._addresses.intern(address)
         if address not in self._history:
             self._history[address] = []
+            with self.transaction_lock:
+                self._unsaved_addrs.add(address)
         if self.synchronizer:
             self.synchronizer.add(address)
 
@@ -1607,6 +2185,10 @@ class ImportedWalletBase(Simple_Wallet):
     def is_change(self, address):
         return False
 
+    def build_address_index(self):
+        # Imported addresses have no derivation index
+        self._addr_index = {address: (False, None) for address in self.get_addresses()}
+
     def get_master_public_keys(self):
         return []
 
@@ -1634,11 +2216,17 @@ class ImportedWalletBase(Simple_Wallet):
                 if addr == address:
                     for tx_hash, height in details:
                         transactions_to_remove.add(tx_hash)
+                        self.tx_addr_hist.get(tx_hash, set()).discard(address)
+                    self._invalidate_history(tx_hash for tx_hash, height in details)
                 else:
                     for tx_hash, height in details:
                         transactions_new.add(tx_hash)
             transactions_to_remove -= transactions_new
             self._history.pop(address, None)
+            with self.transaction_lock:
+                self._unsaved_addrs.add(address)
+            self._addr_utxos.pop(address, None)
+            self._invalidate_balances([address])
 
             for tx_hash in transactions_to_remove:
                 self.remove_transaction(tx_hash)
@@ -1657,6 +2245,7 @@ class ImportedWalletBase(Simple_Wallet):
         self.set_frozen_state([address], False)
 
         self.delete_address_derived(address)
+        self._addr_index.pop(address, None)
         self.save_addresses()
 
 
@@ -1693,7 +2282,7 @@ class ImportedAddressWallet(ImportedWalletBase):
 
     def load_addresses(self):
         addresses = self.storage.get('addresses', [])
-        self.addresses = [Address.from_string(addr) for addr in addresses]
+        self.addresses = self._addresses.from_strings(addresses)
 
     def save_addresses(self):
         self.storage.put('addresses', [addr.to_storage_string()
@@ -1716,7 +2305,9 @@ class ImportedAddressWallet(ImportedWalletBase):
         assert isinstance(address, Address)
         if address in self.addresses:
             return False
+        address = self._addresses.intern(address)
         self.addresses.append(address)
+        self._addr_index[address] = (False, None)
         self.save_addresses()
         self.storage.write()
         self.add_address(address)
@@ -1794,6 +2385,7 @@ class ImportedPrivkeyWallet(ImportedWalletBase):
 
     def import_private_key(self, sec, pw):
         pubkey = self.keystore.import_privkey(sec, pw)
+        self._addr_index[pubkey.address] = (False, None)
         self.save_keystore()
         self.storage.write()
         return pubkey.address.to_ui_string()
@@ -1842,12 +2434,15 @@ class Deterministic_Wallet(Abstract_Wallet):
         if value >= self.gap_limit:
             self.gap_limit = value
             self.storage.put('gap_limit', self.gap_limit)
+            if self.synchronizer:
+                self.synchronizer.wake()
             return True
         elif value >= self.min_acceptable_gap():
             addresses = self.get_receiving_addresses()
             k = self.num_unused_trailing_addresses(addresses)
             n = len(addresses) - k + value
             self.receiving_addresses = self.receiving_addresses[0:n]
+            self.build_address_index()
             self.gap_limit = value
             self.storage.put('gap_limit', self.gap_limit)
             self.save_addresses()
@@ -1878,29 +2473,35 @@ class Deterministic_Wallet(Abstract_Wallet):
         return nmax + 1
 
     def create_new_address(self, for_change=False):
+        return self.create_new_addresses(for_change, 1)[0]
+
+    def create_new_addresses(self, for_change, count):
         assert type(for_change) is bool
         with self.lock:
             addr_list = self.change_addresses if for_change else self.receiving_addresses
             n = len(addr_list)
-            x = self.derive_pubkeys(for_change, n)
-            address = self.pubkeys_to_address(x)
-            addr_list.append(address)
+            new_addresses = [self._addresses.intern(self.pubkeys_to_address(x))
+                             for x in self.derive_pubkeys_range(for_change, n, count)]
+            addr_list.extend(new_addresses)
+            for i, address in enumerate(new_addresses):
+                self._addr_index[address] = (for_change, n + i)
             self.save_addresses()
-            self.add_address(address)
-            return address
+            for address in new_addresses:
+                self.add_address(address)
+            return new_addresses
 
     def synchronize_sequence(self, for_change):
         limit = self.gap_limit_for_change if for_change else self.gap_limit
-        while True:
-            addresses = (self.get_change_addresses() if for_change
-                         else self.get_receiving_addresses())
-            if len(addresses) < limit:
-                self.create_new_address(for_change)
-                continue
-            if [self.address_is_old(x) for x in addresses[-limit:]] == limit*[False]:
+        addresses = (self.get_change_addresses() if for_change
+                     else self.get_receiving_addresses())
+        # Top up so the last limit addresses are unused, in one batch
+        unused = 0
+        for address in reversed(addresses[-limit:]):
+            if self.address_is_old(address):
                 break
-            else:
-                self.create_new_address(for_change)
+            unused += 1
+        if unused < limit:
+            self.create_new_addresses(for_change, limit - unused)
 
     def synchronize(self):
         with self.lock:
@@ -1971,6 +2572,9 @@ class Simple_Deterministic_Wallet(Simple_Wallet, Deterministic_Wallet):
     def derive_pubkeys(self, c, i):
         return self.keystore.derive_pubkey(c, i)
 
+    def derive_pubkeys_range(self, c, start, count):
+        return self.keystore.derive_pubkeys_range(c, start, count)
+
 
 
 
@@ -2006,6 +2610,10 @@ class Multisig_Wallet(Deterministic_Wallet):
     def derive_pubkeys(self, c, i):
         return [k.derive_pubkey(c, i) for k in self.get_keystores()]
 
+    def derive_pubkeys_range(self, c, start, count):
+        return [list(pubkeys) for pubkeys in
+                zip(*(k.derive_pubkeys_range(c, start, count) for k in self.get_keystores()))]
+
     def load_keystore(self):
         self.keystores = {}
         for i in range(self.n):